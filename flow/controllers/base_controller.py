@@ -2,6 +2,8 @@
 
 import numpy as np
 
+import traci.constants as tc
+
 
 class BaseController:
     """Base class for flow-controlled acceleration behavior.
@@ -12,6 +14,11 @@ class BaseController:
     cause the system to crash.
     """
 
+    # sumo variables that must be subscribed to for vehicles using this
+    # controller, on top of the ones needed by the Vehicles class. The leader
+    # of the vehicle is needed by most car-following models and failsafes.
+    subscriptions = (tc.VAR_LEADER, )
+
     def __init__(self,
                  veh_id,
                  sumo_cf_params,
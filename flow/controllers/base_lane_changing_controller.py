@@ -8,6 +8,10 @@ class BaseLaneChangeController:
     lane_changing duration to the controller.
     """
 
+    # sumo variables that must be subscribed to for vehicles using this
+    # controller, on top of the ones needed by the Vehicles class
+    subscriptions = ()
+
     def __init__(self, veh_id, lane_change_params=None):
         """Instantiate the base class for lane-changing controllers.
 
@@ -1,5 +1,7 @@
 """Contains the base routing controller class."""
 
+import traci.constants as tc
+
 
 class BaseRouter:
     """Base class for routing controllers.
@@ -8,6 +10,11 @@ class BaseRouter:
     after initialization.
     """
 
+    # sumo variables that must be subscribed to for vehicles using this
+    # controller, on top of the ones needed by the Vehicles class. Routers
+    # typically compare the current edge with the vehicle's route.
+    subscriptions = (tc.VAR_EDGES, )
+
     def __init__(self, veh_id, router_params):
         """Instantiate the base class for routing controllers.
 
@@ -408,6 +408,9 @@ class SumoCarFollowingController(BaseController):
     available through sumo when initializing the parameters of the vehicle.
     """
 
+    # sumo computes the accelerations itself, so no extra data is needed
+    subscriptions = ()
+
     def __init__(self, veh_id, sumo_cf_params):
         """Instantiate a sumo controller.
 
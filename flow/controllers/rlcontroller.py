@@ -1,5 +1,7 @@
 """Contains the RLController class."""
 
+import traci.constants as tc
+
 from flow.controllers.base_controller import BaseController
 
 
@@ -20,6 +22,11 @@ class RLController(BaseController):
         >>> rl_ids = vehicles.get_rl_ids()
     """
 
+    # actions are provided by the environment, which specifies the data it
+    # needs through Env.vehicle_subscriptions. The leader is only needed by
+    # failsafes (see __init__)
+    subscriptions = ()
+
     def __init__(self, veh_id, sumo_cf_params, time_delay=0, fail_safe=None):
         """Instantiates an RL Controller.
 
@@ -37,3 +44,7 @@ class RLController(BaseController):
             sumo_cf_params,
             delay=time_delay,
             fail_safe=fail_safe)
+
+        # failsafes depend on the leader of the vehicle
+        if fail_safe is not None:
+            self.subscriptions = (tc.VAR_LEADER, )
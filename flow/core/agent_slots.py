@@ -0,0 +1,203 @@
+"""Contains the fixed-slot registry of rl vehicles."""
+
+import collections
+import heapq
+
+import numpy as np
+
+
+class AgentSlots:
+    """Registry mapping rl vehicles to fixed observation and action slots.
+
+    Environments with a variable number of rl vehicles (e.g. with inflows)
+    use fixed-size observation and action spaces, in which every controlled
+    vehicle is represented by a slot. This class assigns slots to vehicles as
+    they enter the network and frees them as they exit, so that a vehicle
+    keeps the same slot for as long as it is controlled. Vehicles entering
+    the network while all slots are in use are queued, and assigned the next
+    free slot in their order of arrival.
+
+    Slots may also be reserved for specific vehicles (see `reserve`), e.g.
+    for rl vehicles that are reintroduced in the network with the same name
+    after exiting.
+
+    Attributes
+    ----------
+    num_slots : int
+        number of slots
+    mask : np.ndarray
+        boolean array indicating which slots are currently in use
+    """
+
+    def __init__(self, num_slots):
+        """Instantiate an empty registry.
+
+        Parameters
+        ----------
+        num_slots : int
+            number of slots, i.e. maximum number of controlled vehicles
+        """
+        self.num_slots = num_slots
+        self.mask = np.zeros(num_slots, dtype=bool)
+        self._ids = [None] * num_slots
+        self._slot_of = dict()
+        self._reserved = dict()
+        self._free = list(range(num_slots))
+        self._queue = collections.OrderedDict()
+
+    def __len__(self):
+        """Return the number of vehicles currently assigned to a slot."""
+        return len(self._slot_of)
+
+    def __contains__(self, veh_id):
+        """Check whether a vehicle is currently assigned to a slot."""
+        return veh_id in self._slot_of
+
+    def reserve(self, veh_id, slot):
+        """Reserve a slot for a vehicle.
+
+        The slot is only used by this vehicle, whenever it is in the network.
+
+        Parameters
+        ----------
+        veh_id : str
+            name of the vehicle
+        slot : int
+            index of the slot
+        """
+        if slot in self._reserved.values() or slot not in self._free:
+            raise ValueError("Slot {} is not available.".format(slot))
+        self._free.remove(slot)
+        heapq.heapify(self._free)
+        self._reserved[veh_id] = slot
+
+    def add(self, veh_id):
+        """Assign a slot to a vehicle, or queue it if no slot is free."""
+        if veh_id in self._slot_of or veh_id in self._queue:
+            return
+        if veh_id in self._reserved:
+            self._assign(veh_id, self._reserved[veh_id])
+        elif len(self._free) > 0:
+            self._assign(veh_id, heapq.heappop(self._free))
+        else:
+            self._queue[veh_id] = None
+
+    def remove(self, veh_id):
+        """Free the slot of a vehicle (or remove it from the queue).
+
+        The freed slot is assigned to the first vehicle in the queue, if any.
+        """
+        if veh_id in self._queue:
+            del self._queue[veh_id]
+            return
+
+        slot = self._slot_of.pop(veh_id, None)
+        if slot is None:
+            return
+        self._ids[slot] = None
+        self.mask[slot] = False
+
+        if veh_id not in self._reserved:
+            if len(self._queue) > 0:
+                queued_id, _ = self._queue.popitem(last=False)
+                self._assign(queued_id, slot)
+            else:
+                heapq.heappush(self._free, slot)
+
+    def sync(self, veh_ids):
+        """Match the registry with the rl vehicles currently in the network.
+
+        Vehicles that are no longer in the network are removed, and new
+        vehicles are added in the given order.
+
+        Parameters
+        ----------
+        veh_ids : list of str
+            names of the rl vehicles in the network
+        """
+        present = set(veh_ids)
+        for veh_id in [veh_id for veh_id in self._queue
+                       if veh_id not in present]:
+            self.remove(veh_id)
+        for veh_id in [veh_id for veh_id in self._slot_of
+                       if veh_id not in present]:
+            self.remove(veh_id)
+        for veh_id in veh_ids:
+            if veh_id not in self._slot_of and veh_id not in self._queue:
+                self.add(veh_id)
+
+    def clear(self):
+        """Remove all vehicles, keeping the reservations of slots."""
+        for veh_id in list(self._queue) + list(self._slot_of):
+            self.remove(veh_id)
+
+    def _assign(self, veh_id, slot):
+        self._slot_of[veh_id] = slot
+        self._ids[slot] = veh_id
+        self.mask[slot] = True
+
+    def get_slot(self, veh_id):
+        """Return the slot of a vehicle, or None if it has no slot."""
+        return self._slot_of.get(veh_id)
+
+    def get_ids(self):
+        """Return the names of the vehicles with a slot, ordered by slot."""
+        return [veh_id for veh_id in self._ids if veh_id is not None]
+
+    def get_queued_ids(self):
+        """Return the names of the vehicles waiting for a slot."""
+        return list(self._queue)
+
+    def items(self):
+        """Return the (slot, name) pairs of all vehicles with a slot."""
+        return [(slot, veh_id) for slot, veh_id in enumerate(self._ids)
+                if veh_id is not None]
+
+    def pad(self, buffer, value=0):
+        """Fill the entries of unused slots in a buffer.
+
+        Parameters
+        ----------
+        buffer : np.ndarray
+            array whose first dimension is indexed by slot
+        value : float, optional
+            value assigned to the entries of unused slots
+
+        Returns
+        -------
+        np.ndarray
+            the buffer (modified in place)
+        """
+        buffer[~self.mask] = value
+        return buffer
+
+    def split_actions(self, actions, action_dim=1, veh_ids=None):
+        """Return the actions of the vehicles with a slot.
+
+        Parameters
+        ----------
+        actions : array_like
+            flat actions of all slots, `action_dim` consecutive elements per
+            slot
+        action_dim : int, optional
+            number of action elements per slot
+        veh_ids : list of str, optional
+            if specified, only the vehicles among these are returned, e.g.
+            the rl vehicles currently in the network (vehicles that exited
+            the network since the registry was last synchronized are skipped)
+
+        Returns
+        -------
+        list of str
+            names of the vehicles with a slot, ordered by slot
+        np.ndarray
+            actions of these vehicles, one row per vehicle
+        """
+        actions = np.asarray(actions).reshape(self.num_slots, action_dim)
+        mask = self.mask
+        if veh_ids is not None:
+            veh_ids = set(veh_ids)
+            mask = mask & np.array([veh_id in veh_ids for veh_id in self._ids],
+                                   dtype=bool)
+        return [self._ids[slot] for slot in np.flatnonzero(mask)], \
+            actions[mask]
@@ -0,0 +1,76 @@
+"""Contains the environment checkpoint class."""
+
+import pickle
+
+
+class Checkpoint:
+    """Saved state of an environment and of its sumo instance.
+
+    A checkpoint consists of the state file written by sumo (see
+    traci.simulation.saveState) and of the pickled state of the environment
+    (vehicles, traffic lights, controllers, counters, and environment-specific
+    attributes). Both are kept in memory as bytes, so that a checkpoint can be
+    restored any number of times, and into several environments built from
+    the same scenario (see Env.restore_checkpoint).
+
+    Attributes
+    ----------
+    sumo_state : bytes
+        content of the state file written by sumo
+    env_state : bytes
+        pickled dictionary of the attributes of the environment
+    time : float
+        simulation time at which the checkpoint was saved (in seconds)
+    """
+
+    def __init__(self, sumo_state, env_state, time):
+        """Instantiate a checkpoint.
+
+        Parameters
+        ----------
+        sumo_state : bytes
+            content of the state file written by sumo
+        env_state : dict
+            attributes of the environment, pickled upon instantiation so that
+            later changes to the environment do not alter the checkpoint
+        time : float
+            simulation time at which the checkpoint was saved (in seconds)
+        """
+        self.sumo_state = sumo_state
+        self.env_state = pickle.dumps(env_state, pickle.HIGHEST_PROTOCOL)
+        self.time = time
+
+    def get_env_state(self):
+        """Return a new copy of the attributes of the environment."""
+        return pickle.loads(self.env_state)
+
+    def save(self, path):
+        """Write the checkpoint to disk.
+
+        Parameters
+        ----------
+        path : str
+            path to the file the checkpoint is written to
+        """
+        with open(path, "wb") as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        """Read a checkpoint written to disk by `save`.
+
+        Parameters
+        ----------
+        path : str
+            path to the checkpoint file
+
+        Returns
+        -------
+        Checkpoint
+            the checkpoint stored in the file
+        """
+        with open(path, "rb") as f:
+            checkpoint = pickle.load(f)
+        if not isinstance(checkpoint, Checkpoint):
+            raise TypeError("{} does not contain a checkpoint.".format(path))
+        return checkpoint
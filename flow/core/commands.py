@@ -0,0 +1,158 @@
+"""Contains the TraCI command buffer class."""
+
+import collections
+
+
+class CommandBuffer:
+    """Buffer of the TraCI actuation commands issued during a simulation step.
+
+    Accelerations, lane changes, routes, and traffic light states requested
+    by controllers and environments are collected here instead of being sent
+    to sumo one at a time, and are sent together right before the next
+    simulation step (see `flush`). While buffered:
+
+    * only the last command of each kind is kept for every vehicle or traffic
+      light, so commands that are overwritten within a step are never sent,
+    * routes that match the current route of a vehicle are dropped,
+    * traffic light states that match the current state of a traffic light
+      already controlled through this buffer are dropped.
+
+    Note that speed commands are never dropped for matching the current speed
+    of a vehicle: a `slowDown` command also prevents sumo's car-following
+    model from controlling the vehicle during the step.
+
+    Since the commands are sent after the environment's additional commands
+    (see Env.additional_command), vehicles that are removed from the network
+    (or removed and reintroduced) in between must be discarded from the
+    buffer (see `discard`).
+    """
+
+    def __init__(self):
+        """Instantiate an empty command buffer."""
+        # Key = vehicle id, Element = (speed, duration)
+        self._speeds = collections.OrderedDict()
+        # Key = vehicle id, Element = (lane index, duration)
+        self._lane_changes = collections.OrderedDict()
+        # Key = vehicle id, Element = list of edges
+        self._routes = collections.OrderedDict()
+        # Key = (node id, link index), Element = state
+        self._tls_states = collections.OrderedDict()
+        # traffic lights whose states have been set through the buffer
+        self._controlled_tls = set()
+
+    def __len__(self):
+        """Return the number of commands waiting to be sent."""
+        return len(self._speeds) + len(self._lane_changes) + \
+            len(self._routes) + len(self._tls_states)
+
+    def slow_down(self, veh_id, speed, duration):
+        """Request a vehicle to reach a speed within a duration."""
+        self._speeds[veh_id] = (speed, duration)
+
+    def change_lane(self, veh_id, lane, duration):
+        """Request a vehicle to move to a lane for a duration."""
+        self._lane_changes[veh_id] = (lane, duration)
+
+    def discard(self, veh_id):
+        """Drop all buffered commands of a vehicle.
+
+        This should be called whenever a vehicle is removed from the network
+        through TraCI, so that the commands meant for it are not sent to a
+        missing vehicle (or to a new vehicle with the same name).
+        """
+        self._speeds.pop(veh_id, None)
+        self._lane_changes.pop(veh_id, None)
+        self._routes.pop(veh_id, None)
+
+    def set_route(self, veh_id, edges, current_route=None):
+        """Request a vehicle to follow a new route.
+
+        Parameters
+        ----------
+        veh_id : str
+            name of the vehicle
+        edges : list of str
+            edges of the new route, starting with the vehicle's current edge
+        current_route : list of str, optional
+            current route of the vehicle, if known. The command is dropped if
+            the new route is the same.
+        """
+        if current_route is not None and list(current_route) == list(edges):
+            self._routes.pop(veh_id, None)
+            return
+        self._routes[veh_id] = edges
+
+    def set_tls_state(self, node_id, state, link_index="all",
+                      current_state=None):
+        """Request a new state for the traffic lights of a node.
+
+        Parameters
+        ----------
+        node_id : str
+            name of the node with the controlled traffic lights
+        state : str
+            requested state(s) for the traffic light
+        link_index : int, optional
+            index of the link whose traffic light state is meant to be changed.
+            If no value is provided, the lights on all links are updated.
+        current_state : str, optional
+            current state of all the lights of the node, if known
+        """
+        key = (node_id, link_index)
+        # states matching the current ones are only dropped if no other
+        # command of the node is pending (which could alter these states)
+        pending = any(k[0] == node_id and k != key for k in self._tls_states)
+        if node_id in self._controlled_tls and current_state is not None \
+                and not pending:
+            if link_index == "all":
+                unchanged = current_state == state
+            else:
+                unchanged = current_state[link_index] == state
+            if unchanged:
+                self._tls_states.pop(key, None)
+                return
+
+        if link_index == "all":
+            # the new states override the states of all links of the node
+            for other_key in [k for k in self._tls_states if k[0] == node_id]:
+                del self._tls_states[other_key]
+        else:
+            # move the command after the other commands of the node, so that
+            # commands are sent in the order they were requested
+            self._tls_states.pop(key, None)
+        self._tls_states[key] = state
+
+    def flush(self, traci_connection):
+        """Send all buffered commands to sumo, and empty the buffer.
+
+        Parameters
+        ----------
+        traci_connection : traci.connection.Connection
+            connection to the sumo instance the commands are meant for
+        """
+        vehicle = traci_connection.vehicle
+        for veh_id, (speed, duration) in self._speeds.items():
+            vehicle.slowDown(veh_id, speed, duration)
+        for veh_id, (lane, duration) in self._lane_changes.items():
+            vehicle.changeLane(veh_id, lane, duration)
+        for veh_id, edges in self._routes.items():
+            vehicle.setRoute(vehID=veh_id, edgeList=edges)
+
+        trafficlight = traci_connection.trafficlight
+        for (node_id, link_index), state in self._tls_states.items():
+            if link_index == "all":
+                trafficlight.setRedYellowGreenState(
+                    tlsID=node_id, state=state)
+            else:
+                trafficlight.setLinkState(
+                    tlsID=node_id, tlsLinkIndex=link_index, state=state)
+            self._controlled_tls.add(node_id)
+
+        self.clear()
+
+    def clear(self):
+        """Drop all buffered commands without sending them."""
+        self._speeds.clear()
+        self._lane_changes.clear()
+        self._routes.clear()
+        self._tls_states.clear()
@@ -0,0 +1,355 @@
+"""Contains toll plaza and ramp meter infrastructure components.
+
+These components can be added to any environment that contains a toll plaza
+or a ramp meter, and are updated by the environment once per simulation step
+(e.g. in its additional_command method). The state of every lane (waiting
+times, traffic light phases) is stored in arrays, and the positions of
+vehicles are read from the per-step lane index of the vehicles class (see
+Vehicles.get_vehicles_by_lane).
+"""
+
+import numpy as np
+
+# lane change mode preventing vehicles from changing lanes on their own
+NO_LANE_CHANGE_MODE = 512
+
+
+class _LaneControlledArea:
+    """Area at the end of an edge in which vehicles may not change lanes.
+
+    Vehicles located on the controlled lanes of the edge beyond a certain
+    position are prevented from changing lanes until they reach the next
+    edge, at which point their initial lane change mode is restored.
+    """
+
+    def __init__(self, edge_before, edge_after, num_lanes, area_start,
+                 color=None):
+        self.edge_before = edge_before
+        self.edge_after = edge_after
+        self.num_lanes = num_lanes
+        self.area_start = area_start
+        self.color = color
+
+        # vehicles currently located in the area
+        self.vehicles_in_area = set()
+
+    def _update_area(self, env):
+        """Add and remove vehicles from the area.
+
+        Returns the vehicles that left the area towards the next edge.
+        """
+        vehicles = env.vehicles
+        traci_veh = env.traci_connection.vehicle
+
+        # restore the lane change mode of vehicles that left the area (or the
+        # network)
+        left = []
+        for veh_id in list(self.vehicles_in_area):
+            edge = vehicles.get_edge(veh_id)
+            if edge == self.edge_after or edge == "":
+                self.vehicles_in_area.remove(veh_id)
+                if edge != "":
+                    traci_veh.setLaneChangeMode(
+                        veh_id, vehicles.get_lane_change_mode(veh_id))
+                    left.append(veh_id)
+
+        # disable lane changes of vehicles entering the area. Vehicles are
+        # only highlighted when the sumo-gui is active, and are recolored by
+        # the environment afterwards.
+        highlight = self.color is not None and env.sumo_params.render is True
+        for cars_in_lane in self.get_lanes(env):
+            for veh_id, pos in cars_in_lane:
+                if pos > self.area_start and \
+                        veh_id not in self.vehicles_in_area:
+                    self.vehicles_in_area.add(veh_id)
+                    traci_veh.setLaneChangeMode(veh_id, NO_LANE_CHANGE_MODE)
+                    if highlight:
+                        traci_veh.setColor(veh_id, self.color)
+
+        return left
+
+    def get_lanes(self, env):
+        """Return the vehicles and positions in every controlled lane."""
+        return env.vehicles.get_vehicles_by_lane(
+            self.edge_before)[:self.num_lanes]
+
+    def reset(self):
+        """Forget all vehicles in the area, e.g. at the start of a rollout."""
+        self.vehicles_in_area = set()
+
+
+class TollPlaza(_LaneControlledArea):
+    """Toll booths located at the end of an edge.
+
+    Vehicles approaching the booths are prevented from changing lanes, and
+    are stopped by a red light at the booth of their lane for a service time
+    sampled from a normal distribution. Some lanes may be served faster than
+    others (e.g. fast track lanes).
+
+    Attributes
+    ----------
+    wait_time : np.ndarray
+        remaining service time of the vehicle at the booth of every lane (in
+        simulation steps). The booth of a lane lets vehicles through once
+        this is negative.
+    tl_state : str
+        last state of the traffic lights of the booths
+    """
+
+    def __init__(self,
+                 edge_before,
+                 edge_after,
+                 tl_id,
+                 num_lanes,
+                 sim_step,
+                 booth_area=10,
+                 stop_position=50,
+                 service_time=15,
+                 service_time_std=1,
+                 fast_track_lanes=(),
+                 fast_track_service_time=3,
+                 initial_service_time_std=4,
+                 color=(255, 0, 255, 0)):
+        """Instantiate a toll plaza.
+
+        Parameters
+        ----------
+        edge_before : str
+            edge at the end of which the booths are located
+        edge_after : str
+            edge following the booths
+        tl_id : str
+            name of the node with the traffic lights of the booths
+        num_lanes : int
+            number of lanes (and booths) of the toll plaza
+        sim_step : float
+            simulation step size (in seconds)
+        booth_area : float, optional
+            position on the edge beyond which vehicles may not change lanes
+        stop_position : float, optional
+            position on the edge beyond which vehicles are served by a booth
+        service_time : float, optional
+            mean service time of a booth (in seconds)
+        service_time_std : float, optional
+            standard deviation of the service time (in seconds)
+        fast_track_lanes : list of int, optional
+            lanes whose booths are served faster
+        fast_track_service_time : float, optional
+            mean service time of the fast track booths (in seconds)
+        initial_service_time_std : float, optional
+            standard deviation of the service time of the first vehicles at
+            every booth (in seconds)
+        color : tuple of int, optional
+            color of the vehicles in the booth area (only used with sumo-gui)
+        """
+        super().__init__(edge_before, edge_after, num_lanes, booth_area,
+                         color)
+        self.tl_id = tl_id
+        self.sim_step = sim_step
+        self.stop_position = stop_position
+        self.service_time_std = service_time_std
+        self.initial_service_time_std = initial_service_time_std
+
+        # mean service time of every lane (in simulation steps)
+        self.service_steps = service_time / sim_step
+        self.mean_service_steps = np.full(num_lanes, self.service_steps)
+        fast_track = [lane for lane in fast_track_lanes if lane < num_lanes]
+        self.mean_service_steps[fast_track] = \
+            fast_track_service_time / sim_step
+
+        self.wait_time = None
+        self.tl_state = ""
+        self.reset()
+
+    def reset(self):
+        """See parent class."""
+        super().reset()
+        self.wait_time = np.abs(np.random.normal(
+            self.service_steps,
+            self.initial_service_time_std / self.sim_step, self.num_lanes))
+        self.tl_state = ""
+
+    def update(self, env):
+        """Update the toll plaza at the current simulation step.
+
+        Parameters
+        ----------
+        env : flow.envs.Env type
+            the environment the toll plaza is located in
+        """
+        # sample new service times for the booths of the vehicles that left
+        lanes = [env.vehicles.get_lane(veh_id)
+                 for veh_id in self._update_area(env)]
+        lanes = np.array(
+            [lane for lane in lanes if 0 <= lane < self.num_lanes], dtype=int)
+        if len(lanes) > 0:
+            self.wait_time[lanes] = np.maximum(0, np.random.normal(
+                self.mean_service_steps[lanes],
+                self.service_time_std / self.sim_step))
+
+        # lanes with a vehicle waiting at the booth
+        occupied = np.zeros(self.num_lanes, dtype=bool)
+        for lane, cars_in_lane in enumerate(self.get_lanes(env)):
+            occupied[lane] = any(
+                pos > self.stop_position and veh_id in self.vehicles_in_area
+                for veh_id, pos in cars_in_lane)
+
+        # booths serving a vehicle show a red light until the service ends
+        red = occupied & (self.wait_time >= 0)
+        self.wait_time[red] -= 1
+
+        # traffic light states are only sent when they change
+        tl_state = "".join(np.where(red, "r", "G"))
+        if tl_state != self.tl_state:
+            self.tl_state = tl_state
+            env.traffic_lights.set_state(self.tl_id, tl_state, env)
+
+
+class RampMeter(_LaneControlledArea):
+    """Ramp meters located at the end of an edge.
+
+    Vehicles approaching the meters are prevented from changing lanes. If
+    the name of the node with the traffic lights of the meters is provided,
+    the meters alternate between green and red phases with a cycle time
+    computed by the ALINEA feedback controller, based on the number of
+    vehicles in a set of downstream edges (see: "Toll Plaza Merging Traffic
+    Control for Throughput Maximization").
+
+    Attributes
+    ----------
+    cycle_time : float
+        current cycle time of the meters (in seconds)
+    ramp_state : np.ndarray
+        time elapsed in the current cycle of every meter (in seconds)
+    q : float
+        current flow set by the feedback controller (in veh/hr)
+    """
+
+    def __init__(self,
+                 edge_before,
+                 edge_after,
+                 num_lanes,
+                 sim_step,
+                 meter_area=80,
+                 tl_id=None,
+                 feedback_edges=(),
+                 n_crit=8,
+                 q_max=1100,
+                 q_min=0.25 * 1100,
+                 feedback_update_time=15,
+                 feedback_coeff=20,
+                 cycle_time=6,
+                 cycle_offset=8,
+                 green_time=4,
+                 smoothing_steps=10,
+                 color=(0, 255, 255, 255)):
+        """Instantiate ramp meters.
+
+        Parameters
+        ----------
+        edge_before : str
+            edge at the end of which the meters are located
+        edge_after : str
+            edge following the meters
+        num_lanes : int
+            number of lanes (and meters)
+        sim_step : float
+            simulation step size (in seconds)
+        meter_area : float, optional
+            position on the edge beyond which vehicles may not change lanes
+        tl_id : str, optional
+            name of the node with the traffic lights of the meters. If not
+            specified, only lane changes are controlled.
+        feedback_edges : list of str, optional
+            edges whose number of vehicles is used by the feedback controller
+        n_crit : float, optional
+            targeted number of vehicles in the feedback edges
+        q_max : float, optional
+            maximum flow set by the feedback controller (in veh/hr)
+        q_min : float, optional
+            minimum flow set by the feedback controller (in veh/hr)
+        feedback_update_time : float, optional
+            time in between updates of the feedback controller (in seconds)
+        feedback_coeff : float, optional
+            gain of the feedback controller
+        cycle_time : float, optional
+            initial cycle time of the meters (in seconds)
+        cycle_offset : float, optional
+            offset in between the cycles of consecutive meters (in seconds)
+        green_time : float, optional
+            duration of the green phase of a cycle (in seconds)
+        smoothing_steps : int, optional
+            number of steps the number of vehicles in the feedback edges is
+            averaged over
+        color : tuple of int, optional
+            color of the vehicles in the meter area (only used with sumo-gui)
+        """
+        super().__init__(edge_before, edge_after, num_lanes, meter_area,
+                         color)
+        self.sim_step = sim_step
+        self.tl_id = tl_id
+        self.feedback_edges = list(feedback_edges)
+        self.n_crit = n_crit
+        self.q_max = q_max
+        self.q_min = q_min
+        self.feedback_update_time = feedback_update_time
+        self.feedback_coeff = feedback_coeff
+        self.initial_cycle_time = cycle_time
+        self.cycle_offset = cycle_offset
+        self.green_time = green_time
+        self.smoothing_steps = smoothing_steps
+        self.reset()
+
+    def reset(self):
+        """See parent class."""
+        super().reset()
+        self.q = self.q_min
+        self.cycle_time = self.initial_cycle_time
+        self.feedback_timer = 0.0
+        self.ramp_state = np.linspace(
+            0, self.cycle_offset * self.num_lanes, self.num_lanes)
+        self.smoothed_num = np.zeros(self.smoothing_steps)
+        self._smoothing_index = 0
+        self.tl_state = ""
+
+    def update(self, env):
+        """Update the ramp meters at the current simulation step.
+
+        Parameters
+        ----------
+        env : flow.envs.Env type
+            the environment the ramp meters are located in
+        """
+        self._update_area(env)
+
+        if self.tl_id is not None:
+            self._alinea(env)
+
+    def _alinea(self, env):
+        """Update the cycles of the meters through the ALINEA controller."""
+        # number of vehicles in the feedback edges over the last steps
+        self.smoothed_num[self._smoothing_index] = \
+            len(env.vehicles.get_ids_by_edge(self.feedback_edges))
+        self._smoothing_index = \
+            (self._smoothing_index + 1) % self.smoothing_steps
+
+        self.feedback_timer += self.sim_step
+        self.ramp_state += self.sim_step
+        if self.feedback_timer > self.feedback_update_time:
+            self.feedback_timer = 0
+            # integral controller update
+            q_update = self.feedback_coeff * (
+                self.n_crit - np.average(self.smoothed_num))
+            self.q = np.clip(
+                self.q + q_update, a_min=self.q_min, a_max=self.q_max)
+            # convert q to cycle time
+            self.cycle_time = 7200 / self.q
+
+        # meters whose cycle is below the green time are green, and the
+        # others are red. States are only sent when they change.
+        self.ramp_state %= self.cycle_time
+        tl_state = "".join(
+            np.where(self.ramp_state <= self.green_time, "G", "r"))
+        if tl_state != self.tl_state:
+            self.tl_state = tl_state
+            env.traffic_lights.set_state(self.tl_id, tl_state, env)
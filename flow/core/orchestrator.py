@@ -0,0 +1,160 @@
+"""Contains the asynchronous step orchestrator."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from flow.envs.base_env import Env
+
+
+class StepOrchestrator:
+    """Steps several environments concurrently from a single process.
+
+    Every environment communicates with its own sumo instance. Instead of
+    stepping the environments one after the other (and waiting for each sumo
+    instance to complete its simulation steps), the orchestrator runs the
+    blocking TraCI calls of all environments in a thread pool, and processes
+    the results of the environments on an asyncio event loop as they come in.
+    While the sumo instance of one environment is computing a simulation
+    step, the controllers, observations, and rewards of other environments
+    are computed.
+
+    Environments that use the default step method of flow.envs.Env are
+    stepped through `Env.async_step`. Other environments (e.g. environments
+    wrapped by gym, or overriding `step`) are stepped as a whole in the
+    thread pool.
+
+    Usage
+    -----
+    >>> orchestrator = StepOrchestrator(envs)
+    >>> observations = orchestrator.reset()
+    >>> results = orchestrator.step(actions)  # list of (obs, rew, done, info)
+    >>> orchestrator.close()
+    """
+
+    def __init__(self, envs, max_workers=None):
+        """Instantiate the orchestrator.
+
+        Parameters
+        ----------
+        envs : list of gym.Env
+            environments to be stepped, each connected to its own sumo
+            instance
+        max_workers : int, optional
+            number of threads used to wait on the sumo instances, defaults to
+            one thread per environment
+        """
+        self.envs = list(envs)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or max(1, len(self.envs)))
+        self.loop = asyncio.new_event_loop()
+
+    def __len__(self):
+        """Return the number of environments."""
+        return len(self.envs)
+
+    def _uses_async_step(self, env):
+        """Check whether an environment can be stepped via `async_step`."""
+        return isinstance(env, Env) and type(env).step is Env.step
+
+    async def _step_env(self, index, rl_actions):
+        """Step a single environment and return its index and results."""
+        env = self.envs[index]
+        if self._uses_async_step(env):
+            result = await env.async_step(
+                rl_actions, self.loop, executor=self.executor)
+        else:
+            result = await self.loop.run_in_executor(
+                self.executor, env.step, rl_actions)
+        return index, result
+
+    async def _reset_env(self, index):
+        """Reset a single environment and return its index and observation."""
+        observation = await self.loop.run_in_executor(
+            self.executor, self.envs[index].reset)
+        return index, observation
+
+    async def step_async(self, actions):
+        """Step all environments, and gather their results.
+
+        Parameters
+        ----------
+        actions : list
+            actions of the agents in every environment
+
+        Returns
+        -------
+        list of tuple
+            observation, reward, done, and info of every environment
+        """
+        if len(actions) != len(self.envs):
+            raise ValueError("Expected {} actions, got {}.".format(
+                len(self.envs), len(actions)))
+        results = await asyncio.gather(*[
+            self.loop.create_task(self._step_env(i, rl_actions))
+            for i, rl_actions in enumerate(actions)])
+        return [result for _, result in results]
+
+    async def as_completed(self, actions, callback):
+        """Step all environments, and process their results as they complete.
+
+        Parameters
+        ----------
+        actions : list
+            actions of the agents in every environment
+        callback : function
+            called with the index of every environment and its results
+            (observation, reward, done, and info) as soon as the environment
+            completes its step, e.g. to compute the next actions of its
+            agents while other environments are still being stepped
+
+        Returns
+        -------
+        list of tuple
+            observation, reward, done, and info of every environment
+        """
+        async def step_env(index, rl_actions):
+            _, result = await self._step_env(index, rl_actions)
+            callback(index, result)
+            return result
+
+        return list(await asyncio.gather(*[
+            self.loop.create_task(step_env(i, rl_actions))
+            for i, rl_actions in enumerate(actions)]))
+
+    def step(self, actions):
+        """Step all environments (see `step_async`)."""
+        return self.loop.run_until_complete(self.step_async(actions))
+
+    def reset(self):
+        """Reset all environments concurrently.
+
+        Returns
+        -------
+        list
+            initial observation of every environment
+        """
+        async def reset_all():
+            results = await asyncio.gather(
+                *[self.loop.create_task(self._reset_env(i))
+                  for i in range(len(self.envs))])
+            return [observation for _, observation in results]
+
+        return self.loop.run_until_complete(reset_all())
+
+    def close(self, terminate_envs=True):
+        """Stop the thread pool, and (optionally) terminate the environments.
+
+        Parameters
+        ----------
+        terminate_envs : bool, optional
+            whether to close the connections of the environments to sumo
+        """
+        if terminate_envs:
+            for env in self.envs:
+                env = getattr(env, "unwrapped", env)
+                if isinstance(env, Env):
+                    env.terminate()
+                else:
+                    env.close()
+        self.executor.shutdown(wait=True)
+        self.loop.close()
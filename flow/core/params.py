@@ -32,6 +32,11 @@ class SumoParams:
                  print_warnings=True,
                  teleport_time=-1,
                  num_clients=1,
+                 restart_threshold=None,
+                 mesoscopic=False,
+                 async_render=False,
+                 traci_record=None,
+                 traci_replay=None,
                  sumo_binary=None):
         """Instantiate SumoParams.
 
@@ -88,6 +93,44 @@ class SumoParams:
             they teleport after teleport_time seconds
         num_clients: int, optional
             Number of clients that will connect to Traci
+        restart_threshold: float, optional
+            if specified, the sumo instance is restarted upon reset whenever
+            the mean latency of a simulation step or the memory used by sumo
+            during the last rollout exceed the values measured during the
+            first rollout after the instance was started by more than this
+            fraction (e.g. 0.5 for 50%). Ignored if restart_instance is set
+            to True.
+        mesoscopic: bool, optional
+            specifies whether to run sumo's mesoscopic model, in which
+            vehicles move as queues along the segments of edges. This is much
+            faster than the default (microscopic) model on large networks, but
+            vehicles are not located in lanes: all vehicles of an edge are
+            treated as a single queue in its first lane, no leaders or lane
+            headways are computed, lane changes are not applied, and vehicles
+            may only use sumo's car following and lane change models. rl
+            vehicles may only act through their routes: requesting their
+            accelerations raises a ValueError, as the mesoscopic model
+            ignores the speeds set through TraCI.
+        async_render: bool, optional
+            specifies whether the pyglet renderer ("gray", "dgray", "rgb", or
+            "drgb" render modes) runs in a separate process. The state of the
+            vehicles is sent to this process after every simulation step
+            without blocking the simulation, and frames are only retrieved
+            when requested through Env.get_frame (the frame buffers of the
+            environment are not updated). Ignored if save_render is set to
+            True.
+        traci_record: str, optional
+            path to a file in which all TraCI requests of the environment and
+            the responses of sumo are recorded (see
+            flow.core.traci_replay.TraCIRecorder). The recording is written
+            when the environment is terminated.
+        traci_replay: str, optional
+            path to a TraCI recording (see traci_record) served to the
+            environment in place of a sumo instance, which is not started
+            (see flow.core.traci_replay.TraCIReplay). The rollouts of the
+            recorded environment are replayed, regardless of the actions of
+            rl vehicles. Both traci_record and traci_replay are incompatible
+            with restart_threshold.
 
         """
         self.port = port
@@ -107,6 +150,11 @@ class SumoParams:
         self.print_warnings = print_warnings
         self.teleport_time = teleport_time
         self.num_clients = num_clients
+        self.restart_threshold = restart_threshold
+        self.mesoscopic = mesoscopic
+        self.async_render = async_render
+        self.traci_record = traci_record
+        self.traci_replay = traci_replay
         if sumo_binary is not None:
             warnings.simplefilter("always", PendingDeprecationWarning)
             warnings.warn(
@@ -133,7 +181,10 @@ class EnvParams:
                  sort_vehicles=False,
                  warmup_steps=0,
                  sims_per_step=1,
-                 evaluate=False):
+                 evaluate=False,
+                 accel_update_period=None,
+                 lane_change_update_period=None,
+                 routing_update_period=None):
         """Instantiate EnvParams.
 
         Attributes
@@ -167,6 +218,20 @@ class EnvParams:
                 flag indicating that the evaluation reward should be used
                 so the evaluation reward should be used rather than the
                 normal reward
+            accel_update_period: float, optional
+                time (in seconds) between two updates of the acceleration
+                controllers of flow-controlled vehicles (e.g. a reaction
+                time). In between updates, the last accelerations are held.
+                Defaults to updating the controllers every simulation step.
+            lane_change_update_period: float, optional
+                time (in seconds) between two updates of the lane-changing
+                controllers. No lane changes are issued in between updates.
+                Defaults to updating the controllers every simulation step.
+            routing_update_period: float or str, optional
+                time (in seconds) between two updates of the routing
+                controllers, or "edge" to only update the routing controller
+                of a vehicle when it moves to a new edge. Defaults to updating
+                the controllers every simulation step.
 
         """
         self.vehicle_arrangement_shuffle = vehicle_arrangement_shuffle
@@ -178,6 +243,9 @@ class EnvParams:
         self.warmup_steps = warmup_steps
         self.sims_per_step = sims_per_step
         self.evaluate = evaluate
+        self.accel_update_period = accel_update_period
+        self.lane_change_update_period = lane_change_update_period
+        self.routing_update_period = routing_update_period
 
     def get_additional_param(self, key):
         """Return a variable from additional_params."""
@@ -202,7 +270,10 @@ class NetParams:
                  inflows=None,
                  in_flows=None,
                  osm_path=None,
+                 osm_bbox=None,
+                 osm_edges=None,
                  netfile=None,
+                 cache_net=False,
                  additional_params=None):
         """Instantiate NetParams.
 
@@ -218,11 +289,26 @@ class NetParams:
             path to the .osm file that should be used to generate the network
             configuration files. This parameter is only needed / used if the
             OpenStreetMapScenario class is used.
+        osm_bbox : (float, float, float, float), optional
+            bounding box (west, south, east, north, in degrees) the .osm file
+            is clipped to before being converted. Only the roads with at least
+            one node inside the box are kept.
+        osm_edges : list of str, optional
+            names of the edges the network generated from the .osm file is
+            restricted to
         netfile : str, optional
             path to the .net.xml file that should be passed to SUMO. This is
             only needed / used if the NetFileScenario class is used, such as
             in the case of Bay Bridge experiments (which use a custom net.xml
             file)
+        cache_net : bool, optional
+            whether the .net.xml files generated by netconvert are cached and
+            reused by scenarios with identical network inputs, instead of
+            calling netconvert again; default is False. The cache should be
+            cleared (see flow/scenarios/debug/net/cache) after updating sumo.
+            The edges and connections parsed from .net.xml files (including
+            the files of NetFileScenario) are also stored in binary files
+            next to them, and loaded instead of parsing the network again.
         additional_params : dict, optional
             network specific parameters; see each subclass for a description of
             what is needed
@@ -233,7 +319,10 @@ class NetParams:
         else:
             self.inflows = inflows
         self.osm_path = osm_path
+        self.osm_bbox = osm_bbox
+        self.osm_edges = osm_edges
         self.netfile = netfile
+        self.cache_net = cache_net
         self.additional_params = additional_params or {}
         if in_flows is not None:
             warnings.simplefilter("always", PendingDeprecationWarning)
@@ -0,0 +1,132 @@
+"""Contains the adaptive sumo restart policy."""
+
+import os
+
+
+def get_process_memory(pid):
+    """Return the resident memory of a process (in kB).
+
+    Returns None if the memory cannot be read, e.g. if the process is not
+    running or the platform does not provide a /proc filesystem.
+    """
+    try:
+        with open(os.path.join("/proc", str(pid), "status")) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return float(line.split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class RestartPolicy:
+    """Decides when a sumo instance should be restarted in between rollouts.
+
+    Sumo gets slower as vehicle ids and internal state accumulate over many
+    rollouts (e.g. with inflows), but restarting it after every rollout is
+    expensive. This policy measures the mean latency of a simulation step and
+    the memory used by sumo during every rollout, and requests a restart once
+    either of them exceeds the values measured during the first rollouts
+    after the instance was started by more than a relative threshold.
+
+    Usage: `record_step` is called with the duration of every simulation
+    step, and `end_episode` at every reset. If the latter returns True, the
+    instance should be restarted, after which `reset` is called to measure
+    a new baseline.
+    """
+
+    def __init__(self, threshold, baseline_episodes=1):
+        """Instantiate the restart policy.
+
+        Parameters
+        ----------
+        threshold : float
+            relative increase of the step latency or memory over their
+            baseline values beyond which sumo is restarted, e.g. 0.5 restarts
+            sumo once steps take 50% longer than in the baseline rollouts
+        baseline_episodes : int, optional
+            number of rollouts after a (re)start used to compute the
+            baseline values, defaults to 1
+        """
+        if threshold <= 0:
+            raise ValueError("The restart threshold must be positive.")
+        self.threshold = threshold
+        self.baseline_episodes = baseline_episodes
+
+        # latency and memory of the rollouts used for the baseline
+        self._baseline_latencies = []
+        self._baseline_memories = []
+
+        # step durations accumulated during the current rollout
+        self._total_time = 0
+        self._num_steps = 0
+
+        # values measured during the last rollout
+        self.last_latency = None
+        self.last_memory = None
+
+    @property
+    def baseline_latency(self):
+        """Return the baseline step latency, or None if not measured yet."""
+        if len(self._baseline_latencies) < self.baseline_episodes:
+            return None
+        return sum(self._baseline_latencies) / len(self._baseline_latencies)
+
+    @property
+    def baseline_memory(self):
+        """Return the baseline memory, or None if not measured yet."""
+        if len(self._baseline_latencies) < self.baseline_episodes or \
+                len(self._baseline_memories) == 0:
+            return None
+        return sum(self._baseline_memories) / len(self._baseline_memories)
+
+    def record_step(self, duration):
+        """Record the duration of a simulation step (in seconds)."""
+        self._total_time += duration
+        self._num_steps += 1
+
+    def end_episode(self, memory=None):
+        """Close the measurements of the current rollout.
+
+        Rollouts in which no step was recorded (e.g. the reset following the
+        initialization of the environment) are ignored.
+
+        Parameters
+        ----------
+        memory : float, optional
+            memory currently used by sumo, if available
+
+        Returns
+        -------
+        bool
+            True if sumo should be restarted before the next rollout
+        """
+        if self._num_steps == 0:
+            return False
+
+        latency = self._total_time / self._num_steps
+        self._total_time = 0
+        self._num_steps = 0
+        self.last_latency = latency
+        self.last_memory = memory
+
+        # the first rollouts after a (re)start provide the baseline
+        if len(self._baseline_latencies) < self.baseline_episodes:
+            self._baseline_latencies.append(latency)
+            if memory is not None:
+                self._baseline_memories.append(memory)
+            return False
+
+        limit = 1 + self.threshold
+        if latency > limit * self.baseline_latency:
+            return True
+        baseline_memory = self.baseline_memory
+        return memory is not None and baseline_memory is not None and \
+            memory > limit * baseline_memory
+
+    def reset(self):
+        """Discard all measurements, e.g. after restarting sumo."""
+        self._baseline_latencies = []
+        self._baseline_memories = []
+        self._total_time = 0
+        self._num_steps = 0
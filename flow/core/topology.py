@@ -0,0 +1,316 @@
+"""Contains the compiled network topology class."""
+
+from bisect import bisect_right
+import warnings
+
+import numpy as np
+
+
+class NetworkTopology:
+    """Array-based representation of the edges and connections of a network.
+
+    Edges and junctions are assigned integer ids in the order they appear in
+    the network data, and every (edge, lane) pair is assigned a lane id equal
+    to `lane_offset[edge] + lane`. The next and previous edge/lane pairs of
+    every lane are stored in compressed sparse row (CSR) arrays, so that the
+    connections of lane id `i` are located in the slice
+    `next_ptr[i]:next_ptr[i+1]` of `next_edges` and `next_lanes`.
+
+    Edge names are mapped to integer ids once (see `edge_index`), after which
+    all lookups are array operations, and can be vectorized over several
+    vehicles at once (see `get_x_array` and `get_edge_array`). Lookups of the
+    connections of a single edge/lane pair (see `next_edge` and `prev_edge`)
+    use dictionaries instead.
+
+    Attributes
+    ----------
+    edge_ids : list of str
+        names of the edges, indexed by their integer ids. The first
+        `num_edges` elements are the edges and junctions of the network;
+        the remaining elements are names that only appear in connections or
+        edge starts (e.g. generalized junction names)
+    edge_index : dict
+        Key = name of the edge, Element = integer id of the edge
+    num_edges : int
+        number of edges and junctions in the network
+    length : np.ndarray
+        length of every edge (nan for names outside the network)
+    lanes : np.ndarray
+        number of lanes of every edge
+    speed : np.ndarray
+        speed limit of every edge (nan for names outside the network)
+    max_lanes : int
+        maximum number of lanes of any edge or junction in the network
+    lane_offset : np.ndarray
+        lane id of the first lane of every edge
+    next_ptr, next_edges, next_lanes : np.ndarray
+        CSR arrays of the forward looking connections of every lane id
+    prev_ptr, prev_edges, prev_lanes : np.ndarray
+        CSR arrays of the backward looking connections of every lane id
+    edge_start : np.ndarray
+        absolute position of the start of every edge (nan if unknown)
+    """
+
+    def __init__(self, edges, connections):
+        """Compile the topology of a network.
+
+        Parameters
+        ----------
+        edges : dict <dict>
+            Key = name of the edge/junction
+            Element = lanes, speed, length
+        connections : dict < dict < dict < list<tup> > > >
+            Key = "prev" or "next", indicating coming from or to this
+            edge/lane pair
+                Key = name of the edge
+                    Key = lane index
+                    Element = list of edge/lane pairs preceding or following
+                    the edge/lane pairs
+        """
+        self.edge_ids = list(edges.keys())
+        self.edge_index = {edge: i for i, edge in enumerate(self.edge_ids)}
+        self.num_edges = len(self.edge_ids)
+
+        lanes = [edges[edge]["lanes"] for edge in self.edge_ids]
+        self.max_lanes = max(lanes) if lanes else 0
+
+        # names referenced by the connections that are not part of the edges
+        # data are still given an id so that no connection is lost
+        for direction in ["next", "prev"]:
+            for edge in connections[direction]:
+                for lane, pairs in connections[direction][edge].items():
+                    lanes = self._add_name(edge, lanes, lane)
+                    for (other_edge, other_lane) in pairs:
+                        lanes = self._add_name(other_edge, lanes, other_lane)
+
+        num_known = self.num_edges
+        num_unknown = len(self.edge_ids) - num_known
+        self.lanes = np.array(lanes, dtype=int)
+        self.length = np.array(
+            [edges[edge]["length"] for edge in self.edge_ids[:num_known]] +
+            [np.nan] * num_unknown, dtype=float)
+        self.speed = np.array(
+            [edges[edge]["speed"] for edge in self.edge_ids[:num_known]] +
+            [np.nan] * num_unknown, dtype=float)
+        self.lane_offset = np.concatenate(
+            [[0], np.cumsum(self.lanes)]).astype(int)
+
+        self.next_ptr, self.next_edges, self.next_lanes = \
+            self._compile_connections(connections["next"])
+        self.prev_ptr, self.prev_edges, self.prev_lanes = \
+            self._compile_connections(connections["prev"])
+
+        # connections of every (edge, lane) pair, for scalar lookups
+        self._next_pairs = self._index_connections(connections["next"])
+        self._prev_pairs = self._index_connections(connections["prev"])
+
+        # absolute positions of the edges, filled by set_edge_starts
+        self.edge_start = np.full(len(self.edge_ids), np.nan)
+        self._offset_position = np.ones(len(self.edge_ids), dtype=bool)
+        self._starts_dict = dict()
+        self._start_positions = []
+        self._start_array = np.array([], dtype=float)
+        self._start_edges = np.array([], dtype=int)
+
+    def _add_name(self, edge, lanes, lane=0):
+        """Assign an id to an edge name, and make room for one of its lanes.
+
+        Returns the (possibly extended) list of number of lanes per edge.
+        """
+        if edge not in self.edge_index:
+            self.edge_index[edge] = len(self.edge_ids)
+            self.edge_ids.append(edge)
+            lanes.append(0)
+        i = self.edge_index[edge]
+        if i >= self.num_edges and lane >= lanes[i]:
+            lanes[i] = lane + 1
+        return lanes
+
+    def _compile_connections(self, connection_data):
+        """Convert nested connection dicts into CSR arrays over lane ids."""
+        num_lane_ids = self.lane_offset[-1]
+        counts = np.zeros(num_lane_ids, dtype=int)
+        pairs_by_lane = dict()
+        for edge in connection_data:
+            i = self.edge_index[edge]
+            for lane, pairs in connection_data[edge].items():
+                if not 0 <= lane < self.lanes[i]:
+                    warnings.warn(
+                        "Edge {} has no lane {}. Its connections are only "
+                        "available through next_edge and prev_edge.".format(
+                            edge, lane))
+                    continue
+                lane_id = self.lane_offset[i] + lane
+                counts[lane_id] = len(pairs)
+                pairs_by_lane[lane_id] = pairs
+
+        ptr = np.concatenate([[0], np.cumsum(counts)]).astype(int)
+        to_edges = np.zeros(ptr[-1], dtype=int)
+        to_lanes = np.zeros(ptr[-1], dtype=int)
+        for lane_id, pairs in pairs_by_lane.items():
+            for j, (other_edge, other_lane) in enumerate(pairs):
+                to_edges[ptr[lane_id] + j] = self.edge_index[other_edge]
+                to_lanes[ptr[lane_id] + j] = other_lane
+
+        return ptr, to_edges, to_lanes
+
+    @staticmethod
+    def _index_connections(connection_data):
+        """Map every (edge, lane) pair to its list of connections."""
+        return {(edge, lane): list(pairs)
+                for edge in connection_data
+                for lane, pairs in connection_data[edge].items()}
+
+    def set_edge_starts(self, edgestarts, internal_edgestarts):
+        """Set the absolute positions of the edges in the network.
+
+        Parameters
+        ----------
+        edgestarts : list of (str, float)
+            starting positions of the edges (and internal links, if any)
+            sorted by position
+        internal_edgestarts : dict
+            Key = name of the internal link, Element = starting position
+        """
+        # names that are only used to specify positions have no lanes
+        lanes = self.lanes.tolist()
+        for edge in [edge for edge, _ in edgestarts] + \
+                list(internal_edgestarts.keys()):
+            lanes = self._add_name(edge, lanes, lane=-1)
+        num_new = len(lanes) - len(self.lanes)
+        if num_new > 0:
+            self.lanes = np.array(lanes, dtype=int)
+            self.length = np.append(self.length, [np.nan] * num_new)
+            self.speed = np.append(self.speed, [np.nan] * num_new)
+            self.lane_offset = np.append(
+                self.lane_offset, [self.lane_offset[-1]] * num_new)
+
+        n = len(self.edge_ids)
+        self.edge_start = np.full(n, np.nan)
+        self._offset_position = np.ones(n, dtype=bool)
+        starts = dict(edgestarts)
+        self._starts_dict = starts
+
+        for i, edge in enumerate(self.edge_ids):
+            if edge[0] != ":":
+                self.edge_start[i] = starts.get(edge, np.nan)
+            elif edge in internal_edgestarts:
+                self.edge_start[i] = internal_edgestarts[edge]
+            else:
+                # in case several internal links are being generalized for by
+                # a single element, the start of the generalized link is used
+                # regardless of the position (for backwards compatibility)
+                self.edge_start[i] = starts.get(edge.rsplit("_", 1)[0], -1001)
+                self._offset_position[i] = False
+
+        self._start_positions = [pos for _, pos in edgestarts]
+        self._start_array = np.array(self._start_positions, dtype=float)
+        self._start_edges = np.array(
+            [self.edge_index[edge] for edge, _ in edgestarts], dtype=int)
+
+    def next_edge(self, edge, lane):
+        """Return the edge/lane pairs in front of the given edge/lane.
+
+        Returns an empty list if there are no edge/lane pairs in front.
+        """
+        return self._next_pairs.get((edge, lane), [])
+
+    def prev_edge(self, edge, lane):
+        """Return the edge/lane pairs behind the given edge/lane.
+
+        Returns an empty list if there are no edge/lane pairs behind.
+        """
+        return self._prev_pairs.get((edge, lane), [])
+
+    def get_x(self, edge, position):
+        """Return the absolute position of a position on an edge.
+
+        Raises a KeyError if the edge is not an internal link and its
+        starting position is unknown, and returns -1001 for internal links
+        with unknown starting positions.
+        """
+        i = self.edge_index.get(edge)
+        if i is None:
+            if edge[0] == ":":
+                return self._starts_dict.get(edge.rsplit("_", 1)[0], -1001)
+            raise KeyError(edge)
+        start = self.edge_start[i]
+        if np.isnan(start):
+            raise KeyError(edge)
+        if self._offset_position[i]:
+            return start + position
+        return start
+
+    def get_x_array(self, edge_ids, positions):
+        """Return the absolute positions of several edge/position pairs.
+
+        Parameters
+        ----------
+        edge_ids : array_like of int
+            integer ids of the edges (see edge_index)
+        positions : array_like of float
+            relative positions on the edges
+
+        Returns
+        -------
+        np.ndarray
+            absolute positions (nan for edges with unknown starts)
+        """
+        edge_ids = np.asarray(edge_ids, dtype=int)
+        return self.edge_start[edge_ids] + \
+            np.asarray(positions) * self._offset_position[edge_ids]
+
+    def get_x_list(self, edges, positions, empty=-1001):
+        """Return the absolute positions of several edge/position pairs.
+
+        Edge names are mapped to integer ids once, after which the positions
+        are computed as array operations. Names without a known starting
+        position fall back to `get_x`.
+
+        Parameters
+        ----------
+        edges : list of str
+            names of the edges
+        positions : list of float
+            relative positions on the edges
+        empty : float, optional
+            value returned for empty edge names (e.g. vehicles that are not in
+            the network)
+
+        Returns
+        -------
+        np.ndarray
+            absolute positions
+        """
+        n = len(edges)
+        edge_ids = np.fromiter(
+            (self.edge_index.get(edge, -1) for edge in edges), int, n)
+        x = self.get_x_array(np.maximum(edge_ids, 0), positions)
+        for i in np.flatnonzero((edge_ids < 0) | np.isnan(x)):
+            x[i] = empty if edges[i] == "" else \
+                self.get_x(edges[i], positions[i])
+        return x
+
+    def get_edge(self, x):
+        """Return the edge name and relative position of an absolute position.
+
+        Returns None if the position is behind the start of the first edge.
+        """
+        index = bisect_right(self._start_positions, x) - 1
+        if index < 0:
+            return None
+        return self.edge_ids[self._start_edges[index]], \
+            x - self._start_positions[index]
+
+    def get_edge_array(self, x):
+        """Return the edge ids and relative positions of absolute positions.
+
+        Edge ids of -1 are returned for positions behind the first edge.
+        """
+        x = np.asarray(x, dtype=float)
+        starts = self._start_array
+        index = np.searchsorted(starts, x, side="right") - 1
+        valid = index >= 0
+        index = np.maximum(index, 0)
+        edge_ids = np.where(valid, self._start_edges[index], -1)
+        return edge_ids, x - np.where(valid, starts[index], 0)
@@ -0,0 +1,290 @@
+"""Contains the classes used to record and replay TraCI connections.
+
+The requests sent by an environment to sumo through TraCI (subscription
+results, id lists, getters, and commands) may be recorded along with the
+responses of sumo, and served again later without any sumo instance. This
+isolates the cost of flow's own computations (vehicles updates, controllers,
+observations, and rewards) from the cost of the simulation, e.g. in order to
+benchmark or profile them on machines without sumo.
+
+Usage
+-----
+Recordings are most easily made and replayed through the traci_record and
+traci_replay attributes of SumoParams:
+
+>>> env = create_env(SumoParams(traci_record="ring.traci"), ...)
+>>> # run a rollout and terminate the environment, which saves the recording
+>>> env = create_env(SumoParams(traci_replay="ring.traci"), ...)
+>>> # the same rollout now runs without sumo
+"""
+
+import collections
+import copy
+import pickle
+
+import numpy as np
+
+
+def _freeze(obj):
+    """Return a hashable, order-independent equivalent of request arguments.
+
+    Sets and dictionaries are sorted, so that requests are matched across
+    processes regardless of hash randomization.
+    """
+    if isinstance(obj, dict):
+        return tuple(sorted(((_freeze(key), _freeze(value))
+                             for key, value in obj.items()), key=repr))
+    if isinstance(obj, (set, frozenset)):
+        return tuple(sorted((_freeze(value) for value in obj), key=repr))
+    if isinstance(obj, (list, tuple, np.ndarray)):
+        return tuple(_freeze(value) for value in obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _request_key(domain, method, args, kwargs):
+    """Return the key under which a request is recorded."""
+    return domain, method, repr((_freeze(args), _freeze(kwargs)))
+
+
+class _RecordingDomain:
+    """Proxy of a TraCI domain (e.g. vehicle) recording all method calls."""
+
+    def __init__(self, recorder, name, domain):
+        self._recorder = recorder
+        self._name = name
+        self._domain = domain
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        attr = getattr(self._domain, name)
+        if not callable(attr):
+            return attr
+        method = self._recorder._wrap(self._name, name, attr)
+        # cache the wrapped method for subsequent calls
+        setattr(self, name, method)
+        return method
+
+
+class TraCIRecorder:
+    """Proxy of a TraCI connection recording every request and response.
+
+    Every method call on the connection (e.g. simulationStep) or on one of
+    its domains (e.g. vehicle.getSubscriptionResults) is forwarded to the
+    connection, and recorded along with its return value, or with the
+    exception it raised. Return values are copied when recorded, since TraCI
+    reuses the dictionaries of subscription results across simulation steps.
+
+    The recording is written to disk when the connection is closed (or when
+    `save` is called), and can be served by a TraCIReplay object.
+
+    Attributes
+    ----------
+    connection : traci.connection.Connection
+        the recorded connection
+    path : str
+        path to the file the recording is written to
+    records : list of tuple
+        recorded requests, as (domain, method, key, response, error) tuples,
+        where the domain is None for methods of the connection itself
+    """
+
+    def __init__(self, connection, path):
+        """Start recording a connection.
+
+        Parameters
+        ----------
+        connection : traci.connection.Connection
+            the connection to sumo
+        path : str
+            path to the file the recording is written to
+        """
+        self.path = path
+        self.records = []
+        self.attach(connection)
+
+    def attach(self, connection):
+        """Record a new connection, e.g. after sumo was restarted.
+
+        Requests sent through the new connection are appended to the
+        recording of the previous ones.
+
+        Returns
+        -------
+        TraCIRecorder
+            the recorder
+        """
+        self.connection = connection
+        # remove the proxies of the previous connection
+        for name in [name for name in self.__dict__
+                     if name not in ["connection", "path", "records"]]:
+            del self.__dict__[name]
+        return self
+
+    def __getattr__(self, name):
+        if name == "connection" or name.startswith("_"):
+            raise AttributeError(name)
+        attr = getattr(self.connection, name)
+        if callable(attr):
+            attr = self._wrap(None, name, attr)
+        else:
+            attr = _RecordingDomain(self, name, attr)
+        # cache the proxy for subsequent calls
+        setattr(self, name, attr)
+        return attr
+
+    def _wrap(self, domain, method, function):
+        """Return a version of a method recording its calls."""
+        records = self.records
+
+        def recorded(*args, **kwargs):
+            key = _request_key(domain, method, args, kwargs)
+            try:
+                response = function(*args, **kwargs)
+            except Exception as e:
+                records.append((domain, method, key, None, e))
+                raise
+            records.append(
+                (domain, method, key, copy.deepcopy(response), None))
+            return response
+
+        return recorded
+
+    def save(self):
+        """Write the recording to disk."""
+        with open(self.path, "wb") as f:
+            pickle.dump(self.records, f, pickle.HIGHEST_PROTOCOL)
+
+    def close(self, *args, **kwargs):
+        """Close the connection, and write the recording to disk."""
+        try:
+            self._wrap(None, "close", self.connection.close)(*args, **kwargs)
+        finally:
+            self.save()
+
+
+class _ReplayDomain:
+    """Replayed TraCI domain (e.g. vehicle)."""
+
+    def __init__(self, replay, name):
+        self._replay = replay
+        self._name = name
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        method = self._replay._method(self._name, name)
+        setattr(self, name, method)
+        return method
+
+
+class TraCIReplay:
+    """Replacement of a TraCI connection serving recorded responses.
+
+    Requests are matched to the recording (see TraCIRecorder) by domain,
+    method, and arguments, and served the recorded responses in the order
+    they were recorded, without any sumo instance. Recorded exceptions are
+    raised again. The replayed environment should therefore be seeded as the
+    recorded one (e.g. random and numpy), so that it sends the same requests.
+
+    Requests that do not match any recorded request (e.g. the commands of an
+    rl agent acting differently than the recorded one) are served the next
+    recorded response of the same method, unless the replay is strict. The
+    state of the simulation then remains the recorded one, regardless of the
+    commands sent.
+
+    Note that the files written by sumo (e.g. state files, see
+    Env.save_checkpoint, and emission outputs) are not reproduced.
+    """
+
+    def __init__(self, path, strict=False):
+        """Load a recording.
+
+        Parameters
+        ----------
+        path : str
+            path to a recording written by TraCIRecorder
+        strict : bool, optional
+            specifies whether requests that do not match any recorded request
+            raise an error
+
+        Raises
+        ------
+        ValueError
+            if `strict` is set to True and a request does not match the
+            recording (when the request is sent)
+        """
+        self.path = path
+        self.strict = strict
+        with open(path, "rb") as f:
+            self._data = f.read()
+        self.rewind()
+
+    def rewind(self):
+        """Serve the recording again from its start.
+
+        This allows the same rollout to be replayed several times, e.g. in
+        repeated benchmarks.
+        """
+        self._records = pickle.loads(self._data)
+        self._served = np.zeros(len(self._records), dtype=bool)
+        self._by_key = collections.defaultdict(collections.deque)
+        self._by_method = collections.defaultdict(collections.deque)
+        for i, (domain, method, key, _, _) in enumerate(self._records):
+            self._by_key[key].append(i)
+            self._by_method[domain, method].append(i)
+
+        # replace the domains of the connection
+        for name in [name for name in self.__dict__ if name not in
+                     ["path", "strict", "_data", "_records", "_served",
+                      "_by_key", "_by_method"]]:
+            del self.__dict__[name]
+        for domain in set(r[0] for r in self._records) - {None}:
+            setattr(self, domain, _ReplayDomain(self, domain))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        method = self._method(None, name)
+        setattr(self, name, method)
+        return method
+
+    def _next(self, queue):
+        """Return the next record of a queue that was not served yet."""
+        while len(queue) > 0:
+            i = queue.popleft()
+            if not self._served[i]:
+                self._served[i] = True
+                return self._records[i]
+        return None
+
+    def _method(self, domain, method):
+        """Return a method serving the recorded responses of a method."""
+        by_method = self._by_method[domain, method]
+
+        def replayed(*args, **kwargs):
+            key = _request_key(domain, method, args, kwargs)
+            record = self._next(self._by_key.get(key, ()))
+            if record is None:
+                if self.strict:
+                    raise ValueError(
+                        "Request {}.{}{} was not recorded.".format(
+                            domain or "connection", method, key[2]))
+                record = self._next(by_method)
+            if record is None:
+                raise ValueError(
+                    "No more recorded responses of {}.{}.".format(
+                        domain or "connection", method))
+
+            _, _, _, response, error = record
+            if error is not None:
+                raise error
+            return response
+
+        return replayed
+
+    def close(self, *args, **kwargs):
+        """Close the connection (nothing to close)."""
+        self._next(self._by_method[None, "close"])
@@ -169,14 +169,12 @@ class TrafficLights:
             index of the link whose traffic light state is meant to be changed.
             If no value is provided, the lights on all links are updated.
         """
-        if link_index == "all":
-            # if lights on all lanes are changed
-            env.traci_connection.trafficlight.setRedYellowGreenState(
-                tlsID=node_id, state=state)
-        else:
-            # if lights on a single lane is changed
-            env.traci_connection.trafficlight.setLinkState(
-                tlsID=node_id, tlsLinkIndex=link_index, state=state)
+        # the state is sent to sumo with the other actuation commands right
+        # before the next simulation step, and dropped if nothing changes
+        current_state = self.__tls.get(node_id, {}).get(
+            tc.TL_RED_YELLOW_GREEN_STATE)
+        env.command_buffer.set_tls_state(
+            node_id, state, link_index, current_state=current_state)
 
     def get_state(self, node_id):
         """Return the state of the traffic light(s) at the specified node.
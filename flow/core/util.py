@@ -9,6 +9,8 @@ E : etree.Element
 import csv
 import errno
 import os
+import pickle
+import struct
 from lxml import etree
 from xml.etree import ElementTree
 
@@ -30,6 +32,174 @@ def printxml(t, fn):
         fn, pretty_print=True, encoding='UTF-8', xml_declaration=True)
 
 
+def writexml(fn, name, nsl, elements):
+    """Stream xml elements into a file.
+
+    Unlike printxml, the elements are serialized one at a time as they are
+    generated, without building the whole tree in memory or pretty printing
+    it. This is meant for large files (e.g. the nodes and edges of large
+    networks).
+
+    Parameters
+    ----------
+    fn : str
+        path to the xml file
+    name : str
+        name of the root element
+    nsl : str
+        schema location of the file
+    elements : iterable of etree.Element
+        children of the root element
+    """
+    xsi = "http://www.w3.org/2001/XMLSchema-instance"
+    attr = {"{%s}noNamespaceSchemaLocation" % xsi: nsl}
+    with etree.xmlfile(fn, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        with xf.element(name, attr, nsmap={"xsi": xsi}):
+            for element in elements:
+                xf.write("\n    ", element)
+            xf.write("\n")
+
+
+def save_net_topology(path, net_data, connection_data):
+    """Store the edges and connections of a network in an indexed file.
+
+    Every edge is stored as a separate record, together with its connections,
+    and the file ends with an index of the records. This allows the topology
+    of a subset of the edges to be loaded without reading the entire file
+    (see load_net_topology).
+
+    Parameters
+    ----------
+    path : str
+        path to the file
+    net_data : dict <dict>
+        lanes, speed, and length of every edge (see
+        Scenario._import_edges_from_net)
+    connection_data : dict < dict < dict < list<tup> > > >
+        edge/lane pairs preceding and following every edge/lane pair (see
+        Scenario._import_edges_from_net)
+    """
+    next_conn = connection_data["next"]
+    prev_conn = connection_data["prev"]
+    edge_ids = list(net_data)
+    edge_ids += [edge_id for edge_id in set(next_conn) | set(prev_conn)
+                 if edge_id not in net_data]
+
+    # the file is written under a temporary name and moved afterwards, in
+    # case several processes store the same topology
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    index = dict()
+    with open(tmp_path, "wb") as f:
+        for edge_id in edge_ids:
+            record = pickle.dumps(
+                (net_data.get(edge_id), next_conn.get(edge_id),
+                 prev_conn.get(edge_id)),
+                pickle.HIGHEST_PROTOCOL)
+            index[edge_id] = (f.tell(), len(record))
+            f.write(record)
+        index_offset = f.tell()
+        pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+        f.write(struct.pack("!Q", index_offset))
+    os.replace(tmp_path, path)
+
+
+def load_net_topology(path, edges=None):
+    """Load the edges and connections of a network stored by save_net_topology.
+
+    Parameters
+    ----------
+    path : str
+        path to the file
+    edges : list of str, optional
+        edges to be loaded. The internal edges (junctions) connecting these
+        edges to one another are loaded as well, and connections to any other
+        edge are discarded. If not specified, all edges are loaded.
+
+    Returns
+    -------
+    net_data : dict <dict>
+        lanes, speed, and length of every loaded edge
+    connection_data : dict < dict < dict < list<tup> > > >
+        edge/lane pairs preceding and following every loaded edge/lane pair
+
+    Raises
+    ------
+    ValueError
+        if one of the requested edges is not in the network
+    """
+    records = dict()
+    with open(path, "rb") as f:
+        f.seek(-8, os.SEEK_END)
+        index_offset, = struct.unpack("!Q", f.read(8))
+        f.seek(index_offset)
+        index = pickle.load(f)
+
+        def read(edge_id):
+            offset, size = index[edge_id]
+            f.seek(offset)
+            return pickle.loads(f.read(size))
+
+        if edges is None:
+            for edge_id in index:
+                records[edge_id] = read(edge_id)
+        else:
+            for edge_id in edges:
+                if edge_id not in index:
+                    raise ValueError(
+                        "Edge {} is not in the network.".format(edge_id))
+            for edge_id in edges:
+                records[edge_id] = read(edge_id)
+
+            # collect the chains of junctions following the requested edges
+            junctions = dict()
+            pending = list(edges)
+            while len(pending) > 0:
+                edge_id = pending.pop()
+                record = records.get(edge_id) or junctions[edge_id]
+                for pairs in (record[1] or {}).values():
+                    for other, _ in pairs:
+                        if other.startswith(":") and other in index \
+                                and other not in records \
+                                and other not in junctions:
+                            junctions[other] = read(other)
+                            pending.append(other)
+
+            # only keep the junctions leading back into the requested edges
+            added = True
+            while added:
+                added = False
+                for junction_id, record in junctions.items():
+                    if junction_id not in records and any(
+                            other in records
+                            for pairs in (record[1] or {}).values()
+                            for other, _ in pairs):
+                        records[junction_id] = record
+                        added = True
+
+    net_data = dict()
+    next_conn_data = dict()
+    prev_conn_data = dict()
+    # edges are returned in the order they were stored in
+    for edge_id in sorted(records, key=lambda edge_id: index[edge_id][0]):
+        edge_data, next_conn, prev_conn = records[edge_id]
+        if edge_data is not None:
+            net_data[edge_id] = edge_data
+        for conn, conn_data in ((next_conn, next_conn_data),
+                                (prev_conn, prev_conn_data)):
+            if conn is None:
+                continue
+            if edges is not None:
+                conn = {lane: [pair for pair in pairs if pair[0] in records]
+                        for lane, pairs in conn.items()}
+                conn = {lane: pairs for lane, pairs in conn.items() if pairs}
+                if len(conn) == 0:
+                    continue
+            conn_data[edge_id] = conn
+
+    return net_data, {"next": next_conn_data, "prev": prev_conn_data}
+
+
 def ensure_dir(path):
     """Ensure that the directory specified exists, and if not, create it."""
     try:
@@ -5,7 +5,7 @@ from flow.controllers.rlcontroller import RLController
 from flow.controllers.lane_change_controllers import SumoLaneChangeController
 import collections
 import logging
-from bisect import bisect_left
+from bisect import bisect_left, insort
 import itertools
 import numpy as np
 
@@ -21,6 +21,68 @@ SPEED_MODES = {
 }
 LC_MODES = {"aggressive": 0, "no_lat_collide": 512, "strategic": 1621}
 
+# sumo variables every vehicle is subscribed to. These are needed by the
+# vehicles class to compute edges, lanes, positions, and headways. Additional
+# variables are requested by controllers (see BaseController.subscriptions)
+# and environments (see Env.vehicle_subscriptions).
+BASE_SUBSCRIPTIONS = (tc.VAR_LANE_INDEX, tc.VAR_LANEPOSITION, tc.VAR_ROAD_ID,
+                      tc.VAR_SPEED)
+
+# distance (in meters) sumo looks ahead of a vehicle for its leader, if the
+# leader is subscribed to
+LEADER_SUBSCRIPTION_DIST = 2000
+
+# speed and lane change modes sumo assigns to vehicles by default. Vehicles
+# with these modes do not need to have them set through TraCI.
+SUMO_DEFAULT_SPEED_MODE = 31
+SUMO_DEFAULT_LC_MODE = 1621
+
+
+class RollingCounter:
+    """Running sums of a per-step count over a bounded window of steps.
+
+    The cumulative count after each step is stored in a ring buffer, so that
+    the sum over any of the last `max_steps` steps is the difference of two
+    elements of the buffer, and memory does not grow with the number of
+    steps.
+    """
+
+    def __init__(self, max_steps):
+        """Instantiate the counter.
+
+        Parameters
+        ----------
+        max_steps : int
+            maximum number of steps the sums can be computed over
+        """
+        self.max_steps = max(int(max_steps), 1)
+        self._cumsum = np.zeros(self.max_steps + 1)
+        self._num_steps = 0  # number of steps recorded since the last reset
+        self._total = 0  # cumulative count since the last reset
+        self.last = 0  # count at the most recent step
+
+    def append(self, count):
+        """Record the count of a new step."""
+        self._num_steps += 1
+        self._total += count
+        self._cumsum[self._num_steps % (self.max_steps + 1)] = self._total
+        self.last = count
+
+    def __len__(self):
+        """Return the number of steps available to compute sums over."""
+        return min(self._num_steps, self.max_steps)
+
+    def sum(self, num_steps):
+        """Return the sum of the counts of the last `num_steps` steps.
+
+        If `num_steps` is not positive or is larger than the number of
+        available steps, the sum is computed over all available steps.
+        """
+        if num_steps <= 0 or num_steps > len(self):
+            num_steps = len(self)
+        start = (self._num_steps - num_steps) % (self.max_steps + 1)
+        return self._total - self._cumsum[start]
+
 
 class Vehicles:
     """Base vehicle class.
@@ -30,8 +92,19 @@ class Vehicles:
     retrieved from this class.
     """
 
-    def __init__(self):
-        """Instantiate the base vehicle class."""
+    def __init__(self, max_flow_window=3600, record_flow_ids=False):
+        """Instantiate the base vehicle class.
+
+        Parameters
+        ----------
+        max_flow_window : float, optional
+            maximum time span (in seconds) over which inflow and outflow rates
+            can be computed
+        record_flow_ids : bool, optional
+            whether to keep the ids of departed and arrived vehicles for every
+            time step of a rollout. By default, these ids are only available
+            for the most recent time step.
+        """
         self.__ids = []  # ids of all vehicles
         self.__human_ids = []  # ids of human-driven vehicles
         self.__controlled_ids = []  # ids of flow-controlled vehicles
@@ -59,16 +132,50 @@ class Vehicles:
         # contain the minGap attribute of each type of vehicle
         self.minGap = dict()
 
+        # sumo variables subscribed to for all vehicles, regardless of their
+        # type (specified by the environment)
+        self.env_subscriptions = set()
+
+        # sorted variables subscribed to for each vehicle type, computed once
+        # per type and reused for every departing vehicle
+        self._subscriptions_cache = dict()
+
+        # whether sumo runs the mesoscopic model, in which vehicles are not
+        # located in lanes (set by the environment, see SumoParams)
+        self.mesoscopic = False
+
         # list of vehicle ids located in each edge in the network
         self._ids_by_edge = dict()
 
-        # number of vehicles that entered the network for every time-step
-        self._num_departed = []
-        self._arrived_ids = []
+        # Key = edge id, Element = list, with the ith element containing the
+        # names and positions of all vehicles in lane i, sorted by position
+        self._vehicles_by_lane = dict()
+
+        # length of every type of vehicle, collected from sumo the first time
+        # a vehicle of the type enters the network
+        self._type_lengths = dict()
+
+        # type of the vehicles of each inflow, used to identify the type of
+        # departing vehicles without querying sumo
+        self._flow_types = None
+
+        # ids of the vehicles sorted by absolute position at the last call of
+        # sort_by_absolute_position
+        self._sorted_ids = []
 
-        # number of vehicles to exit the network for every time-step
-        self._num_arrived = []
+        # number of vehicles that entered/exited the network over the last
+        # time steps (allocated once the simulation step size is known)
+        self.max_flow_window = max_flow_window
+        self._num_departed = RollingCounter(1)
+        self._num_arrived = RollingCounter(1)
+
+        # ids of the vehicles that entered/exited the network in the most
+        # recent time step, and, if requested, in every time step
+        self.record_flow_ids = record_flow_ids
         self._departed_ids = []
+        self._arrived_ids = []
+        self._departed_ids_history = []
+        self._arrived_ids_history = []
 
         # simulation step size
         self.sim_step = 0
@@ -174,6 +281,18 @@ class Vehicles:
                           "default.".format(veh_id))
             lane_change_mode = LC_MODES["no_lat_collide"]
 
+        # collect the sumo variables needed by the controllers of this type
+        subscriptions = set(BASE_SUBSCRIPTIONS)
+        for controller in [acceleration_controller, lane_change_controller,
+                           routing_controller]:
+            if controller is not None:
+                subscriptions.update(
+                    getattr(controller[0], "subscriptions", ()))
+        # failsafes depend on the leader of the vehicle, also for controllers
+        # that do not need it otherwise (e.g. RLController)
+        if (acceleration_controller[1] or {}).get("fail_safe") is not None:
+            subscriptions.add(tc.VAR_LEADER)
+
         # this dict will be used when trying to introduce new vehicles into
         # the network via a flow
         self.type_parameters[veh_id] = \
@@ -184,7 +303,9 @@ class Vehicles:
              "speed_mode": speed_mode,
              "lane_change_mode": lane_change_mode,
              "sumo_car_following_params": sumo_car_following_params,
-             "sumo_lc_params": sumo_lc_params}
+             "sumo_lc_params": sumo_lc_params,
+             "subscriptions": subscriptions}
+        self._subscriptions_cache.pop(veh_id, None)
 
         self.initial.append({
             "veh_id":
@@ -248,7 +369,8 @@ class Vehicles:
 
             # check if the vehicle is human-driven or autonomous
             if acceleration_controller[0] == RLController:
-                self.__rl_ids.append(v_id)
+                # make sure that the order of rl_ids is kept sorted
+                insort(self.__rl_ids, v_id)
             else:
                 self.__human_ids.append(v_id)
 
@@ -272,7 +394,7 @@ class Vehicles:
         self.num_types += 1
         self.types.append({"veh_id": veh_id, "type_params": type_params})
 
-    def update(self, vehicle_obs, sim_obs, env):
+    def update(self, vehicle_obs, sim_obs, env, flow_obs=None):
         """Update the vehicle class with data from the current time step.
 
         The following actions are performed:
@@ -290,20 +412,32 @@ class Vehicles:
             simulation observations provided from sumo via subscriptions
         env : Environment type
             state of the environment at the current time step
+        flow_obs : dict, optional
+            departed and arrived vehicles counted in the inflow and outflow
+            rates, if they differ from those of sim_obs (e.g. when sim_obs
+            covers several simulation steps). Defaults to sim_obs.
         """
+        # vehicles are not located in lanes in the mesoscopic model, and are
+        # all treated as if they were in the first lane of their edge
+        if self.mesoscopic:
+            for obs in vehicle_obs.values():
+                if tc.VAR_LANE_INDEX in obs:
+                    obs[tc.VAR_LANE_INDEX] = 0
+
         # remove exiting vehicles from the vehicles class
+        arrived_ids = []
         for veh_id in sim_obs[tc.VAR_ARRIVED_VEHICLES_IDS]:
             if veh_id not in sim_obs[tc.VAR_TELEPORT_STARTING_VEHICLES_IDS]:
-                self.remove(veh_id)
+                arrived_ids.append(veh_id)
             else:
                 # this is meant to resolve the KeyError bug when there are
                 # collisions
                 vehicle_obs[veh_id] = self.__sumo_obs[veh_id]
+        self._remove_many(arrived_ids)
 
         # add entering vehicles into the vehicles class
         for veh_id in sim_obs[tc.VAR_DEPARTED_VEHICLES_IDS]:
-            veh_type = env.traci_connection.vehicle.getTypeID(veh_id)
-            if veh_id in self.get_ids():
+            if veh_id in self.__vehicles:
                 # this occurs when a vehicle is actively being removed and
                 # placed again in the network to ensure a constant number of
                 # total vehicles (e.g. GreenWaveEnv). In this case, the vehicle
@@ -311,17 +445,21 @@ class Vehicles:
                 # updated
                 pass
             else:
+                veh_type = self._get_departed_type(veh_id, env)
                 self._add_departed(veh_id, veh_type, env)
 
         if env.time_counter == 0:
             # reset all necessary values
             for veh_id in self.__rl_ids:
                 self.set_state(veh_id, "last_lc", -float("inf"))
-            self._num_departed.clear()
-            self._num_arrived.clear()
-            self._departed_ids.clear()
-            self._arrived_ids.clear()
             self.sim_step = env.sim_step
+            max_steps = np.ceil(self.max_flow_window / self.sim_step)
+            self._num_departed = RollingCounter(max_steps)
+            self._num_arrived = RollingCounter(max_steps)
+            self._departed_ids = []
+            self._arrived_ids = []
+            self._departed_ids_history = []
+            self._arrived_ids_history = []
         else:
             # update the "last_lc" variable
             for veh_id in self.__rl_ids:
@@ -331,35 +469,30 @@ class Vehicles:
                     self.set_state(veh_id, "last_lc", env.time_counter)
 
             # update the "absolute_position" variable
-            for veh_id in self.__ids:
-                prev_pos = env.get_x_by_id(veh_id)
-                this_edge = vehicle_obs.get(veh_id, {}).get(tc.VAR_ROAD_ID, "")
-                this_pos = vehicle_obs.get(veh_id, {}).get(
-                    tc.VAR_LANEPOSITION, -1001)
-
-                # in case the vehicle isn't in the network
-                if this_edge == "":
-                    self.set_absolute_position(veh_id, -1001)
-                else:
-                    change = env.scenario.get_x(this_edge, this_pos) - prev_pos
-                    new_abs_pos = (self.get_absolute_position(veh_id) +
-                                   change) % env.scenario.length
-                    self.set_absolute_position(veh_id, new_abs_pos)
+            self._update_absolute_positions(vehicle_obs, env)
 
             # updated the list of departed and arrived vehicles
-            self._num_departed.append(
-                len(sim_obs[tc.VAR_DEPARTED_VEHICLES_IDS]))
-            self._num_arrived.append(len(sim_obs[tc.VAR_ARRIVED_VEHICLES_IDS]))
-            self._departed_ids.append(sim_obs[tc.VAR_ARRIVED_VEHICLES_IDS])
-            self._arrived_ids.append(sim_obs[tc.VAR_ARRIVED_VEHICLES_IDS])
+            if flow_obs is None:
+                flow_obs = sim_obs
+            self._departed_ids = flow_obs[tc.VAR_DEPARTED_VEHICLES_IDS]
+            self._arrived_ids = flow_obs[tc.VAR_ARRIVED_VEHICLES_IDS]
+            self._num_departed.append(len(self._departed_ids))
+            self._num_arrived.append(len(self._arrived_ids))
+            if self.record_flow_ids:
+                self._departed_ids_history.append(self._departed_ids)
+                self._arrived_ids_history.append(self._arrived_ids)
 
         # update the "headway", "leader", and "follower" variables
         for veh_id in self.__ids:
-            _position = vehicle_obs[veh_id][tc.VAR_POSITION]
-            _angle = vehicle_obs[veh_id][tc.VAR_ANGLE]
             _time_step = sim_obs[tc.VAR_TIME_STEP]
             _time_delta = sim_obs[tc.VAR_DELTA_T]
-            self.__vehicles[veh_id]["orientation"] = list(_position) + [_angle]
+            # orientations are only available if they were subscribed to
+            # (e.g. when rendering with pyglet)
+            if tc.VAR_POSITION in vehicle_obs[veh_id]:
+                _position = vehicle_obs[veh_id][tc.VAR_POSITION]
+                _angle = vehicle_obs[veh_id][tc.VAR_ANGLE]
+                self.__vehicles[veh_id]["orientation"] = \
+                    list(_position) + [_angle]
             self.__vehicles[veh_id]["timestep"] = _time_step
             self.__vehicles[veh_id]["timedelta"] = _time_delta
             headway = vehicle_obs.get(veh_id, {}).get(tc.VAR_LEADER, None)
@@ -381,15 +514,109 @@ class Vehicles:
         # update the sumo observations variable
         self.__sumo_obs = vehicle_obs.copy()
 
-        # update the lane leaders data for each vehicle
-        self._multi_lane_headways(env)
+        # update the lane leaders data for each vehicle (or only the queues
+        # of vehicles in every edge for the mesoscopic model)
+        if self.mesoscopic:
+            self._edge_queues(env)
+        else:
+            self._multi_lane_headways(env)
+
+    def _update_absolute_positions(self, vehicle_obs, env):
+        """Update the absolute positions of all vehicles in the network.
+
+        The change in position of every vehicle since the last time step is
+        computed in one pass over the compiled topology of the network, and
+        added to the previous absolute positions modulo the network length.
+        Vehicles that are not in the network are given a position of -1001.
+
+        Parameters
+        ----------
+        vehicle_obs : dict
+            vehicle observations provided from sumo via subscriptions
+        env : Environment type
+            state of the environment at the current time step
+        """
+        veh_ids = self.__ids
+        if len(veh_ids) == 0:
+            return
+
+        topology = env.scenario.topology
+
+        # positions at the previous time step (0 if the vehicle just entered)
+        prev_x = topology.get_x_list(
+            self.get_edge(veh_ids), self.get_position(veh_ids), empty=0)
+
+        # positions at the current time step
+        this_edges = [vehicle_obs.get(veh_id, {}).get(tc.VAR_ROAD_ID, "")
+                      for veh_id in veh_ids]
+        this_x = topology.get_x_list(
+            this_edges,
+            [vehicle_obs.get(veh_id, {}).get(tc.VAR_LANEPOSITION, -1001)
+             for veh_id in veh_ids])
+
+        abs_pos = np.mod(np.array(self.get_absolute_position(veh_ids)) +
+                         this_x - prev_x, env.scenario.length)
+
+        # in case the vehicle isn't in the network
+        abs_pos[[edge == "" for edge in this_edges]] = -1001
+
+        for veh_id, pos in zip(veh_ids, abs_pos.tolist()):
+            self.__vehicles[veh_id]["absolute_position"] = pos
+
+    def sort_by_absolute_position(self):
+        """Return the ids of all vehicles sorted by their absolute positions.
+
+        The order computed at the previous call is used as the starting point
+        of the sort, so that the (stable) merge sort only needs to fix the few
+        vehicles that overtook one another or wrapped around the network.
+
+        Returns
+        -------
+        list <str>
+            vehicle ids, sorted by absolute position
+        """
+        ids = set(self.__ids)
+        prev_order = [veh_id for veh_id in self._sorted_ids if veh_id in ids]
+        in_order = set(prev_order)
+        order = prev_order + [veh_id for veh_id in self.__ids
+                              if veh_id not in in_order]
+
+        positions = np.array(self.get_absolute_position(order), dtype=float)
+        index = np.argsort(positions, kind="mergesort")
+        self._sorted_ids = [order[i] for i in index]
+
+        return list(self._sorted_ids)
+
+    def _get_departed_type(self, veh_id, env):
+        """Return the type of a vehicle that just entered the network.
+
+        The types of the initial vehicles and of vehicles from inflows (which
+        sumo names "<inflow name>.<index>") are known beforehand; sumo is only
+        queried for vehicles that were added by other means.
+        """
+        if self._flow_types is None:
+            self._flow_types = {
+                flow["name"]: flow["vtype"]
+                for flow in env.scenario.net_params.inflows.get()}
+
+        initial_state = getattr(env, "initial_state", {})
+        if veh_id in initial_state:
+            veh_type = initial_state[veh_id][0]
+        else:
+            veh_type = self._flow_types.get(veh_id.rsplit(".", 1)[0])
+
+        if veh_type not in self.type_parameters:
+            veh_type = env.traci_connection.vehicle.getTypeID(veh_id)
 
-        # make sure the rl vehicle list is still sorted
-        self.__rl_ids.sort()
+        return veh_type
 
     def _add_departed(self, veh_id, veh_type, env):
         """Add a vehicle that entered the network from an inflow or reset.
 
+        Controllers are only created once they are requested (see
+        get_acc_controller), and the length of the vehicle is collected from
+        sumo once per vehicle type.
+
         Parameters
         ----------
         veh_id: str
@@ -402,6 +629,8 @@ class Vehicles:
         if veh_type not in self.type_parameters:
             raise KeyError("Entering vehicle is not a valid type.")
 
+        type_params = self.type_parameters[veh_type]
+
         self.num_vehicles += 1
         self.__ids.append(veh_id)
         self.__vehicles[veh_id] = dict()
@@ -409,34 +638,12 @@ class Vehicles:
         # specify the type
         self.__vehicles[veh_id]["type"] = veh_type
 
-        sumo_cf_params = \
-            self.type_parameters[veh_type]["sumo_car_following_params"]
-
-        # specify the acceleration controller class
-        accel_controller = \
-            self.type_parameters[veh_type]["acceleration_controller"]
-        self.__vehicles[veh_id]["acc_controller"] = \
-            accel_controller[0](veh_id,
-                                sumo_cf_params=sumo_cf_params,
-                                **accel_controller[1])
-
-        # specify the lane-changing controller class
-        lc_controller = \
-            self.type_parameters[veh_type]["lane_change_controller"]
-        self.__vehicles[veh_id]["lane_changer"] = \
-            lc_controller[0](veh_id=veh_id, **lc_controller[1])
-
-        # specify the routing controller class
-        rt_controller = self.type_parameters[veh_type]["routing_controller"]
-        if rt_controller is not None:
-            self.__vehicles[veh_id]["router"] = \
-                rt_controller[0](veh_id=veh_id, router_params=rt_controller[1])
-        else:
-            self.__vehicles[veh_id]["router"] = None
-
         # add the vehicle's id to the list of vehicle ids
+        accel_controller = type_params["acceleration_controller"]
+        lc_controller = type_params["lane_change_controller"]
         if accel_controller[0] == RLController:
-            self.__rl_ids.append(veh_id)
+            # make sure that the order of rl_ids is kept sorted
+            insort(self.__rl_ids, veh_id)
             self.num_rl_vehicles += 1
         else:
             self.__human_ids.append(veh_id)
@@ -446,15 +653,13 @@ class Vehicles:
                 self.__controlled_lc_ids.append(veh_id)
 
         # subscribe the new vehicle
-        env.traci_connection.vehicle.subscribe(veh_id, [
-            tc.VAR_LANE_INDEX, tc.VAR_LANEPOSITION, tc.VAR_ROAD_ID,
-            tc.VAR_SPEED, tc.VAR_EDGES, tc.VAR_POSITION, tc.VAR_ANGLE,
-            tc.VAR_SPEED_WITHOUT_TRACI
-        ])
-        env.traci_connection.vehicle.subscribeLeader(veh_id, 2000)
+        self.subscribe(veh_id, env.traci_connection)
 
         # some constant vehicle parameters to the vehicles class
-        self.set_length(veh_id, env.traci_connection.vehicle.getLength(veh_id))
+        if veh_type not in self._type_lengths:
+            self._type_lengths[veh_type] = \
+                env.traci_connection.vehicle.getLength(veh_id)
+        self.set_length(veh_id, self._type_lengths[veh_type])
 
         # set the absolute position of the vehicle
         self.set_absolute_position(veh_id, 0)
@@ -463,21 +668,129 @@ class Vehicles:
         self.set_state(veh_id, "last_lc", env.time_counter)
 
         # specify the initial speed
-        self.__vehicles[veh_id]["initial_speed"] = \
-            self.type_parameters[veh_type]["initial_speed"]
+        self.__vehicles[veh_id]["initial_speed"] = type_params["initial_speed"]
 
-        # set the speed mode for the vehicle
-        speed_mode = self.type_parameters[veh_type]["speed_mode"]
+        # set the speed mode for the vehicle (if it differs from sumo's)
+        speed_mode = type_params["speed_mode"]
         self.__vehicles[veh_id]["speed_mode"] = speed_mode
-        env.traci_connection.vehicle.setSpeedMode(veh_id, speed_mode)
+        if speed_mode != SUMO_DEFAULT_SPEED_MODE:
+            env.traci_connection.vehicle.setSpeedMode(veh_id, speed_mode)
 
-        # set the lane changing mode for the vehicle
-        lc_mode = self.type_parameters[veh_type]["lane_change_mode"]
+        # set the lane changing mode for the vehicle (if it differs from
+        # sumo's)
+        lc_mode = type_params["lane_change_mode"]
         self.__vehicles[veh_id]["lane_change_mode"] = lc_mode
-        env.traci_connection.vehicle.setLaneChangeMode(veh_id, lc_mode)
+        if lc_mode != SUMO_DEFAULT_LC_MODE:
+            env.traci_connection.vehicle.setLaneChangeMode(veh_id, lc_mode)
 
-        # make sure that the order of rl_ids is kept sorted
-        self.__rl_ids.sort()
+    def _get_controller(self, veh_id, name):
+        """Return a controller of a vehicle, creating it if needed.
+
+        Parameters
+        ----------
+        veh_id : str
+            name of the vehicle
+        name : str
+            one of "acc_controller", "lane_changer", or "router"
+        """
+        vehicle = self.__vehicles[veh_id]
+        if name not in vehicle:
+            type_params = self.type_parameters[vehicle["type"]]
+            if name == "acc_controller":
+                controller = type_params["acceleration_controller"]
+                vehicle[name] = controller[0](
+                    veh_id,
+                    sumo_cf_params=type_params["sumo_car_following_params"],
+                    **controller[1])
+            elif name == "lane_changer":
+                controller = type_params["lane_change_controller"]
+                vehicle[name] = controller[0](veh_id=veh_id, **controller[1])
+            else:
+                controller = type_params["routing_controller"]
+                vehicle[name] = None if controller is None else \
+                    controller[0](veh_id=veh_id, router_params=controller[1])
+        return vehicle[name]
+
+    def set_env_subscriptions(self, subscriptions):
+        """Set the sumo variables subscribed to for all vehicles.
+
+        This is called by the environment with the variables it reads (see
+        Env.vehicle_subscriptions), and must be done before any vehicle is
+        subscribed to.
+
+        Parameters
+        ----------
+        subscriptions : iterable of int
+            traci constants of the requested vehicle variables
+        """
+        self.env_subscriptions = set(subscriptions)
+        self._subscriptions_cache.clear()
+
+    def get_subscriptions(self, veh_type):
+        """Return the sumo variables subscribed to for a type of vehicle.
+
+        This is the union of the variables needed by the vehicles class, the
+        controllers of the vehicle type, and the environment.
+
+        Parameters
+        ----------
+        veh_type : str
+            type of vehicle, as specified to sumo
+
+        Returns
+        -------
+        list of int
+            traci constants of the subscribed variables
+        """
+        if veh_type not in self._subscriptions_cache:
+            subscriptions = \
+                self.type_parameters[veh_type]["subscriptions"] | \
+                self.env_subscriptions
+            self._subscriptions_cache[veh_type] = sorted(subscriptions)
+        return self._subscriptions_cache[veh_type]
+
+    def subscribe(self, veh_id, traci_connection):
+        """Subscribe to the sumo variables needed for a specific vehicle.
+
+        Leaders are requested through a separate subscription, and only if
+        the vehicle's type or the environment requires them (leaders are not
+        available in the mesoscopic model).
+
+        Parameters
+        ----------
+        veh_id : str
+            name of the vehicle
+        traci_connection : traci.connection.Connection
+            connection to the sumo instance the vehicle is located in
+        """
+        subscriptions = self.get_subscriptions(self.get_state(veh_id, "type"))
+        traci_connection.vehicle.subscribe(
+            veh_id, [var for var in subscriptions if var != tc.VAR_LEADER])
+        if tc.VAR_LEADER in subscriptions and not self.mesoscopic:
+            traci_connection.vehicle.subscribeLeader(
+                veh_id, LEADER_SUBSCRIPTION_DIST)
+
+    def reattach(self, traci_connection):
+        """Re-apply the subscriptions and modes of all vehicles in sumo.
+
+        This is needed when sumo re-creates the vehicles in the network, e.g.
+        after loading a saved simulation state.
+
+        Parameters
+        ----------
+        traci_connection : traci.connection.Connection
+            connection to the sumo instance the vehicles are located in
+        """
+        for veh_id in self.__ids:
+            self.subscribe(veh_id, traci_connection)
+
+            speed_mode = self.__vehicles[veh_id]["speed_mode"]
+            if speed_mode != SUMO_DEFAULT_SPEED_MODE:
+                traci_connection.vehicle.setSpeedMode(veh_id, speed_mode)
+
+            lc_mode = self.__vehicles[veh_id]["lane_change_mode"]
+            if lc_mode != SUMO_DEFAULT_LC_MODE:
+                traci_connection.vehicle.setLaneChangeMode(veh_id, lc_mode)
 
     def remove(self, veh_id):
         """Remove a vehicle.
@@ -490,23 +803,41 @@ class Vehicles:
         veh_id: str
             unique identifier of th vehicle to be removed
         """
-        del self.__vehicles[veh_id]
-        self.__ids.remove(veh_id)
-        self.num_vehicles -= 1
-
-        # remove it from all other ids (if it is there)
-        if veh_id in self.__human_ids:
-            self.__human_ids.remove(veh_id)
-            if veh_id in self.__controlled_ids:
-                self.__controlled_ids.remove(veh_id)
-            if veh_id in self.__controlled_lc_ids:
-                self.__controlled_lc_ids.remove(veh_id)
-        else:
-            self.__rl_ids.remove(veh_id)
-            self.num_rl_vehicles -= 1
+        self._remove_many([veh_id])
+
+    def _remove_many(self, veh_ids):
+        """Remove several vehicles at once.
 
-        # make sure that the rl ids remain sorted
-        self.__rl_ids.sort()
+        Each list of ids is filtered once, regardless of the number of
+        vehicles removed. The relative order of the remaining ids (and thus
+        the sorting of the rl ids) is preserved. Vehicles that are not in the
+        class (e.g. because they were already removed when sumo reports them
+        as arrived) are ignored.
+
+        Parameters
+        ----------
+        veh_ids: list <str>
+            unique identifiers of the vehicles to be removed
+        """
+        removed = set(veh_id for veh_id in veh_ids
+                      if veh_id in self.__vehicles)
+        if len(removed) == 0:
+            return
+
+        for veh_id in removed:
+            del self.__vehicles[veh_id]
+
+        num_rl = len(self.__rl_ids)
+        self.__ids[:] = [v for v in self.__ids if v not in removed]
+        self.__human_ids[:] = [v for v in self.__human_ids if v not in removed]
+        self.__controlled_ids[:] = \
+            [v for v in self.__controlled_ids if v not in removed]
+        self.__controlled_lc_ids[:] = \
+            [v for v in self.__controlled_lc_ids if v not in removed]
+        self.__rl_ids[:] = [v for v in self.__rl_ids if v not in removed]
+
+        self.num_vehicles -= len(removed)
+        self.num_rl_vehicles -= num_rl - len(self.__rl_ids)
 
     def test_set_speed(self, veh_id, speed):
         """Set the speed of the specified vehicle."""
@@ -601,46 +932,104 @@ class Vehicles:
             return sum([self.get_ids_by_edge(edge) for edge in edges], [])
         return self._ids_by_edge.get(edges, []) or []
 
+    def get_edge_queues(self, edges):
+        """Return the number and mean speed of the vehicles in some edges.
+
+        These are queue-level observations of the edges, which are available
+        in both the microscopic and mesoscopic models.
+
+        Parameters
+        ----------
+        edges : list of str
+            names of the edges
+
+        Returns
+        -------
+        np.ndarray
+            number of vehicles in every edge
+        np.ndarray
+            mean speed of the vehicles in every edge (0 for empty edges)
+        """
+        num_vehicles = np.zeros(len(edges))
+        mean_speed = np.zeros(len(edges))
+        for i, edge in enumerate(edges):
+            veh_ids = self.get_ids_by_edge(edge)
+            if len(veh_ids) > 0:
+                num_vehicles[i] = len(veh_ids)
+                mean_speed[i] = np.mean(self.get_speed(veh_ids))
+        return num_vehicles, mean_speed
+
+    def get_vehicles_by_lane(self, edge):
+        """Return the vehicles in every lane of an edge.
+
+        This is computed once per step for all edges, and is shared by all
+        users of the vehicles class.
+
+        Parameters
+        ----------
+        edge : str
+            name of the edge
+
+        Returns
+        -------
+        list of list of (str, float)
+            the ith element contains the names and positions of all vehicles
+            in lane i, sorted by position. Empty if no vehicles are currently
+            in the edge.
+        """
+        return self._vehicles_by_lane.get(edge, [])
+
     def get_inflow_rate(self, time_span):
         """Return the inflow rate (in veh/hr) of vehicles from the network.
 
-        This value is computed over the specified **time_span** seconds.
+        This value is computed over the specified **time_span** seconds, up to
+        a maximum of **max_flow_window** seconds.
         """
-        if len(self._num_departed) == 0:
-            return 0
-        num_inflow = self._num_departed[-int(time_span / self.sim_step):]
-        return 3600 * sum(num_inflow) / (len(num_inflow) * self.sim_step)
+        return self._flow_rate(self._num_departed, time_span)
 
     def get_outflow_rate(self, time_span):
         """Return the outflow rate (in veh/hr) of vehicles from the network.
 
-        This value is computed over the specified **time_span** seconds.
+        This value is computed over the specified **time_span** seconds, up to
+        a maximum of **max_flow_window** seconds.
         """
-        if len(self._num_arrived) == 0:
+        return self._flow_rate(self._num_arrived, time_span)
+
+    def _flow_rate(self, counter, time_span):
+        """Return the rate (in veh/hr) of a count over a time span."""
+        if len(counter) == 0:
             return 0
-        num_outflow = self._num_arrived[-int(time_span / self.sim_step):]
-        return 3600 * sum(num_outflow) / (len(num_outflow) * self.sim_step)
+        num_steps = min(int(time_span / self.sim_step), len(counter))
+        if num_steps <= 0:
+            num_steps = len(counter)
+        return 3600 * counter.sum(num_steps) / (num_steps * self.sim_step)
 
     def get_num_arrived(self):
         """Return the number of vehicles that arrived in the last time step."""
-        if len(self._num_arrived) > 0:
-            return self._num_arrived[-1]
-        else:
-            return 0
+        return self._num_arrived.last
 
     def get_arrived_ids(self):
         """Return the ids of vehicles that arrived in the last time step"""
-        if len(self._arrived_ids) > 0:
-            return self._arrived_ids[-1]
-        else:
-            return 0
+        return self._arrived_ids
 
     def get_departed_ids(self):
         """Return the ids of vehicles that departed in the last time step"""
-        if len(self._departed_ids) > 0:
-            return self._departed_ids[-1]
-        else:
-            return 0
+        return self._departed_ids
+
+    def get_flow_ids_history(self):
+        """Return the ids of vehicles that departed/arrived at every step.
+
+        This is only available if the vehicles class was created with
+        **record_flow_ids** set to True.
+
+        Returns
+        -------
+        list < list<str> >
+            ids of the vehicles that departed at every time step
+        list < list<str> >
+            ids of the vehicles that arrived at every time step
+        """
+        return self._departed_ids_history, self._arrived_ids_history
 
     def get_initial_speed(self, veh_id, error=-1001):
         """Return the initial speed upon reset of the specified vehicle.
@@ -715,6 +1104,10 @@ class Vehicles:
     def get_default_speed(self, veh_id, error=-1001):
         """Return the expected speed if no control were applied
 
+        This speed is only available if the environment or the controllers
+        of the vehicle subscribe to tc.VAR_SPEED_WITHOUT_TRACI (see
+        Env.vehicle_subscriptions), and is set to `error` otherwise.
+
         Parameters
         ----------
         veh_id : str or list<str>
@@ -844,7 +1237,9 @@ class Vehicles:
         """
         if isinstance(veh_id, (list, np.ndarray)):
             return [self.get_acc_controller(vehID, error) for vehID in veh_id]
-        return self.__vehicles.get(veh_id, {}).get("acc_controller", error)
+        if veh_id not in self.__vehicles:
+            return error
+        return self._get_controller(veh_id, "acc_controller")
 
     def get_lane_changing_controller(self, veh_id, error=None):
         """Return the lane changing controller of the specified vehicle.
@@ -865,7 +1260,9 @@ class Vehicles:
                 self.get_lane_changing_controller(vehID, error)
                 for vehID in veh_id
             ]
-        return self.__vehicles.get(veh_id, {}).get("lane_changer", error)
+        if veh_id not in self.__vehicles:
+            return error
+        return self._get_controller(veh_id, "lane_changer")
 
     def get_routing_controller(self, veh_id, error=None):
         """Return the routing controller of the specified vehicle.
@@ -885,7 +1282,9 @@ class Vehicles:
             return [
                 self.get_routing_controller(vehID, error) for vehID in veh_id
             ]
-        return self.__vehicles.get(veh_id, {}).get("router", error)
+        if veh_id not in self.__vehicles:
+            return error
+        return self._get_controller(veh_id, "router")
 
     def get_route(self, veh_id, error=list()):
         """Return the route of the specified vehicle.
@@ -1131,12 +1530,10 @@ class Vehicles:
         edge_list = env.scenario.get_edge_list()
         junction_list = env.scenario.get_junction_list()
         tot_list = edge_list + junction_list
-        num_edges = (len(env.scenario.get_edge_list()) + len(
-            env.scenario.get_junction_list()))
+        num_edges = env.scenario.topology.num_edges
 
         # maximum number of lanes in the network
-        max_lanes = max(
-            [env.scenario.num_lanes(edge_id) for edge_id in tot_list])
+        max_lanes = env.scenario.topology.max_lanes
 
         # Key = edge id
         # Element = list, with the ith element containing tuples with the name
@@ -1161,6 +1558,8 @@ class Vehicles:
                 for lane in range(max_lanes):
                     edge_dict[edge][lane].sort(key=lambda x: x[1])
 
+        self._vehicles_by_lane = edge_dict
+
         for veh_id in self.get_rl_ids():
             # collect the lane leaders, followers, headways, and tailways for
             # each vehicle
@@ -1187,6 +1586,28 @@ class Vehicles:
             else:
                 self._ids_by_edge[edge_id] = []
 
+    def _edge_queues(self, env):
+        """Compute the queue of vehicles in every edge.
+
+        This replaces the multi-lane data in the mesoscopic model, in which
+        vehicles are not located in lanes: the vehicles of every edge are
+        stored as a single lane sorted by position, and no lane leaders,
+        followers, headways, or tailways are computed.
+        """
+        queues = dict()
+        for veh_id in self.get_ids():
+            edge = self.get_edge(veh_id)
+            if edge:
+                queues.setdefault(edge, []).append(
+                    (veh_id, self.get_position(veh_id)))
+
+        self._ids_by_edge = dict.fromkeys(env.scenario.get_edge_list())
+        self._vehicles_by_lane = dict()
+        for edge, queue in queues.items():
+            queue.sort(key=lambda x: x[1])
+            self._vehicles_by_lane[edge] = [queue]
+            self._ids_by_edge[edge] = [veh_id for veh_id, _ in queue]
+
     def _multi_lane_headways_util(self, veh_id, edge_dict, num_edges, env):
         """Compute multi-lane data for the specified vehicle.
 
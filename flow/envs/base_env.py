@@ -8,10 +8,12 @@ import os
 import signal
 import subprocess
 import sys
+import tempfile
 import time
 import traceback
 import numpy as np
 import random
+from flow.renderer.async_renderer import AsyncRenderer
 from flow.renderer.pyglet_renderer import PygletRenderer as Renderer
 
 import traci
@@ -35,6 +37,13 @@ except ImportError:
     import flow.config_default as config
 
 from flow.core.util import ensure_dir
+from flow.core.commands import CommandBuffer
+from flow.core.restart import RestartPolicy, get_process_memory
+from flow.core.traci_replay import TraCIRecorder, TraCIReplay
+from flow.core.checkpoint import Checkpoint
+from flow.controllers.car_following_models import SumoCarFollowingController
+from flow.controllers.lane_change_controllers import SumoLaneChangeController
+from flow.controllers.rlcontroller import RLController
 
 # Number of retries on restarting SUMO before giving up
 RETRIES_ON_ERROR = 10
@@ -79,8 +88,35 @@ class Env(*classdef):
        see flow/core/params.py
     scenario: Scenario type
         see flow/scenarios/base_scenario.py
+    vehicle_subscriptions: tuple of int
+        sumo variables that are subscribed to for every vehicle in the network
+        on top of the ones needed by the vehicles class and the vehicles'
+        controllers. Defaults to the leaders of vehicles and the speeds
+        returned by Vehicles.get_default_speed. Environments that do not need
+        these (or need additional variables, e.g. tc.VAR_EDGES) can
+        overwrite this to reduce the amount of data sent through TraCI.
+    checkpoint_exclude : tuple of str
+        attributes of the environment that are not saved in checkpoints (see
+        save_checkpoint), e.g. because they describe the configuration of the
+        environment or the connection to sumo. Environments with attributes
+        that cannot be pickled should extend this.
+    warmup_fast_forward : bool
+        specifies whether the additional commands of the environment may be
+        skipped during the warm-up steps (e.g. because they only select the
+        vehicles observed for visualization). If so, and all vehicles are
+        controlled by sumo or rl agents, sumo runs the warm-up on its own (see
+        _can_fast_forward). Environments that do not overwrite
+        additional_command are always eligible.
     """
 
+    vehicle_subscriptions = (tc.VAR_LEADER, tc.VAR_SPEED_WITHOUT_TRACI)
+
+    warmup_fast_forward = False
+
+    checkpoint_exclude = ("env_params", "sumo_params", "scenario",
+                          "traci_connection", "sumo_proc", "command_buffer",
+                          "restart_policy", "renderer")
+
     def __init__(self, env_params, sumo_params, scenario):
         # Invoke serializable if using rllab
 
@@ -123,6 +159,15 @@ class Env(*classdef):
         # TraCI connection used to communicate with sumo
         self.traci_connection = None
 
+        # actuation commands issued during a simulation step, sent to sumo
+        # right before the step is performed
+        self.command_buffer = CommandBuffer()
+
+        # accelerations held by controlled vehicles in between updates of
+        # their controllers, and edges of vehicles at the last routing update
+        self._held_accel = dict()
+        self._routing_edges = dict()
+
         # dictionary of initial observations used while resetting vehicles
         # after each rollout
         self.initial_observations = dict.fromkeys(self.vehicles.get_ids())
@@ -139,6 +184,25 @@ class Env(*classdef):
         # contains the subprocess.Popen instance used to start traci
         self.sumo_proc = None
 
+        # measures the performance of sumo in order to decide when the
+        # instance should be restarted (if requested)
+        if self.sumo_params.restart_threshold is not None:
+            # restarts depend on the performance of sumo, and cannot be
+            # reproduced when replaying a recording
+            if self.sumo_params.traci_record is not None or \
+                    self.sumo_params.traci_replay is not None:
+                raise ValueError(
+                    "restart_threshold cannot be used with traci_record or "
+                    "traci_replay.")
+            self.restart_policy = RestartPolicy(
+                self.sumo_params.restart_threshold)
+        else:
+            self.restart_policy = None
+
+        # only sumo's models may control vehicles in the mesoscopic model
+        if self.sumo_params.mesoscopic:
+            self._check_mesoscopic_controllers()
+
         self.start_sumo()
         self.setup_initial_state()
 
@@ -156,14 +220,23 @@ class Env(*classdef):
                 lane_poly = [i for pt in _lane_poly for i in pt]
                 network.append(lane_poly)
 
-            # instantiate a pyglet renderer
-            self.renderer = Renderer(
-                network,
-                self.sumo_params.render,
-                save_render,
-                sight_radius=sight_radius,
-                pxpm=pxpm,
-                show_radius=show_radius)
+            # instantiate a pyglet renderer (in a separate process, if
+            # requested)
+            if self.sumo_params.async_render and not save_render:
+                self.renderer = AsyncRenderer(
+                    network,
+                    self.sumo_params.render,
+                    sight_radius=sight_radius,
+                    pxpm=pxpm,
+                    show_radius=show_radius)
+            else:
+                self.renderer = Renderer(
+                    network,
+                    self.sumo_params.render,
+                    save_render,
+                    sight_radius=sight_radius,
+                    pxpm=pxpm,
+                    show_radius=show_radius)
 
             # render a frame
             self.render(reset=True)
@@ -190,7 +263,8 @@ class Env(*classdef):
             specifies whether to use sumo's gui
         """
         self.traci_connection.close(False)
-        self.sumo_proc.kill()
+        if self.sumo_proc is not None:
+            self.sumo_proc.kill()
 
         if render is not None:
             self.sumo_params.render = render
@@ -202,13 +276,113 @@ class Env(*classdef):
         self.start_sumo()
         self.setup_initial_state()
 
+    def load_scenario(self, scenario):
+        """Replace the scenario simulated by the running sumo instance.
+
+        The network and routes of the new scenario are loaded through traci,
+        which is much faster than restarting sumo (see `restart_sumo`) since
+        no new process or connection is needed. The new scenario must contain
+        the same vehicles as the current one.
+
+        Parameters
+        ----------
+        scenario : flow.scenarios.Scenario type
+            the new scenario
+        """
+        self.scenario = scenario
+        self.available_routes = scenario.rts
+        self.command_buffer.clear()
+        self.traci_connection.load(self._get_sumo_options())
+        self.traci_connection.simulationStep()
+        self.setup_initial_state()
+
+        # measure a new baseline for the reloaded simulation
+        if self.restart_policy is not None:
+            self.restart_policy.reset()
+
+    def _get_sumo_options(self):
+        """Return the command line options of the sumo instance.
+
+        These are the options shared by the sumo instances started by the
+        environment (see `start_sumo`) and the scenarios loaded in a running
+        instance (see `load_scenario`).
+        """
+        sumo_call = [
+            "-c", self.scenario.cfg,
+            "--step-length", str(self.sim_step)
+        ]
+
+        # add step logs (if requested)
+        if self.sumo_params.no_step_log:
+            sumo_call.append("--no-step-log")
+
+        # add the lateral resolution of the sublanes (if requested)
+        if self.sumo_params.lateral_resolution is not None:
+            sumo_call.append("--lateral-resolution")
+            sumo_call.append(str(self.sumo_params.lateral_resolution))
+
+        # add the emission path to the sumo command (if requested)
+        if self.sumo_params.emission_path is not None:
+            ensure_dir(self.sumo_params.emission_path)
+            emission_out = \
+                self.sumo_params.emission_path + \
+                "{0}-emission.xml".format(self.scenario.name)
+            sumo_call.append("--emission-output")
+            sumo_call.append(emission_out)
+            logging.debug(" Emission file: " + str(emission_out))
+
+        if self.sumo_params.overtake_right:
+            sumo_call.append("--lanechange.overtake-right")
+            sumo_call.append("true")
+
+        if self.sumo_params.ballistic:
+            sumo_call.append("--step-method.ballistic")
+            sumo_call.append("true")
+
+        # use the mesoscopic model (if requested)
+        if self.sumo_params.mesoscopic:
+            sumo_call.append("--mesosim")
+            sumo_call.append("true")
+
+        # specify a simulation seed (if requested)
+        if self.sumo_params.seed is not None:
+            sumo_call.append("--seed")
+            sumo_call.append(str(self.sumo_params.seed))
+
+        if not self.sumo_params.print_warnings:
+            sumo_call.append("--no-warnings")
+            sumo_call.append("true")
+
+        # set the time it takes for a gridlock teleport to occur
+        sumo_call.append("--time-to-teleport")
+        sumo_call.append(str(int(self.sumo_params.teleport_time)))
+
+        return sumo_call
+
     def start_sumo(self):
         """Start a sumo instance.
 
         Uses the configuration files created by the scenario class to
         initialize a sumo instance. Also initializes a traci connection to
         interface with sumo from Python.
+
+        If a TraCI recording is replayed (see SumoParams.traci_replay), no
+        sumo instance is started, and the recording is served instead.
         """
+        if self.sumo_params.traci_replay is not None:
+            # keep serving the same recording after restarts
+            if not isinstance(self.traci_connection, TraCIReplay):
+                self.traci_connection = TraCIReplay(
+                    self.sumo_params.traci_replay)
+            self.traci_connection.setOrder(0)
+            self.command_buffer = CommandBuffer()
+            self.traci_connection.simulationStep()
+            return
+
+        # keep appending to the same recording after restarts
+        recorder = self.traci_connection \
+            if isinstance(self.traci_connection, TraCIRecorder) else None
+
         error = None
         for _ in range(RETRIES_ON_ERROR):
             try:
@@ -229,59 +403,16 @@ class Env(*classdef):
 
                 # command used to start sumo
                 sumo_call = [
-                    sumo_binary, "-c", self.scenario.cfg,
+                    sumo_binary,
                     "--remote-port", str(port),
-                    "--num-clients", str(self.sumo_params.num_clients),
-                    "--step-length", str(self.sim_step)
-                ]
-
-                # add step logs (if requested)
-                if self.sumo_params.no_step_log:
-                    sumo_call.append("--no-step-log")
-
-                # add the lateral resolution of the sublanes (if requested)
-                if self.sumo_params.lateral_resolution is not None:
-                    sumo_call.append("--lateral-resolution")
-                    sumo_call.append(str(self.sumo_params.lateral_resolution))
-
-                # add the emission path to the sumo command (if requested)
-                if self.sumo_params.emission_path is not None:
-                    ensure_dir(self.sumo_params.emission_path)
-                    emission_out = \
-                        self.sumo_params.emission_path + \
-                        "{0}-emission.xml".format(self.scenario.name)
-                    sumo_call.append("--emission-output")
-                    sumo_call.append(emission_out)
-                else:
-                    emission_out = None
-
-                if self.sumo_params.overtake_right:
-                    sumo_call.append("--lanechange.overtake-right")
-                    sumo_call.append("true")
-
-                if self.sumo_params.ballistic:
-                    sumo_call.append("--step-method.ballistic")
-                    sumo_call.append("true")
-
-                # specify a simulation seed (if requested)
-                if self.sumo_params.seed is not None:
-                    sumo_call.append("--seed")
-                    sumo_call.append(str(self.sumo_params.seed))
-
-                if not self.sumo_params.print_warnings:
-                    sumo_call.append("--no-warnings")
-                    sumo_call.append("true")
-
-                # set the time it takes for a gridlock teleport to occur
-                sumo_call.append("--time-to-teleport")
-                sumo_call.append(str(int(self.sumo_params.teleport_time)))
+                    "--num-clients", str(self.sumo_params.num_clients)
+                ] + self._get_sumo_options()
 
                 logging.info(" Starting SUMO on port " + str(port))
                 logging.debug(" Cfg file: " + str(self.scenario.cfg))
                 if self.sumo_params.num_clients > 1:
                     logging.info(" Num clients are" +
                                  str(self.sumo_params.num_clients))
-                logging.debug(" Emission file: " + str(emission_out))
                 logging.debug(" Step length: " + str(self.sim_step))
 
                 # Opening the I/O thread to SUMO
@@ -296,7 +427,17 @@ class Env(*classdef):
                     time.sleep(config.SUMO_SLEEP)
 
                 self.traci_connection = traci.connect(port, numRetries=100)
+
+                # record the requests sent to sumo (if requested)
+                if recorder is not None:
+                    self.traci_connection = \
+                        recorder.attach(self.traci_connection)
+                elif self.sumo_params.traci_record is not None:
+                    self.traci_connection = TraCIRecorder(
+                        self.traci_connection, self.sumo_params.traci_record)
+
                 self.traci_connection.setOrder(0)
+                self.command_buffer = CommandBuffer()
 
                 self.traci_connection.simulationStep()
                 return
@@ -330,26 +471,19 @@ class Env(*classdef):
             self.traffic_lights.add(tl_id)
 
         # subscribe the requested states for traci-related speedups
+        env_subscriptions = set(self.vehicle_subscriptions)
+        if self.sumo_params.render in ['gray', 'dgray', 'rgb', 'drgb']:
+            # the pyglet renderer needs the orientation of every vehicle
+            env_subscriptions.update([tc.VAR_POSITION, tc.VAR_ANGLE])
+        if self.sumo_params.mesoscopic:
+            # leaders are not available in the mesoscopic model
+            env_subscriptions.discard(tc.VAR_LEADER)
+        self.vehicles.set_env_subscriptions(env_subscriptions)
+        self.vehicles.mesoscopic = self.sumo_params.mesoscopic
         for veh_id in self.vehicles.get_ids():
-            self.traci_connection.vehicle.subscribe(veh_id, [
-                tc.VAR_LANE_INDEX, tc.VAR_LANEPOSITION, tc.VAR_ROAD_ID,
-                tc.VAR_SPEED, tc.VAR_EDGES, tc.VAR_POSITION, tc.VAR_ANGLE,
-                tc.VAR_SPEED_WITHOUT_TRACI
-            ])
-            self.traci_connection.vehicle.subscribeLeader(veh_id, 2000)
-
-        # subscribe some simulation parameters needed to check for entering,
-        # exiting, and colliding vehicles
-        self.traci_connection.simulation.subscribe([
-            tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_ARRIVED_VEHICLES_IDS,
-            tc.VAR_TELEPORT_STARTING_VEHICLES_IDS, tc.VAR_TIME_STEP,
-            tc.VAR_DELTA_T
-        ])
+            self.vehicles.subscribe(veh_id, self.traci_connection)
 
-        # subscribe the traffic light
-        for node_id in self.traffic_lights.get_ids():
-            self.traci_connection.trafficlight.subscribe(
-                node_id, [tc.TL_RED_YELLOW_GREEN_STATE])
+        self._subscribe_simulation()
 
         # collect subscription information from sumo
         vehicle_obs = self.traci_connection.vehicle.getSubscriptionResults()
@@ -381,6 +515,23 @@ class Env(*classdef):
 
             self.initial_state[veh_id] = (type_id, route_id, lane, pos, speed)
 
+    def _subscribe_simulation(self):
+        """Subscribe to the simulation variables and traffic light states.
+
+        The simulation variables are needed to check for entering, exiting,
+        and colliding vehicles.
+        """
+        self.traci_connection.simulation.subscribe([
+            tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_ARRIVED_VEHICLES_IDS,
+            tc.VAR_TELEPORT_STARTING_VEHICLES_IDS, tc.VAR_TIME_STEP,
+            tc.VAR_DELTA_T
+        ])
+
+        # subscribe the traffic light
+        for node_id in self.traffic_lights.get_ids():
+            self.traci_connection.trafficlight.subscribe(
+                node_id, [tc.TL_RED_YELLOW_GREEN_STATE])
+
     def step(self, rl_actions):
         """Advance the environment by one step.
 
@@ -411,71 +562,52 @@ class Env(*classdef):
         info: dict
             contains other diagnostic information from the previous action
         """
-        for _ in range(self.env_params.sims_per_step):
-            self.time_counter += 1
-            self.step_counter += 1
-
-            # perform acceleration actions for controlled human-driven vehicles
-            if len(self.vehicles.get_controlled_ids()) > 0:
-                accel = []
-                for veh_id in self.vehicles.get_controlled_ids():
-                    accel_contr = self.vehicles.get_acc_controller(veh_id)
-                    action = accel_contr.get_action(self)
-                    accel.append(action)
-                self.apply_acceleration(self.vehicles.get_controlled_ids(),
-                                        accel)
-
-            # perform lane change actions for controlled human-driven vehicles
-            if len(self.vehicles.get_controlled_lc_ids()) > 0:
-                direction = []
-                for veh_id in self.vehicles.get_controlled_lc_ids():
-                    lc_contr = self.vehicles.get_lane_changing_controller(
-                        veh_id)
-                    target_lane = lc_contr.get_action(self)
-                    direction.append(target_lane)
-                self.apply_lane_change(
-                    self.vehicles.get_controlled_lc_ids(), direction=direction)
-
-            # perform (optionally) routing actions for all vehicle in the
-            # network, including rl and sumo-controlled vehicles
-            routing_ids = []
-            routing_actions = []
-            for veh_id in self.vehicles.get_ids():
-                if self.vehicles.get_routing_controller(veh_id) is not None:
-                    routing_ids.append(veh_id)
-                    route_contr = self.vehicles.get_routing_controller(veh_id)
-                    routing_actions.append(route_contr.choose_route(self))
-
-            self.choose_routes(routing_ids, routing_actions)
-
-            self.apply_rl_actions(rl_actions)
-
-            self.additional_command()
+        for i in range(self.env_params.sims_per_step):
+            self._before_sim_step(rl_actions)
+            self._sim_step()
+            crash = self._after_sim_step(
+                final_sub_step=i == self.env_params.sims_per_step - 1)
 
-            self.traci_connection.simulationStep()
+            # stop collecting new simulation steps if there is a collision
+            if crash:
+                break
 
-            # collect subscription information from sumo
-            vehicle_obs = \
-                self.traci_connection.vehicle.getSubscriptionResults()
-            id_lists = \
-                self.traci_connection.simulation.getSubscriptionResults()
-            tls_obs = \
-                self.traci_connection.trafficlight.getSubscriptionResults()
+            # render a frame
+            self.render()
 
-            # store new observations in the vehicles and traffic lights class
-            self.vehicles.update(vehicle_obs, id_lists, self)
-            self.traffic_lights.update(tls_obs)
+        return self._step_outputs(rl_actions, crash)
 
-            # update the colors of vehicles
-            self.update_vehicle_colors()
+    async def async_step(self, rl_actions, loop, executor=None):
+        """Advance the environment by one step without blocking on sumo.
 
-            # collect list of sorted vehicle ids
-            self.sorted_ids, self.sorted_extra_data = self.sort_by_position()
+        This is equivalent to `step`, except that the commands sent to sumo
+        and the simulation steps (which block until sumo completes them) are
+        run in an executor, so that an asyncio event loop can process other
+        environments while this environment's sumo instance is busy (see
+        flow.core.orchestrator.StepOrchestrator).
 
-            # crash encodes whether the simulator experienced a collision
-            crash = \
-                self.traci_connection.simulation.getStartingTeleportNumber() \
-                != 0
+        Parameters
+        ----------
+        rl_actions: numpy ndarray
+            an list of actions provided by the rl algorithm
+        loop : asyncio.AbstractEventLoop
+            event loop the step is run in (e.g. the loop of the
+            orchestrator), which is not necessarily the current event loop
+            of the thread
+        executor : concurrent.futures.Executor, optional
+            executor the blocking calls are run in, defaults to the event
+            loop's default executor
+
+        Returns
+        -------
+        tuple
+            observation, reward, done, and info (see `step`)
+        """
+        for i in range(self.env_params.sims_per_step):
+            self._before_sim_step(rl_actions)
+            await loop.run_in_executor(executor, self._sim_step)
+            crash = self._after_sim_step(
+                final_sub_step=i == self.env_params.sims_per_step - 1)
 
             # stop collecting new simulation steps if there is a collision
             if crash:
@@ -484,6 +616,75 @@ class Env(*classdef):
             # render a frame
             self.render()
 
+        return self._step_outputs(rl_actions, crash)
+
+    def _before_sim_step(self, rl_actions):
+        """Issue the commands of all controllers and agents for a sub-step."""
+        self.time_counter += 1
+        self.step_counter += 1
+
+        # perform the actions of flow-controlled (non-rl) vehicles
+        self._apply_controller_actions()
+
+        self.apply_rl_actions(rl_actions)
+
+        self.additional_command()
+
+    def _sim_step(self):
+        """Send all buffered commands to sumo and advance the simulation.
+
+        This is the only part of a step that waits on sumo.
+        """
+        # send all buffered actuation commands before advancing the
+        # simulation
+        self.command_buffer.flush(self.traci_connection)
+        if self.restart_policy is not None:
+            t0 = time.time()
+            self.traci_connection.simulationStep()
+            self.restart_policy.record_step(time.time() - t0)
+        else:
+            self.traci_connection.simulationStep()
+
+    def _after_sim_step(self, final_sub_step=True):
+        """Update the vehicles and traffic lights after a simulation step.
+
+        Parameters
+        ----------
+        final_sub_step : bool, optional
+            whether this is the last simulation step of the current step
+
+        Returns
+        -------
+        bool
+            True if the simulator experienced a collision
+        """
+        # collect subscription information from sumo
+        vehicle_obs = self.traci_connection.vehicle.getSubscriptionResults()
+        id_lists = self.traci_connection.simulation.getSubscriptionResults()
+        tls_obs = self.traci_connection.trafficlight.getSubscriptionResults()
+
+        # store new observations in the vehicles and traffic lights class
+        self.vehicles.update(vehicle_obs, id_lists, self)
+        self.traffic_lights.update(tls_obs)
+
+        # crash encodes whether the simulator experienced a collision
+        crash = len(id_lists[tc.VAR_TELEPORT_STARTING_VEHICLES_IDS]) != 0
+
+        # update the colors of vehicles (only visible at the end of the step)
+        if final_sub_step or crash:
+            self.update_vehicle_colors()
+
+        # collect list of sorted vehicle ids. In between sub-steps, this is
+        # only needed if vehicles entered or exited the network.
+        if final_sub_step or crash or \
+                len(id_lists[tc.VAR_DEPARTED_VEHICLES_IDS]) > 0 or \
+                len(id_lists[tc.VAR_ARRIVED_VEHICLES_IDS]) > 0:
+            self.sorted_ids, self.sorted_extra_data = self.sort_by_position()
+
+        return crash
+
+    def _step_outputs(self, rl_actions, crash):
+        """Compute the observation, reward, done, and info of a step."""
         states = self.get_state()
         if isinstance(states, dict):
             self.state = {}
@@ -491,6 +692,7 @@ class Env(*classdef):
             done = {}
             infos = {}
             temp_state = states
+            arrived = set(self.vehicles.get_arrived_ids())
             for key, state in temp_state.items():
                 # collect information of the state of the network based on the
                 # environment class used
@@ -504,7 +706,7 @@ class Env(*classdef):
                 # test if the agent has exited the system, if so
                 # its agent should be done
                 # FIXME(ev) this assumes that agents are single vehicles
-                if key in self.vehicles.get_arrived_ids():
+                if key in arrived:
                     done[key] = True
                 # check if an agent is done
                 if crash:
@@ -556,22 +758,36 @@ class Env(*classdef):
         # reset the time counter
         self.time_counter = 0
 
+        # controller updates start over with the new rollout
+        self._held_accel = dict()
+        self._routing_edges = dict()
+
         # warn about not using restart_instance when using inflows
         if len(self.scenario.net_params.inflows.get()) > 0 and \
-                not self.sumo_params.restart_instance:
+                not self.sumo_params.restart_instance and \
+                self.restart_policy is None:
             print(
                 "**********************************************************\n"
                 "**********************************************************\n"
                 "**********************************************************\n"
                 "WARNING: Inflows will cause computational performance to\n"
                 "significantly decrease after large number of rollouts. In \n"
-                "order to avoid this, set SumoParams(restart_instance=True).\n"
+                "order to avoid this, set SumoParams(restart_instance=True)\n"
+                "or SumoParams(restart_threshold=...).\n"
                 "**********************************************************\n"
                 "**********************************************************\n"
                 "**********************************************************"
             )
 
-        if self.sumo_params.restart_instance or self.step_counter > 2e6:
+        # check whether the performance of sumo degraded over the last
+        # rollout (if an adaptive restart policy is used)
+        degraded = False
+        if self.restart_policy is not None:
+            degraded = self.restart_policy.end_episode(
+                get_process_memory(self.sumo_proc.pid))
+
+        if self.sumo_params.restart_instance or self.step_counter > 2e6 \
+                or degraded:
             self.step_counter = 0
             # issue a random seed to induce randomness into the next rollout
             self.sumo_params.seed = random.randint(0, 1e5)
@@ -579,6 +795,9 @@ class Env(*classdef):
             self.vehicles = deepcopy(self.initial_vehicles)
             # restart the sumo instance
             self.restart_sumo(self.sumo_params)
+            # measure a new baseline for the restarted instance
+            if self.restart_policy is not None:
+                self.restart_policy.reset()
 
         # perform shuffling (if requested)
         if self.starting_position_shuffle or self.vehicle_arrangement_shuffle:
@@ -609,6 +828,9 @@ class Env(*classdef):
 
             self.initial_state = deepcopy(initial_state)
 
+        # drop any commands meant for the vehicles of the previous rollout
+        self.command_buffer.clear()
+
         # clear all vehicles from the network and the vehicles class
         for veh_id in self.traci_connection.vehicle.getIDList():
             try:
@@ -702,14 +924,243 @@ class Env(*classdef):
             observation = np.copy(states)
 
         # perform (optional) warm-up steps before training
-        for _ in range(self.env_params.warmup_steps):
-            observation, _, _, _ = self.step(rl_actions=None)
+        if self.env_params.warmup_steps > 0:
+            observation = self._warmup(self.env_params.warmup_steps)
 
         # render a frame
         self.render(reset=True)
 
         return observation
 
+    def save_checkpoint(self, path=None):
+        """Save the current state of the environment and of sumo.
+
+        The checkpoint contains the simulation state of sumo, as well as the
+        vehicles and traffic lights classes (including the internal states of
+        the vehicles' controllers), the counters of the environment, and any
+        environment-specific attribute not listed in `checkpoint_exclude`.
+
+        Parameters
+        ----------
+        path : str, optional
+            if specified, the checkpoint is also written to this file, from
+            which it can be restored in other processes
+
+        Returns
+        -------
+        flow.core.checkpoint.Checkpoint
+            handle of the checkpoint, to be passed to `restore_checkpoint`
+        """
+        fd, state_file = tempfile.mkstemp(suffix=".xml")
+        os.close(fd)
+        try:
+            self.traci_connection.simulation.saveState(state_file)
+            with open(state_file, "rb") as f:
+                sumo_state = f.read()
+        finally:
+            os.remove(state_file)
+
+        env_state = {
+            key: value for key, value in self.__dict__.items()
+            if key not in self.checkpoint_exclude and
+            not key.startswith("_Serializable")
+        }
+        checkpoint = Checkpoint(
+            sumo_state, env_state,
+            self.traci_connection.simulation.getCurrentTime() / 1000)
+
+        if path is not None:
+            checkpoint.save(path)
+
+        return checkpoint
+
+    def restore_checkpoint(self, checkpoint):
+        """Restore a state saved by `save_checkpoint`.
+
+        A checkpoint can be restored several times, and into any environment
+        of the same class using the same scenario, e.g. to evaluate several
+        policies or traffic light plans from a common starting state.
+
+        Parameters
+        ----------
+        checkpoint : flow.core.checkpoint.Checkpoint or str
+            handle returned by `save_checkpoint`, or path to a checkpoint
+            written to disk
+
+        Returns
+        -------
+        observation : numpy ndarray or dict
+            observation of the restored state
+        """
+        if not isinstance(checkpoint, Checkpoint):
+            checkpoint = Checkpoint.load(checkpoint)
+
+        fd, state_file = tempfile.mkstemp(suffix=".xml")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(checkpoint.sumo_state)
+            self.traci_connection.simulation.loadState(state_file)
+        finally:
+            os.remove(state_file)
+
+        # commands issued before the restore are meant for another state
+        self.command_buffer.clear()
+
+        self.__dict__.update(checkpoint.get_env_state())
+
+        # sumo re-creates the vehicles upon loading a state, and drops the
+        # subscriptions of the simulation, so these, as well as the modes of
+        # vehicles, need to be requested again
+        self.vehicles.reattach(self.traci_connection)
+        self._subscribe_simulation()
+
+        states = self.get_state()
+        if isinstance(states, dict):
+            return {key: np.asarray(state).T for key, state in states.items()}
+        return np.copy(states)
+
+    def _warmup(self, num_steps):
+        """Perform the warm-up steps at the start of a rollout.
+
+        All but the last warm-up step are performed without computing
+        observations or rewards. If no vehicle or environment needs to act
+        during these steps, sumo is advanced to the end of them with a single
+        command; otherwise, only the controllers and the vehicles class are
+        updated at every simulation step. The last warm-up step is a regular
+        step, and provides the observation returned by the reset.
+
+        Parameters
+        ----------
+        num_steps : int
+            number of warm-up steps
+
+        Returns
+        -------
+        observation : numpy ndarray or dict
+            observation after the warm-up steps
+        """
+        num_sims = (num_steps - 1) * self.env_params.sims_per_step
+        if num_sims > 0:
+            if self._can_fast_forward():
+                self._fast_forward(num_sims)
+            else:
+                for _ in range(num_sims):
+                    self._warmup_sim_step()
+
+        observation, _, _, _ = self.step(rl_actions=None)
+        return observation
+
+    def _check_mesoscopic_controllers(self):
+        """Ensure that all vehicles can be simulated by the mesoscopic model.
+
+        Vehicles of the mesoscopic model are not located in lanes and follow
+        sumo's queue dynamics, so their accelerations and lane changes may not
+        be controlled by flow. Routing controllers may still be used. rl
+        vehicles are accepted, but may only act through their routes (see
+        apply_acceleration).
+
+        Raises
+        ------
+        ValueError
+            if a type of vehicle uses a flow acceleration or lane change
+            controller
+        """
+        for veh_type, type_params in self.vehicles.type_parameters.items():
+            if type_params["acceleration_controller"][0] not in \
+                    [SumoCarFollowingController, RLController] or \
+                    type_params["lane_change_controller"][0] != \
+                    SumoLaneChangeController:
+                raise ValueError(
+                    "Vehicles of type {} use flow acceleration or lane change "
+                    "controllers, which are not supported by the mesoscopic "
+                    "model.".format(veh_type))
+
+    def _can_fast_forward(self):
+        """Check whether sumo can run the warm-up without flow's actions.
+
+        This is the case if the controllers of all vehicles (including those
+        of types that may still enter the network) are sumo's or rl agents'
+        (which do not act during warm-up), no vehicle uses a routing
+        controller, and the environment issues no additional commands or
+        allows them to be skipped (see warmup_fast_forward).
+        """
+        for type_params in self.vehicles.type_parameters.values():
+            if type_params["acceleration_controller"][0] not in \
+                    [SumoCarFollowingController, RLController] or \
+                    type_params["lane_change_controller"][0] != \
+                    SumoLaneChangeController or \
+                    type_params["routing_controller"] is not None:
+                return False
+
+        return self.warmup_fast_forward or \
+            type(self).additional_command is Env.additional_command
+
+    def _fast_forward(self, num_sims):
+        """Advance sumo by several simulation steps with a single command.
+
+        The vehicles class is synchronized once at the end: vehicles that
+        entered or exited the network during these steps are added or
+        removed, and all other states are taken from the last step. The
+        inflow and outflow rates only count the vehicles that entered or
+        exited the network at the last step, as if it was the only step.
+
+        Parameters
+        ----------
+        num_sims : int
+            number of simulation steps to advance
+        """
+        prev_ids = list(self.vehicles.get_ids())
+
+        # sumo versions prior to 1.0 express simulation times in ms
+        time_scale = 1 if hasattr(tc, "VAR_TIME") else 1000
+        target_time = self.traci_connection.simulation.getCurrentTime() \
+            / 1000 + num_sims * self.sim_step
+        if time_scale == 1000:
+            target_time = int(round(target_time * 1000))
+        self.traci_connection.simulationStep(target_time)
+
+        self.time_counter += num_sims
+        self.step_counter += num_sims
+
+        # collect subscription information from sumo
+        vehicle_obs = self.traci_connection.vehicle.getSubscriptionResults()
+        id_lists = dict(
+            self.traci_connection.simulation.getSubscriptionResults())
+        tls_obs = self.traci_connection.trafficlight.getSubscriptionResults()
+
+        # the departed and arrived vehicles reported by sumo only cover the
+        # last step, so they are computed from the ids in the network instead
+        # (the ones of the last step are still used for the flow rates)
+        flow_obs = {
+            tc.VAR_DEPARTED_VEHICLES_IDS:
+                id_lists.get(tc.VAR_DEPARTED_VEHICLES_IDS, []),
+            tc.VAR_ARRIVED_VEHICLES_IDS:
+                id_lists.get(tc.VAR_ARRIVED_VEHICLES_IDS, [])}
+        current_ids = self.traci_connection.vehicle.getIDList()
+        prev_id_set = set(prev_ids)
+        current_id_set = set(current_ids)
+        id_lists[tc.VAR_DEPARTED_VEHICLES_IDS] = \
+            [veh_id for veh_id in current_ids if veh_id not in prev_id_set]
+        id_lists[tc.VAR_ARRIVED_VEHICLES_IDS] = \
+            [veh_id for veh_id in prev_ids if veh_id not in current_id_set]
+        id_lists[tc.VAR_TELEPORT_STARTING_VEHICLES_IDS] = []
+
+        # store new observations in the vehicles and traffic lights class
+        self.vehicles.update(vehicle_obs, id_lists, self, flow_obs=flow_obs)
+        self.traffic_lights.update(tls_obs)
+
+        self.sorted_ids, self.sorted_extra_data = self.sort_by_position()
+
+    def _warmup_sim_step(self):
+        """Perform a simulation step of the warm-up.
+
+        Only the actions of controllers and the environment are applied,
+        and only the vehicles and traffic lights classes are updated.
+        """
+        self._before_sim_step(None)
+        self._sim_step()
+        self._after_sim_step(final_sub_step=False)
+
     def additional_command(self):
         """Additional commands that may be performed by the step method."""
         pass
@@ -742,6 +1193,84 @@ class Env(*classdef):
     def _apply_rl_actions(self, rl_actions):
         raise NotImplementedError
 
+    def _apply_controller_actions(self):
+        """Apply the actions of the acceleration, lane-changing, and routing
+        controllers of all vehicles in the network."""
+        # perform acceleration actions for controlled human-driven vehicles
+        # (holding the last accelerations in between controller updates)
+        if len(self.vehicles.get_controlled_ids()) > 0:
+            if self._controller_update_due(
+                    self.env_params.accel_update_period):
+                self._held_accel = dict()
+            accel = []
+            for veh_id in self.vehicles.get_controlled_ids():
+                if veh_id not in self._held_accel:
+                    accel_contr = self.vehicles.get_acc_controller(veh_id)
+                    self._held_accel[veh_id] = accel_contr.get_action(self)
+                accel.append(self._held_accel[veh_id])
+            self.apply_acceleration(self.vehicles.get_controlled_ids(),
+                                    accel)
+
+        # perform lane change actions for controlled human-driven vehicles
+        if len(self.vehicles.get_controlled_lc_ids()) > 0 and \
+                self._controller_update_due(
+                    self.env_params.lane_change_update_period):
+            direction = []
+            for veh_id in self.vehicles.get_controlled_lc_ids():
+                lc_contr = self.vehicles.get_lane_changing_controller(
+                    veh_id)
+                target_lane = lc_contr.get_action(self)
+                direction.append(target_lane)
+            self.apply_lane_change(
+                self.vehicles.get_controlled_lc_ids(), direction=direction)
+
+        # perform (optionally) routing actions for all vehicle in the
+        # network, including rl and sumo-controlled vehicles
+        routing_ids = []
+        routing_actions = []
+        for veh_id in self._get_routing_ids():
+            route_contr = self.vehicles.get_routing_controller(veh_id)
+            if route_contr is not None:
+                routing_ids.append(veh_id)
+                routing_actions.append(route_contr.choose_route(self))
+
+        self.choose_routes(routing_ids, routing_actions)
+
+    def _controller_update_due(self, period):
+        """Check whether controllers with a given period act this sub-step.
+
+        Parameters
+        ----------
+        period : float or None
+            time (in seconds) between two controller updates. If None, the
+            controllers are updated every simulation step.
+        """
+        if period is None:
+            return True
+        num_steps = max(int(round(period / self.sim_step)), 1)
+        return (self.time_counter - 1) % num_steps == 0
+
+    def _get_routing_ids(self):
+        """Return the ids of the vehicles whose routers act this sub-step.
+
+        If the routing update period is "edge", routing controllers are only
+        updated when their vehicles move to a new edge.
+        """
+        period = self.env_params.routing_update_period
+        if period != "edge":
+            if self._controller_update_due(period):
+                return self.vehicles.get_ids()
+            return []
+
+        routing_ids = []
+        edges = dict()
+        for veh_id in self.vehicles.get_ids():
+            edges[veh_id] = self.vehicles.get_edge(veh_id)
+            if self._routing_edges.get(veh_id) != edges[veh_id]:
+                routing_ids.append(veh_id)
+        self._routing_edges = edges
+        return routing_ids
+
     def apply_acceleration(self, veh_ids, acc):
         """Apply the acceleration requested by a vehicle in sumo.
 
@@ -755,12 +1284,25 @@ class Env(*classdef):
             vehicles IDs associated with the requested accelerations
         acc: numpy ndarray or list of float
             requested accelerations from the vehicles
+
+        Raises
+        ------
+        ValueError
+            if an acceleration is requested in the mesoscopic model, which
+            ignores the speeds set through TraCI
         """
+        if self.sumo_params.mesoscopic and \
+                any(acc[i] is not None for i in range(len(veh_ids))):
+            raise ValueError(
+                "Accelerations cannot be applied in the mesoscopic model. rl "
+                "vehicles may only act through their routes (see "
+                "choose_routes).")
+
         for i, vid in enumerate(veh_ids):
             if acc[i] is not None:
                 this_vel = self.vehicles.get_speed(vid)
                 next_vel = max([this_vel + acc[i] * self.sim_step, 0])
-                self.traci_connection.vehicle.slowDown(vid, next_vel, 1)
+                self.command_buffer.slow_down(vid, next_vel, 1)
 
     def apply_lane_change(self, veh_ids, direction):
         """Apply an instantaneous lane-change to a set of vehicles.
@@ -768,7 +1310,8 @@ class Env(*classdef):
         This method also prevents vehicles from moving to lanes that do not
         exist, and set the "last_lc" variable for RL vehicles that lane changed
         to match the current time step, in order to assist in maintaining a
-        lane change duration for these vehicles.
+        lane change duration for these vehicles. Lane changes are ignored if
+        sumo runs the mesoscopic model (see SumoParams).
 
         Parameters
         ----------
@@ -789,6 +1332,11 @@ class Env(*classdef):
             raise ValueError(
                 "Direction values for lane changes may only be: -1, 0, or 1.")
 
+        # vehicles are not located in lanes in the mesoscopic model
+        if self.sumo_params.mesoscopic:
+            return
+
+        rl_ids = set(self.vehicles.get_rl_ids())
         for i, veh_id in enumerate(veh_ids):
             # check for no lane change
             if direction[i] == 0:
@@ -804,10 +1352,10 @@ class Env(*classdef):
 
             # perform the requested lane action action in TraCI
             if target_lane != this_lane:
-                self.traci_connection.vehicle.changeLane(
+                self.command_buffer.change_lane(
                     veh_id, int(target_lane), 100000)
 
-                if veh_id in self.vehicles.get_rl_ids():
+                if veh_id in rl_ids:
                     self.prev_last_lc[veh_id] = \
                         self.vehicles.get_state(veh_id, "last_lc")
 
@@ -825,8 +1373,9 @@ class Env(*classdef):
         """
         for i, veh_id in enumerate(veh_ids):
             if route_choices[i] is not None:
-                self.traci_connection.vehicle.setRoute(
-                    vehID=veh_id, edgeList=route_choices[i])
+                self.command_buffer.set_route(
+                    veh_id, route_choices[i],
+                    current_route=self.vehicles.get_route(veh_id) or None)
 
     def get_x_by_id(self, veh_id):
         """Provide a 1-D representation of the position of a vehicle.
@@ -867,9 +1416,7 @@ class Env(*classdef):
             of None should be returned
         """
         if self.env_params.sort_vehicles:
-            sorted_ids = sorted(
-                self.vehicles.get_ids(),
-                key=self.vehicles.get_absolute_position)
+            sorted_ids = self.vehicles.sort_by_absolute_position()
             return sorted_ids, None
         else:
             return self.vehicles.get_ids(), None
@@ -1007,6 +1554,12 @@ class Env(*classdef):
             length of the buffer
         """
         if self.sumo_params.render in ['gray', 'dgray', 'rgb', 'drgb']:
+            # send the state of the vehicles to the rendering process, which
+            # renders frames without blocking the simulation
+            if isinstance(self.renderer, AsyncRenderer):
+                self.renderer.submit(*self._get_render_data()[:4])
+                return
+
             # render a frame
             self.pyglet_render()
 
@@ -1022,49 +1575,64 @@ class Env(*classdef):
                     self.frame_buffer.pop(0)
                     self.sights_buffer.pop(0)
 
-    def pyglet_render(self):
-        """Render a frame using pyglet."""
+    def get_frame(self):
+        """Return the rendering of the current state of the simulation.
+
+        With asynchronous rendering (see SumoParams.async_render), this waits
+        for the rendering process to render the latest state of the vehicles.
 
-        # get human and RL simulation status
+        Returns
+        -------
+        np.ndarray
+            rendered frame
+        list of np.ndarray
+            local observations (sights) of the rl and tracked vehicles
+        """
+        if isinstance(self.renderer, AsyncRenderer):
+            self.frame, self.sights = self.renderer.get_frame()
+        return self.frame, self.sights
+
+    def _get_render_data(self):
+        """Collect the state of the vehicles needed by the pyglet renderer.
+
+        Human vehicles whose names contain "track" are rendered (and
+        observed) as rl vehicles.
+
+        Returns
+        -------
+        tuple of list
+            orientations, normalized speeds, and logs (timestep, timedelta,
+            and name) of the human and rl vehicles, ordered as the arguments
+            of PygletRenderer.render, followed by the names of the vehicles
+            rendered as rl vehicles
+        """
         human_idlist = self.vehicles.get_human_ids()
-        machine_idlist = self.vehicles.get_rl_ids()
-        human_logs = []
-        human_orientations = []
-        human_dynamics = []
-        machine_logs = []
-        machine_orientations = []
-        machine_dynamics = []
+        machine_idlist = [veh_id for veh_id in human_idlist
+                          if "track" in veh_id] + self.vehicles.get_rl_ids()
+        human_idlist = [veh_id for veh_id in human_idlist
+                        if "track" not in veh_id]
         max_speed = self.scenario.max_speed
-        for id in human_idlist:
-            # Force tracking human vehicles by adding "track" in vehicle id.
-            # The tracked human vehicles will be treated as machine vehicles.
-            if 'track' in id:
-                machine_logs.append(
-                    [self.vehicles.get_timestep(id),
-                     self.vehicles.get_timedelta(id),
-                     id])
-                machine_orientations.append(
-                    self.vehicles.get_orientation(id))
-                machine_dynamics.append(
-                    self.vehicles.get_speed(id)/max_speed)
-            else:
-                human_logs.append(
-                    [self.vehicles.get_timestep(id),
-                     self.vehicles.get_timedelta(id),
-                     id])
-                human_orientations.append(
-                    self.vehicles.get_orientation(id))
-                human_dynamics.append(
-                    self.vehicles.get_speed(id)/max_speed)
-        for id in machine_idlist:
-            machine_logs.append(
-                [self.vehicles.get_timestep(id),
-                 self.vehicles.get_timedelta(id),
-                 id])
-            machine_orientations.append(
-                self.vehicles.get_orientation(id))
-            machine_dynamics.append(
-                self.vehicles.get_speed(id)/max_speed)
+
+        data = []
+        for idlist in [human_idlist, machine_idlist]:
+            data.append([self.vehicles.get_orientation(veh_id)
+                         for veh_id in idlist])
+        for idlist in [human_idlist, machine_idlist]:
+            data.append([self.vehicles.get_speed(veh_id) / max_speed
+                         for veh_id in idlist])
+        for idlist in [human_idlist, machine_idlist]:
+            data.append([[self.vehicles.get_timestep(veh_id),
+                          self.vehicles.get_timedelta(veh_id),
+                          veh_id] for veh_id in idlist])
+        data.append(machine_idlist)
+
+        return tuple(data)
+
+    def pyglet_render(self):
+        """Render a frame using pyglet."""
+        human_orientations, machine_orientations, human_dynamics, \
+            machine_dynamics, human_logs, machine_logs, machine_idlist = \
+            self._get_render_data()
 
         # step the renderer
         self.frame = self.renderer.render(human_orientations,
@@ -1076,16 +1644,6 @@ class Env(*classdef):
 
         # get local observation of RL vehicles
         self.sights = []
-        for id in human_idlist:
-            # Force tracking human vehicles by adding "track" in vehicle id.
-            # The tracked human vehicles will be treated as machine vehicles.
-            if "track" in id:
-                orientation = self.vehicles.get_orientation(id)
-                sight = self.renderer.get_sight(
-                    orientation, id)
-                self.sights.append(sight)
-        for id in machine_idlist:
-            orientation = self.vehicles.get_orientation(id)
-            sight = self.renderer.get_sight(
-                orientation, id)
+        for id, orientation in zip(machine_idlist, machine_orientations):
+            sight = self.renderer.get_sight(orientation, id)
             self.sights.append(sight)
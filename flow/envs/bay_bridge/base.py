@@ -1,7 +1,7 @@
 import numpy as np
-from collections import defaultdict
 
 from flow.envs import Env
+from flow.core.infrastructure import TollPlaza, RampMeter
 
 EDGE_LIST = [
     '11198593', '236348360#1', '157598960', '11415208', '236348361',
@@ -60,16 +60,30 @@ class BayBridgeEnv(Env):
         vehicles collide into one another.
     """
 
+    # observations and rewards do not depend on the leaders of vehicles
+    vehicle_subscriptions = ()
+
     def __init__(self, env_params, sumo_params, scenario):
         self.num_rl = scenario.vehicles.num_rl_vehicles
         super().__init__(env_params, sumo_params, scenario)
-        self.edge_dict = defaultdict(list)
-        self.cars_waiting_for_toll = dict()
-        self.cars_before_ramp = dict()
-        self.toll_wait_time = np.abs(
-            np.random.normal(MEAN_SECONDS_WAIT_AT_TOLL / self.sim_step,
-                             4 / self.sim_step, NUM_TOLL_LANES))
-        self.tl_state = ""
+        self.toll_plaza = TollPlaza(
+            edge_before=EDGE_BEFORE_TOLL,
+            edge_after=EDGE_AFTER_TOLL,
+            tl_id=TB_TL_ID,
+            num_lanes=NUM_TOLL_LANES,
+            sim_step=self.sim_step,
+            booth_area=TOLL_BOOTH_AREA,
+            stop_position=120,
+            service_time=MEAN_SECONDS_WAIT_AT_TOLL,
+            fast_track_lanes=FAST_TRACK_ON,
+            fast_track_service_time=MEAN_SECONDS_WAIT_AT_FAST_TRACK)
+        self.ramp_meter = RampMeter(
+            edge_before=EDGE_BEFORE_RAMP_METER,
+            edge_after=EDGE_AFTER_RAMP_METER,
+            num_lanes=NUM_RAMP_METERS,
+            sim_step=self.sim_step,
+            meter_area=RAMP_METER_AREA,
+            color=(0, 255, 255, 0))
         self.disable_tb = False
         self.disable_ramp_metering = False
 
@@ -80,132 +94,34 @@ class BayBridgeEnv(Env):
             self.disable_ramp_metering = env_params.get_additional_param(
                 "disable_ramp_metering")
 
+    def reset(self):
+        """See parent class.
+
+        The toll booths and ramp meters are reset to their initial states.
+        """
+        self.toll_plaza.reset()
+        self.ramp_meter.reset()
+        return super().reset()
+
     def additional_command(self):
+        """See parent class.
+
+        Keeps vehicles in the right lane for their route, and updates the
+        toll booths and ramp meters (if active).
+        """
         super().additional_command()
-        # build a list of vehicles and their edges and positions
-        self.edge_dict = defaultdict(list)
-        # update the dict with all the edges in edge_list so we can look
-        # forward for edges
-        self.edge_dict.update(
-            (k, [[] for _ in range(MAX_LANES)]) for k in EDGE_LIST)
-        for veh_id in self.vehicles.get_ids():
-            edge = self.vehicles.get_edge(veh_id)
-            if edge not in self.edge_dict:
-                self.edge_dict.update({edge: [[] for _ in range(MAX_LANES)]})
-            lane = self.vehicles.get_lane(veh_id)  # integer
-            pos = self.vehicles.get_position(veh_id)
-
-            # perform necessary lane change actions to keep vehicle in the
-            # right route
-            self.edge_dict[edge][lane].append((veh_id, pos))
-            if edge == "124952171" and lane == 1:
-                self.apply_lane_change([veh_id], direction=[1])
+
+        # perform necessary lane change actions to keep vehicles in the right
+        # route
+        lanes = self.vehicles.get_vehicles_by_lane("124952171")
+        if len(lanes) > 1 and len(lanes[1]) > 0:
+            veh_ids = [veh_id for veh_id, _ in lanes[1]]
+            self.apply_lane_change(veh_ids, direction=[1] * len(veh_ids))
 
         if not self.disable_tb:
-            self.apply_toll_bridge_control()
+            self.toll_plaza.update(self)
         if not self.disable_ramp_metering:
-            self.ramp_meter_lane_change_control()
-
-    def ramp_meter_lane_change_control(self):
-        cars_that_have_left = []
-        for veh_id in self.cars_before_ramp:
-            if self.vehicles.get_edge(veh_id) == EDGE_AFTER_RAMP_METER:
-                lane_change_mode = self.cars_before_ramp[veh_id][
-                    "lane_change_mode"]
-                color = self.cars_before_ramp[veh_id]["color"]
-                self.traci_connection.vehicle.setColor(veh_id, color)
-                self.traci_connection.vehicle.setLaneChangeMode(
-                    veh_id, lane_change_mode)
-
-                cars_that_have_left.append(veh_id)
-
-        for veh_id in cars_that_have_left:
-            self.cars_before_ramp.__delitem__(veh_id)
-
-        for lane in range(NUM_RAMP_METERS):
-            cars_in_lane = self.edge_dict[EDGE_BEFORE_RAMP_METER][lane]
-
-            for car in cars_in_lane:
-                veh_id, pos = car
-                if pos > RAMP_METER_AREA:
-                    if veh_id not in self.cars_waiting_for_toll:
-                        # Disable lane changes inside Toll Area
-                        lane_change_mode = self.vehicles.get_lane_change_mode(
-                            veh_id)
-                        color = self.traci_connection.vehicle.getColor(veh_id)
-                        self.cars_before_ramp[veh_id] = {
-                            "lane_change_mode": lane_change_mode,
-                            "color": color
-                        }
-                        self.traci_connection.vehicle.setLaneChangeMode(
-                            veh_id, 512)
-                        self.traci_connection.vehicle.setColor(
-                            veh_id, (0, 255, 255, 0))
-
-    def apply_toll_bridge_control(self):
-        cars_that_have_left = []
-        for veh_id in self.cars_waiting_for_toll:
-            if self.vehicles.get_edge(veh_id) == EDGE_AFTER_TOLL:
-                lane = self.vehicles.get_lane(veh_id)
-                lane_change_mode = \
-                    self.cars_waiting_for_toll[veh_id]["lane_change_mode"]
-                color = self.cars_waiting_for_toll[veh_id]["color"]
-                self.traci_connection.vehicle.setColor(veh_id, color)
-                self.traci_connection.vehicle.setLaneChangeMode(
-                    veh_id, lane_change_mode)
-                if lane not in FAST_TRACK_ON:
-                    self.toll_wait_time[lane] = max(
-                        0,
-                        np.random.normal(
-                            loc=MEAN_SECONDS_WAIT_AT_TOLL / self.sim_step,
-                            scale=1 / self.sim_step))
-                else:
-                    self.toll_wait_time[lane] = max(
-                        0,
-                        np.random.normal(
-                            loc=MEAN_SECONDS_WAIT_AT_FAST_TRACK /
-                            self.sim_step,
-                            scale=1 / self.sim_step))
-
-                cars_that_have_left.append(veh_id)
-
-        for veh_id in cars_that_have_left:
-            self.cars_waiting_for_toll.__delitem__(veh_id)
-
-        traffic_light_states = ["G"] * NUM_TOLL_LANES
-
-        for lane in range(NUM_TOLL_LANES):
-            cars_in_lane = self.edge_dict[EDGE_BEFORE_TOLL][lane]
-
-            for car in cars_in_lane:
-                veh_id, pos = car
-                if pos > TOLL_BOOTH_AREA:
-                    if veh_id not in self.cars_waiting_for_toll:
-                        # Disable lane changes inside Toll Area
-                        lc_mode = self.vehicles.get_lane_change_mode(veh_id)
-                        color = self.traci_connection.vehicle.getColor(veh_id)
-                        self.cars_waiting_for_toll[veh_id] = {
-                            "lane_change_mode": lc_mode,
-                            "color": color
-                        }
-                        self.traci_connection.vehicle.setLaneChangeMode(
-                            veh_id, 512)
-                        self.traci_connection.vehicle.setColor(
-                            veh_id, (255, 0, 255, 0))
-                    else:
-                        if pos > 120:
-                            if self.toll_wait_time[lane] < 0:
-                                traffic_light_states[lane] = "G"
-                            else:
-                                traffic_light_states[lane] = "r"
-                                self.toll_wait_time[lane] -= 1
-
-        new_tls_state = "".join(traffic_light_states)
-
-        if new_tls_state != self.tl_state:
-            self.tl_state = new_tls_state
-            self.traci_connection.trafficlight.setRedYellowGreenState(
-                tlsID=TB_TL_ID, state=new_tls_state)
+            self.ramp_meter.update(self)
 
     # TODO: decide on a good reward function
     def compute_reward(self, rl_actions, **kwargs):
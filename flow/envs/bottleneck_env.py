@@ -10,8 +10,9 @@ from flow.controllers.lane_change_controllers import SumoLaneChangeController
 from flow.controllers.routing_controllers import ContinuousRouter
 from flow.core.params import InFlows, NetParams
 from flow.core.vehicles import Vehicles
+from flow.core.infrastructure import TollPlaza, RampMeter
+from flow.core.agent_slots import AgentSlots
 
-from collections import defaultdict
 from copy import deepcopy
 
 import numpy as np
@@ -113,16 +114,21 @@ class BottleneckEnv(Env):
         env_add_params = self.env_params.additional_params
         # tells how scaled the number of lanes are
         self.scaling = scenario.net_params.additional_params.get("scaling")
-        self.edge_dict = defaultdict(list)
-        self.cars_waiting_for_toll = dict()
-        self.cars_before_ramp = dict()
-        self.toll_wait_time = np.abs(
-            np.random.normal(MEAN_NUM_SECONDS_WAIT_AT_TOLL / self.sim_step,
-                             4 / self.sim_step, NUM_TOLL_LANES * self.scaling))
         self.fast_track_lanes = range(
             int(np.ceil(1.5 * self.scaling)), int(np.ceil(2.6 * self.scaling)))
 
-        self.tl_state = ""
+        self.toll_plaza = TollPlaza(
+            edge_before=EDGE_BEFORE_TOLL,
+            edge_after=EDGE_AFTER_TOLL,
+            tl_id=TB_TL_ID,
+            num_lanes=NUM_TOLL_LANES * self.scaling,
+            sim_step=self.sim_step,
+            booth_area=TOLL_BOOTH_AREA,
+            stop_position=50,
+            service_time=MEAN_NUM_SECONDS_WAIT_AT_TOLL,
+            fast_track_lanes=self.fast_track_lanes,
+            fast_track_service_time=MEAN_NUM_SECONDS_WAIT_AT_FAST_TRACK)
+
         self.disable_tb = env_params.get_additional_param("disable_tb")
         self.disable_ramp_metering = \
             env_params.get_additional_param("disable_ramp_metering")
@@ -131,58 +137,42 @@ class BottleneckEnv(Env):
         self.next_period = START_RECORD_TIME / self.sim_step
         self.cars_arrived = 0
 
-        # values for the ramp meter
-        self.n_crit = env_add_params.get("n_crit", 8)
-        self.q_max = env_add_params.get("q_max", 1100)
-        self.q_min = env_add_params.get("q_min", .25 * 1100)
-        self.q = self.q_min  # ramp meter feedback controller
-        self.feedback_update_time = env_add_params.get("feedback_update", 15)
-        self.feedback_timer = 0.0
-        self.cycle_time = 6
-        cycle_offset = 8
-        self.ramp_state = np.linspace(0,
-                                      cycle_offset * self.scaling * MAX_LANES,
-                                      self.scaling * MAX_LANES)
-        self.green_time = 4
-        self.red_min = 2
-        self.feedback_coeff = env_add_params.get("feedback_coeff", 20)
-
-        self.smoothed_num = np.zeros(10)  # averaged number of vehs in '4'
-        self.outflow_index = 0
+        # ramp meters, controlled by the ALINEA feedback controller based on
+        # the number of vehicles in the bottleneck
+        self.ramp_meter = RampMeter(
+            edge_before=EDGE_BEFORE_RAMP_METER,
+            edge_after=EDGE_AFTER_RAMP_METER,
+            num_lanes=NUM_RAMP_METERS * self.scaling,
+            sim_step=self.sim_step,
+            meter_area=RAMP_METER_AREA,
+            tl_id="3",
+            feedback_edges=["4"],
+            n_crit=env_add_params.get("n_crit", 8),
+            q_max=env_add_params.get("q_max", 1100),
+            q_min=env_add_params.get("q_min", .25 * 1100),
+            feedback_update_time=env_add_params.get("feedback_update", 15),
+            feedback_coeff=env_add_params.get("feedback_coeff", 20))
+
+    def reset(self):
+        """See parent class.
+
+        The toll booths and ramp meters are reset to their initial states.
+        """
+        self.toll_plaza.reset()
+        self.ramp_meter.reset()
+        return super().reset()
 
     def additional_command(self):
-        # print(self.vehicles.get_outflow_rate(100))
+        """See parent class.
+
+        Updates the toll booths and ramp meters (if active), and the number
+        of vehicles that exited the network in the current period.
+        """
         super().additional_command()
-        # build a list of vehicles and their edges and positions
-        self.edge_dict = defaultdict(list)
-        # update the dict with all the edges in edge_list
-        # so we can look forward for edges
-        self.edge_dict.update((k, [[]
-                                   for _ in range(MAX_LANES * self.scaling)])
-                              for k in EDGE_LIST)
-        for veh_id in self.vehicles.get_ids():
-            try:
-                edge = self.vehicles.get_edge(veh_id)
-                if edge not in self.edge_dict:
-                    self.edge_dict.update({
-                        edge: [[] for _ in range(MAX_LANES * self.scaling)]
-                    })
-                lane = self.vehicles.get_lane(veh_id)  # integer
-                pos = self.vehicles.get_position(veh_id)
-                self.edge_dict[edge][lane].append((veh_id, pos))
-            except Exception:
-                pass
         if not self.disable_tb:
-            self.apply_toll_bridge_control()
+            self.toll_plaza.update(self)
         if not self.disable_ramp_metering:
-            self.ramp_meter_lane_change_control()
-            self.alinea()
-
-        # compute the outflow
-        veh_ids = self.vehicles.get_ids_by_edge('4')
-        self.smoothed_num[self.outflow_index] = len(veh_ids)
-        self.outflow_index = \
-            (self.outflow_index + 1) % self.smoothed_num.shape[0]
+            self.ramp_meter.update(self)
 
         if self.time_counter > self.next_period:
             self.density = self.cars_arrived  # / (PERIOD/self.sim_step)
@@ -192,129 +182,6 @@ class BottleneckEnv(Env):
 
         self.cars_arrived += self.vehicles.get_num_arrived()
 
-    def ramp_meter_lane_change_control(self):
-        cars_that_have_left = []
-        for veh_id in self.cars_before_ramp:
-            if self.vehicles.get_edge(veh_id) == EDGE_AFTER_RAMP_METER:
-                lane_change_mode = \
-                    self.cars_before_ramp[veh_id]["lane_change_mode"]
-                color = self.cars_before_ramp[veh_id]["color"]
-                self.traci_connection.vehicle.setColor(veh_id, color)
-                self.traci_connection.vehicle.setLaneChangeMode(
-                    veh_id, lane_change_mode)
-
-                cars_that_have_left.append(veh_id)
-
-        for veh_id in cars_that_have_left:
-            self.cars_before_ramp.__delitem__(veh_id)
-
-        for lane in range(NUM_RAMP_METERS * self.scaling):
-            cars_in_lane = self.edge_dict[EDGE_BEFORE_RAMP_METER][lane]
-
-            for car in cars_in_lane:
-                veh_id, pos = car
-                if pos > RAMP_METER_AREA:
-                    if veh_id not in self.cars_waiting_for_toll:
-                        traci_veh = self.traci_connection.vehicle
-                        # Disable lane changes inside Toll Area
-                        lane_change_mode = \
-                            self.vehicles.get_lane_change_mode(veh_id)
-                        color = traci_veh.getColor(veh_id)
-                        self.cars_before_ramp[veh_id] = {
-                            "lane_change_mode": lane_change_mode,
-                            "color": color
-                        }
-                        traci_veh.setLaneChangeMode(veh_id, 512)
-                        traci_veh.setColor(veh_id, (0, 255, 255, 255))
-
-    def alinea(self):
-        """Implementation of ALINEA from Toll Plaza Merging Traffic Control
-           for Throughput Maximization"""
-        self.feedback_timer += self.sim_step
-        self.ramp_state += self.sim_step
-        if self.feedback_timer > self.feedback_update_time:
-            self.feedback_timer = 0
-            # now implement the integral controller update
-            # find all the vehicles in an edge
-            q_update = self.feedback_coeff * (
-                self.n_crit - np.average(self.smoothed_num))
-            self.q = np.clip(
-                self.q + q_update, a_min=self.q_min, a_max=self.q_max)
-            # convert q to cycle time
-            self.cycle_time = 7200 / self.q
-
-        # now apply the ramp meter
-        self.ramp_state %= self.cycle_time
-        # step through, if the value of tl_state is below self.green_time
-        # we should be green, otherwise we should be red
-        tl_mask = (self.ramp_state <= self.green_time)
-        colors = ['G' if val else 'r' for val in tl_mask]
-        self.traffic_lights.set_state('3', ''.join(colors), self)
-
-    def apply_toll_bridge_control(self):
-        cars_that_have_left = []
-        for veh_id in self.cars_waiting_for_toll:
-            if self.vehicles.get_edge(veh_id) == EDGE_AFTER_TOLL:
-                lane = self.vehicles.get_lane(veh_id)
-                lane_change_mode = \
-                    self.cars_waiting_for_toll[veh_id]["lane_change_mode"]
-                color = self.cars_waiting_for_toll[veh_id]["color"]
-                self.traci_connection.vehicle.setColor(veh_id, color)
-                self.traci_connection.vehicle.setLaneChangeMode(
-                    veh_id, lane_change_mode)
-                if lane not in self.fast_track_lanes:
-                    self.toll_wait_time[lane] = max(
-                        0,
-                        np.random.normal(
-                            MEAN_NUM_SECONDS_WAIT_AT_TOLL / self.sim_step,
-                            1 / self.sim_step))
-                else:
-                    self.toll_wait_time[lane] = max(
-                        0,
-                        np.random.normal(
-                            MEAN_NUM_SECONDS_WAIT_AT_FAST_TRACK /
-                            self.sim_step, 1 / self.sim_step))
-
-                cars_that_have_left.append(veh_id)
-
-        for veh_id in cars_that_have_left:
-            self.cars_waiting_for_toll.__delitem__(veh_id)
-
-        traffic_light_states = ["G"] * NUM_TOLL_LANES * self.scaling
-
-        for lane in range(NUM_TOLL_LANES * self.scaling):
-            cars_in_lane = self.edge_dict[EDGE_BEFORE_TOLL][lane]
-
-            for car in cars_in_lane:
-                veh_id, pos = car
-                if pos > TOLL_BOOTH_AREA:
-                    if veh_id not in self.cars_waiting_for_toll:
-                        # Disable lane changes inside Toll Area
-                        lane_change_mode = \
-                            self.vehicles.get_lane_change_mode(veh_id)
-                        color = self.traci_connection.vehicle.getColor(veh_id)
-                        self.cars_waiting_for_toll[veh_id] = \
-                            {"lane_change_mode": lane_change_mode,
-                             "color": color}
-                        self.traci_connection.vehicle.setLaneChangeMode(
-                            veh_id, 512)
-                        self.traci_connection.vehicle.setColor(
-                            veh_id, (255, 0, 255, 0))
-                    else:
-                        if pos > 50:
-                            if self.toll_wait_time[lane] < 0:
-                                traffic_light_states[lane] = "G"
-                            else:
-                                traffic_light_states[lane] = "r"
-                                self.toll_wait_time[lane] -= 1
-
-        newTLState = "".join(traffic_light_states)
-
-        if newTLState != self.tl_state:
-            self.tl_state = newTLState
-            self.traci_connection.trafficlight.setRedYellowGreenState(
-                tlsID=TB_TL_ID, state=newTLState)
-
     def distance_to_bottleneck(self, veh_id):
         pre_bottleneck_edges = {
             str(i): self.scenario.edge_length(str(i))
@@ -392,8 +259,8 @@ class BottleNeckAccelEnv(BottleneckEnv):
            in front and behind the AV for all lanes. Additionally, we pass the
            density and average velocity of all edges. Finally, we pad with
            zeros in case an AV has exited the system.
-           Note: the vehicles are arranged in an initial order, so we pad
-           the missing vehicle at its normal position in the order
+           Note: every AV is assigned a fixed slot in the observation (in
+           its initial order), so we pad the missing vehicle at its slot
 
        Actions
            The action space consist of a list in which the first half
@@ -418,6 +285,24 @@ class BottleNeckAccelEnv(BottleneckEnv):
 
         super().__init__(env_params, sumo_params, scenario)
         self.add_rl_if_exit = env_params.get_additional_param("add_rl_if_exit")
+        self.lane_change_duration = \
+            env_params.get_additional_param("lane_change_duration")
+
+        # slots of the rl vehicles in the state and action spaces. The
+        # initial rl vehicles keep their slot when they are reintroduced
+        self.rl_slots = AgentSlots(self.num_rl)
+        for i, rl_id in enumerate(self.rl_id_list[:self.num_rl]):
+            self.rl_slots.reserve(rl_id, i)
+
+    @property
+    def action_space(self):
+        """See class definition."""
+        max_decel = self.env_params.additional_params["max_decel"]
+        max_accel = self.env_params.additional_params["max_accel"]
+        lb = [-abs(max_decel), -1] * self.num_rl
+        ub = [max_accel, 1] * self.num_rl
+
+        return Box(np.array(lb), np.array(ub), dtype=np.float32)
 
     @property
     def observation_space(self):
@@ -433,21 +318,16 @@ class BottleNeckAccelEnv(BottleneckEnv):
         """See class definition."""
         headway_scale = 1000
 
-        rl_ids = self.vehicles.get_rl_ids()
+        self.rl_slots.sync(self.vehicles.get_rl_ids())
+        num_lanes = MAX_LANES * self.scaling
 
         # rl vehicle data (absolute position, speed, and lane index)
-        rl_obs = np.empty(0)
-        id_counter = 0
-        for veh_id in rl_ids:
-            # check if we have skipped a vehicle, if not, pad
-            rl_id_num = self.rl_id_list.index(veh_id)
-            if rl_id_num != id_counter:
-                rl_obs = np.concatenate(
-                    (rl_obs, np.zeros(4 * (rl_id_num - id_counter))))
-                id_counter = rl_id_num + 1
-            else:
-                id_counter += 1
+        rl_obs = np.zeros((self.num_rl, 4))
+        # relative vehicles data (lane headways, tailways, vel_ahead, and
+        # vel_behind)
+        relative_obs = np.zeros((self.num_rl, 4, num_lanes))
 
+        for slot, veh_id in self.rl_slots.items():
             # get the edge and convert it to a number
             edge_num = self.vehicles.get_edge(veh_id)
             if edge_num is None:
@@ -458,39 +338,15 @@ class BottleNeckAccelEnv(BottleneckEnv):
                 edge_num = -1
             else:
                 edge_num = int(edge_num) / 6
-            rl_obs = np.concatenate((rl_obs, [
+            rl_obs[slot] = [
                 self.get_x_by_id(veh_id) / 1000,
                 (self.vehicles.get_speed(veh_id) / self.max_speed),
                 (self.vehicles.get_lane(veh_id) / MAX_LANES), edge_num
-            ]))
-        # if all the missing vehicles are at the end, pad
-        diff = self.num_rl - int(rl_obs.shape[0] / 4)
-        if diff > 0:
-            rl_obs = np.concatenate((rl_obs, np.zeros(4 * diff)))
+            ]
 
-        # relative vehicles data (lane headways, tailways, vel_ahead, and
-        # vel_behind)
-        relative_obs = np.empty(0)
-        id_counter = 0
-        for veh_id in rl_ids:
-            # check if we have skipped a vehicle, if not, pad
-            rl_id_num = self.rl_id_list.index(veh_id)
-            if rl_id_num != id_counter:
-                pad_mat = np.zeros(
-                    4 * MAX_LANES * self.scaling * (rl_id_num - id_counter))
-                relative_obs = np.concatenate((relative_obs, pad_mat))
-                id_counter = rl_id_num + 1
-            else:
-                id_counter += 1
-            num_lanes = MAX_LANES * self.scaling
-            headway = np.asarray([1000
-                                  for _ in range(num_lanes)]) / headway_scale
-            tailway = np.asarray([1000
-                                  for _ in range(num_lanes)]) / headway_scale
-            vel_in_front = np.asarray([0 for _ in range(num_lanes)
-                                       ]) / self.max_speed
-            vel_behind = np.asarray([0 for _ in range(num_lanes)
-                                     ]) / self.max_speed
+            headway, tailway, vel_in_front, vel_behind = relative_obs[slot]
+            headway[:] = 1000 / headway_scale
+            tailway[:] = 1000 / headway_scale
 
             lane_leaders = self.vehicles.get_lane_leaders(veh_id)
             lane_followers = self.vehicles.get_lane_followers(veh_id)
@@ -509,15 +365,6 @@ class BottleNeckAccelEnv(BottleneckEnv):
                     vel_behind[i] = (self.vehicles.get_speed(lane_follower) /
                                      self.max_speed)
 
-            relative_obs = np.concatenate((relative_obs, headway, tailway,
-                                           vel_in_front, vel_behind))
-
-        # if all the missing vehicles are at the end, pad
-        diff = self.num_rl - int(relative_obs.shape[0] / (4 * MAX_LANES))
-        if diff > 0:
-            relative_obs = np.concatenate((relative_obs,
-                                           np.zeros(4 * MAX_LANES * diff)))
-
         # per edge data (average speed, density
         edge_obs = []
         for edge in self.scenario.get_edge_list():
@@ -530,19 +377,27 @@ class BottleNeckAccelEnv(BottleneckEnv):
             else:
                 edge_obs += [0, 0]
 
-        return np.concatenate((rl_obs, relative_obs, edge_obs))
+        # the slots of missing vehicles are padded with zeros
+        return np.concatenate((self.rl_slots.pad(rl_obs).flatten(),
+                               self.rl_slots.pad(relative_obs).flatten(),
+                               edge_obs))
 
     def compute_reward(self, rl_actions, **kwargs):
         """See class definition."""
-        num_rl = self.vehicles.num_rl_vehicles
-        lane_change_acts = np.abs(np.round(rl_actions[1::2])[:num_rl])
+        _, actions = self.rl_slots.split_actions(rl_actions, 2)
+        lane_change_acts = np.abs(np.round(actions[:, 1]))
         return (rewards.desired_velocity(self) + rewards.rl_forward_progress(
             self, gain=0.1) - rewards.boolean_action_penalty(
                 lane_change_acts, gain=1.0))
 
     def sort_by_position(self):
         if self.env_params.sort_vehicles:
-            sorted_ids = sorted(self.vehicles.get_ids(), key=self.get_x_by_id)
+            veh_ids = self.vehicles.get_ids()
+            pos = self.scenario.topology.get_x_list(
+                self.vehicles.get_edge(veh_ids),
+                self.vehicles.get_position(veh_ids), empty=0)
+            sorted_ids = [veh_ids[i] for i in
+                          np.argsort(pos, kind="mergesort")]
             return sorted_ids, None
         else:
             return self.vehicles.get_ids(), None
@@ -557,27 +412,24 @@ class BottleNeckAccelEnv(BottleneckEnv):
         for actions during that lane change. if a lane change isn't applied,
         and sufficient time has passed, issue an acceleration like normal.
         """
-        num_rl = self.vehicles.num_rl_vehicles
-        acceleration = actions[::2][:num_rl]
-        direction = np.round(actions[1::2])[:num_rl]
-
-        # re-arrange actions according to mapping in observation space
-        sorted_rl_ids = [
-            veh_id for veh_id in self.sorted_ids
-            if veh_id in self.vehicles.get_rl_ids()
-        ]
+        # actions are mapped to vehicles according to their observation
+        # slot, skipping the vehicles that exited since the slots were last
+        # synced (e.g. in between the sub-steps of a step)
+        rl_ids, actions = self.rl_slots.split_actions(
+            actions, 2, veh_ids=self.vehicles.get_rl_ids())
+        acceleration = actions[:, 0]
+        direction = np.round(actions[:, 1])
 
         # represents vehicles that are allowed to change lanes
-        non_lane_changing_veh = \
+        non_lane_changing_veh = np.array(
             [self.time_counter <= self.lane_change_duration
              + self.vehicles.get_state(veh_id, 'last_lc')
-             for veh_id in sorted_rl_ids]
+             for veh_id in rl_ids], dtype=bool)
         # vehicle that are not allowed to change have their directions set to 0
-        direction[non_lane_changing_veh] = \
-            np.array([0] * sum(non_lane_changing_veh))
+        direction[non_lane_changing_veh] = 0
 
-        self.apply_acceleration(sorted_rl_ids, acc=acceleration)
-        self.apply_lane_change(sorted_rl_ids, direction=direction)
+        self.apply_acceleration(rl_ids, acc=acceleration)
+        self.apply_lane_change(rl_ids, direction=direction)
 
     def additional_command(self):
         super().additional_command()
@@ -591,7 +443,9 @@ class BottleNeckAccelEnv(BottleneckEnv):
                 # distribute rl cars evenly over lanes
                 lane_num = self.rl_id_list.index(rl_id) % \
                            MAX_LANES * self.scaling
-                # reintroduce it at the start of the network
+                # reintroduce it at the start of the network, without the
+                # commands meant for the exited vehicle
+                self.command_buffer.discard(rl_id)
                 try:
                     self.traci_connection.vehicle.addFull(
                         rl_id,
@@ -1,3 +1,4 @@
+import itertools
 import numpy as np
 import re
 
@@ -63,6 +64,9 @@ class TrafficLightGridEnv(Env):
         vehicles.
     """
 
+    # observations and rewards do not depend on the leaders of vehicles
+    vehicle_subscriptions = ()
+
     def __init__(self, env_params, sumo_params, scenario):
 
         for p in ADDITIONAL_ENV_PARAMS.keys():
@@ -88,6 +92,12 @@ class TrafficLightGridEnv(Env):
         }
         self.node_mapping = scenario.get_node_mapping()
 
+        # static edge lengths and normalizers used by the observations
+        self.edge_lengths = {edge: scenario.edge_length(edge)
+                             for edge in scenario.get_edge_list()}
+        self.max_dist = max(scenario.short_length, scenario.long_length,
+                            scenario.inner_length)
+
         # keeps track of the last time the light was allowed to change.
         self.last_change = np.zeros((self.rows * self.cols, 3))
 
@@ -154,9 +164,7 @@ class TrafficLightGridEnv(Env):
 
     def get_state(self):
         """See class definition."""
-        # compute the normalizers
-        max_dist = max(self.scenario.short_length, self.scenario.long_length,
-                       self.scenario.inner_length)
+        max_dist = self.max_dist
 
         # get the state arrays
         speeds = [
@@ -386,8 +394,9 @@ class TrafficLightGridEnv(Env):
 
         if route_id is not None:
             route_id = "route" + route_id
-            # remove the vehicle
+            # remove the vehicle, along with the commands meant for it
             self.traci_connection.vehicle.remove(veh_id)
+            self.command_buffer.discard(veh_id)
             # reintroduce it at the start of the network
             type_id = self.vehicles.get_state(veh_id, "type")
             lane_index = self.vehicles.get_lane(veh_id)
@@ -409,26 +418,56 @@ class TrafficLightGridEnv(Env):
         """
         if k < 0:
             raise IndexError("k must be greater than 0")
-        dists = []
+        if not isinstance(edges, list):
+            edges = [edges]
+        closest_ids, _ = self.closest_to_intersection(edges, k)
+        return list(itertools.chain.from_iterable(closest_ids))
 
-        def sort_lambda(veh_id):
-            return self.get_distance_to_intersection(veh_id)
+    def closest_to_intersection(self, edges, k):
+        """Return the k closest vehicles to the downstream node of each edge.
 
-        if isinstance(edges, list):
-            for edge in edges:
-                vehicles = self.vehicles.get_ids_by_edge(edge)
-                dist = sorted(
-                    vehicles,
-                    key=sort_lambda
-                )
-                dists += dist[:k]
-        else:
-            vehicles = self.vehicles.get_ids_by_edge(edges)
-            dist = sorted(
-                vehicles,
-                key=lambda veh_id: self.get_distance_to_intersection(veh_id))
-            dists += dist[:k]
-        return dists
+        The distances of all vehicles on the edges to the node they are
+        heading toward are computed at once, and only the k closest vehicles
+        of every edge are selected (through a partial sort) and sorted.
+
+        Parameters
+        ----------
+        edges : list of str
+            names of the edges
+        k : int
+            maximum number of vehicles per edge
+
+        Returns
+        -------
+        list of list of str
+            names of the (at most) k closest vehicles of every edge, sorted
+            by distance to the downstream node
+        np.ndarray
+            distances of these vehicles to the downstream node, one row of k
+            elements per edge. The entries of missing vehicles are zero.
+        """
+        ids = [self.vehicles.get_ids_by_edge(edge) for edge in edges]
+        counts = [len(edge_ids) for edge_ids in ids]
+        lengths = np.repeat([self.edge_lengths[edge] for edge in edges],
+                            counts)
+        dists = lengths - np.asarray(self.vehicles.get_position(
+            list(itertools.chain.from_iterable(ids))), dtype=float)
+
+        closest_ids = []
+        closest_dists = np.zeros((len(edges), k))
+        start = 0
+        for i, count in enumerate(counts):
+            edge_dists = dists[start:start + count]
+            start += count
+            if count > k:
+                index = np.argpartition(edge_dists, k)[:k]
+            else:
+                index = np.arange(count)
+            index = index[np.argsort(edge_dists[index], kind="mergesort")]
+            closest_ids.append([ids[i][j] for j in index])
+            closest_dists[i, :len(index)] = edge_dists[index]
+
+        return closest_ids, closest_dists
 
 
 class PO_TrafficLightGridEnv(TrafficLightGridEnv):
@@ -483,6 +522,13 @@ class PO_TrafficLightGridEnv(TrafficLightGridEnv):
         # used during visualization
         self.observed_ids = []
 
+        # edges heading toward each node, and their normalized edge numbers
+        self.incoming_edges = [edge for _, edges in self.node_mapping
+                               for edge in edges]
+        self.incoming_edge_numbers = np.array(
+            self._convert_edge(self.incoming_edges)) \
+            / (self.scenario.num_edges - 1)
+
     @property
     def observation_space(self):
         """
@@ -506,65 +552,37 @@ class PO_TrafficLightGridEnv(TrafficLightGridEnv):
         light and for each vehicle its velocity, distance to intersection,
         edge_number traffic light state. This is partially observed
         """
-        speeds = []
-        dist_to_intersec = []
-        edge_number = []
-        max_speed = max(
-            self.scenario.speed_limit(edge)
-            for edge in self.scenario.get_edge_list())
-        max_dist = max(self.scenario.short_length, self.scenario.long_length,
-                       self.scenario.inner_length)
-        all_observed_ids = []
-
-        for node, edges in self.scenario.get_node_mapping():
-            for edge in edges:
-                observed_ids = \
-                    self.k_closest_to_intersection(edge, self.num_observed)
-                all_observed_ids += observed_ids
-
-                # check which edges we have so we can always pad in the right
-                # positions
-                speeds += [
-                    self.vehicles.get_speed(veh_id) / max_speed
-                    for veh_id in observed_ids
-                ]
-                dist_to_intersec += [
-                    (self.scenario.edge_length(self.vehicles.get_edge(veh_id))
-                     - self.vehicles.get_position(veh_id)) / max_dist
-                    for veh_id in observed_ids
-                ]
-                edge_number += \
-                    [self._convert_edge(self.vehicles.get_edge(veh_id))
-                     / (self.scenario.num_edges - 1)
-                     for veh_id in observed_ids]
-
-                if len(observed_ids) < self.num_observed:
-                    diff = self.num_observed - len(observed_ids)
-                    speeds += [0] * diff
-                    dist_to_intersec += [0] * diff
-                    edge_number += [0] * diff
+        max_speed = self.scenario.max_speed
+
+        # the k closest vehicles of every edge heading toward a node. The
+        # entries of missing vehicles are padded with zeros.
+        observed_ids, dist_to_intersec = self.closest_to_intersection(
+            self.incoming_edges, self.num_observed)
+        speeds = np.zeros_like(dist_to_intersec)
+        edge_number = np.zeros_like(dist_to_intersec)
+        for i, ids in enumerate(observed_ids):
+            speeds[i, :len(ids)] = self.vehicles.get_speed(ids)
+            edge_number[i, :len(ids)] = self.incoming_edge_numbers[i]
+        speeds /= max_speed
+        dist_to_intersec /= self.max_dist
 
         # now add in the density and average velocity on the edges
-        density = []
-        velocity_avg = []
-        for edge in self.scenario.get_edge_list():
+        edge_list = self.scenario.get_edge_list()
+        density = np.zeros(len(edge_list))
+        velocity_avg = np.zeros(len(edge_list))
+        for i, edge in enumerate(edge_list):
             ids = self.vehicles.get_ids_by_edge(edge)
             if len(ids) > 0:
-                density += [5 * len(ids) / self.scenario.edge_length(edge)]
-                velocity_avg += [
-                    np.mean(
-                        [self.vehicles.get_speed(veh_id)
-                         for veh_id in ids]) / max_speed
-                ]
-            else:
-                density += [0]
-                velocity_avg += [0]
-        self.observed_ids = all_observed_ids
-        return np.array(
-            np.concatenate([
-                speeds, dist_to_intersec, edge_number, density, velocity_avg,
-                self.last_change.flatten().tolist()
-            ]))
+                density[i] = 5 * len(ids) / self.edge_lengths[edge]
+                velocity_avg[i] = \
+                    np.mean(self.vehicles.get_speed(ids)) / max_speed
+
+        self.observed_ids = list(itertools.chain.from_iterable(observed_ids))
+        return np.concatenate([
+            speeds.flatten(), dist_to_intersec.flatten(),
+            edge_number.flatten(), density, velocity_avg,
+            self.last_change.flatten()
+        ])
 
     def compute_reward(self, rl_actions, **kwargs):
         """See class definition."""
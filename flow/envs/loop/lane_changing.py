@@ -60,6 +60,10 @@ class LaneChangeAccelEnv(Env):
         vehicles collide into one another.
     """
 
+    # observed vehicles (see additional_command) only matter for rendering,
+    # so they may be skipped during warm-up
+    warmup_fast_forward = True
+
     def __init__(self, env_params, sumo_params, scenario):
         for p in ADDITIONAL_ENV_PARAMS.keys():
             if p not in env_params.additional_params:
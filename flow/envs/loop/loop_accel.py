@@ -48,6 +48,10 @@ class AccelEnv(Env):
         vehicles collide into one another.
     """
 
+    # the additional commands only select the vehicles observed for
+    # visualization, and are not needed during warm-up steps
+    warmup_fast_forward = True
+
     def __init__(self, env_params, sumo_params, scenario):
         for p in ADDITIONAL_ENV_PARAMS.keys():
             if p not in env_params.additional_params:
@@ -30,6 +30,32 @@ ADDITIONAL_ENV_PARAMS = {
 }
 
 
+def v_eq_max_function(v, length, num_vehicles):
+    """Return the error in the equilibrium speed of a ring with one rl car.
+
+    Parameters
+    ----------
+    v : float
+        candidate equilibrium speed
+    length : float
+        length of the ring road
+    num_vehicles : int
+        total number of vehicles in the ring (including the rl vehicle)
+    """
+    num_veh = num_vehicles - 1
+    # maximum gap in the presence of one rl vehicle
+    s_eq_max = (length - num_vehicles * 5) / num_veh
+
+    v0 = 30
+    s0 = 2
+    T = 1
+    gamma = 4
+
+    error = s_eq_max - (s0 + v * T) * (1 - (v / v0)**gamma)**-0.5
+
+    return error
+
+
 class WaveAttenuationEnv(Env):
     """Fully observable wave attenuation environment.
 
@@ -43,6 +69,15 @@ class WaveAttenuationEnv(Env):
     * ring_length: bounds on the ranges of ring road lengths the autonomous
       vehicle is trained on
 
+    Optional from env_params:
+
+    * ring_length_step: granularity of the ring road lengths in the above
+      range, defaults to 1 meter
+
+    The ring roads of all lengths are generated once when the environment is
+    created, and a new ring is loaded in the running sumo instance upon every
+    reset (see Env.load_scenario).
+
     States
         The state consists of the velocities and absolute position of all
         vehicles in the network. This assumes a constant number of vehicles.
@@ -60,14 +95,55 @@ class WaveAttenuationEnv(Env):
         vehicles collide into one another.
     """
 
+    # additional_command (here and in the POMDP version) only marks vehicles
+    # as observed, which is not needed during warm-up
+    warmup_fast_forward = True
+
+    # the library of ring roads is part of the configuration of the
+    # environment, and is not saved in checkpoints
+    checkpoint_exclude = Env.checkpoint_exclude + ("ring_scenarios",
+                                                   "v_eq_max")
+
     def __init__(self, env_params, sumo_params, scenario):
         for p in ADDITIONAL_ENV_PARAMS.keys():
             if p not in env_params.additional_params:
                 raise KeyError(
                     'Environment parameter \'{}\' not supplied'.format(p))
 
+        # ring roads of all lengths the autonomous vehicle is trained on, and
+        # their equilibrium speeds (keyed by length)
+        self.ring_scenarios = dict()
+        self.v_eq_max = dict()
+        self._build_ring_library(env_params, scenario)
+
         super().__init__(env_params, sumo_params, scenario)
 
+    def _build_ring_library(self, env_params, scenario):
+        """Generate the ring roads of all lengths in the training range."""
+        min_length, max_length = env_params.additional_params['ring_length']
+        step = env_params.additional_params.get('ring_length_step', 1)
+
+        initial_config = InitialConfig(bunching=50, min_gap=0)
+        for i in range(int((max_length - min_length) // step) + 1):
+            length = min_length + i * step
+            additional_net_params = {
+                'length': length,
+                'lanes': scenario.lanes,
+                'speed_limit': 30,
+                'resolution': 40
+            }
+            net_params = NetParams(additional_params=additional_net_params)
+
+            self.ring_scenarios[length] = scenario.__class__(
+                scenario.orig_name, scenario.vehicles, net_params,
+                initial_config)
+
+            # solve for the velocity upper bound of the ring
+            v_guess = 4.
+            self.v_eq_max[length] = fsolve(
+                v_eq_max_function, v_guess,
+                args=(length, scenario.vehicles.num_vehicles))[0]
+
     @property
     def action_space(self):
         """See class definition."""
@@ -145,54 +221,15 @@ class WaveAttenuationEnv(Env):
         The sumo instance is reset with a new ring length, and a number of
         steps are performed with the rl vehicle acting as a human vehicle.
         """
-        # update the scenario
-        initial_config = InitialConfig(bunching=50, min_gap=0)
-        additional_net_params = {
-            'length':
-            random.randint(
-                self.env_params.additional_params['ring_length'][0],
-                self.env_params.additional_params['ring_length'][1]),
-            'lanes':
-            self.scenario.lanes,
-            'speed_limit':
-            30,
-            'resolution':
-            40
-        }
-        net_params = NetParams(additional_params=additional_net_params)
-
-        self.scenario = self.scenario.__class__(
-            self.scenario.orig_name, self.scenario.vehicles,
-            net_params, initial_config)
-
-        # solve for the velocity upper bound of the ring
-        def v_eq_max_function(v):
-            num_veh = self.vehicles.num_vehicles - 1
-            # maximum gap in the presence of one rl vehicle
-            s_eq_max = (self.scenario.length -
-                        self.vehicles.num_vehicles * 5) / num_veh
-
-            v0 = 30
-            s0 = 2
-            T = 1
-            gamma = 4
-
-            error = s_eq_max - (s0 + v * T) * (1 - (v / v0)**gamma)**-0.5
-
-            return error
-
-        v_guess = 4.
-        v_eq_max = fsolve(v_eq_max_function, v_guess)[0]
+        # load a ring road of random length
+        length = random.choice(list(self.ring_scenarios))
 
         print('\n-----------------------')
-        print('ring length:', net_params.additional_params['length'])
-        print('v_max:', v_eq_max)
+        print('ring length:', length)
+        print('v_max:', self.v_eq_max[length])
         print('-----------------------')
 
-        # restart the sumo instance
-        self.restart_sumo(
-            sumo_params=self.sumo_params,
-            render=self.sumo_params.render)
+        self.load_scenario(self.ring_scenarios[length])
 
         # perform the generic reset function
         observation = super().reset()
@@ -202,6 +239,16 @@ class WaveAttenuationEnv(Env):
 
         return observation
 
+    def terminate(self):
+        """See parent class.
+
+        The files of all generated ring roads are deleted as well.
+        """
+        super().terminate()
+        for scenario in self.ring_scenarios.values():
+            if scenario is not self.scenario:
+                scenario.close()
+
 
 class WaveAttenuationPOEnv(WaveAttenuationEnv):
     """POMDP version of WaveAttenuationEnv.
@@ -7,11 +7,11 @@ TODO(ak): add paper after it has been published.
 
 from flow.envs.base_env import Env
 from flow.core import rewards
+from flow.core.agent_slots import AgentSlots
 
 from gym.spaces.box import Box
 
 import numpy as np
-import collections
 
 ADDITIONAL_ENV_PARAMS = {
     # maximum acceleration for autonomous vehicles, in m/s^2
@@ -47,7 +47,8 @@ class WaveAttenuationMergePOEnv(Env):
         in the network is less than "num_rl", the extra entries are filled in
         with zeros. Conversely, if the number of autonomous vehicles is greater
         than "num_rl", the observations from the additional vehicles are not
-        included in the state space.
+        included in the state space. Every controlled AV keeps the same
+        entries in the state space until it exits the network.
 
     Actions
         The action space consists of a vector of bounded accelerations for each
@@ -78,10 +79,11 @@ class WaveAttenuationMergePOEnv(Env):
 
         # maximum number of controlled vehicles
         self.num_rl = env_params.additional_params["num_rl"]
-        # queue of rl vehicles waiting to be controlled
-        self.rl_queue = collections.deque()
-        # names of the rl vehicles controlled at any step
-        self.rl_veh = []
+        # slots of the rl vehicles controlled at any step in the state and
+        # action spaces, and queue of rl vehicles waiting to be controlled
+        self.rl_slots = AgentSlots(self.num_rl)
+        # preallocated observation of the controlled vehicles
+        self._observation = np.zeros((self.num_rl, 5))
         # used for visualization
         self.leader = []
         self.follower = []
@@ -104,11 +106,10 @@ class WaveAttenuationMergePOEnv(Env):
 
     def _apply_rl_actions(self, rl_actions):
         """See class definition."""
-        for i, rl_id in enumerate(self.rl_veh):
-            # ignore rl vehicles outside the network
-            if rl_id not in self.vehicles.get_rl_ids():
-                continue
-            self.apply_acceleration([rl_id], [rl_actions[i]])
+        # skip the rl vehicles that exited since the slots were last synced
+        rl_ids, accel = self.rl_slots.split_actions(
+            rl_actions, veh_ids=self.vehicles.get_rl_ids())
+        self.apply_acceleration(rl_ids, accel[:, 0])
 
     def get_state(self, rl_id=None, **kwargs):
         """See class definition."""
@@ -119,8 +120,8 @@ class WaveAttenuationMergePOEnv(Env):
         max_speed = self.scenario.max_speed
         max_length = self.scenario.length
 
-        observation = [0 for _ in range(5 * self.num_rl)]
-        for i, rl_id in enumerate(self.rl_veh):
+        observation = self._observation
+        for i, rl_id in self.rl_slots.items():
             this_speed = self.vehicles.get_speed(rl_id)
             lead_id = self.vehicles.get_leader(rl_id)
             follower = self.vehicles.get_follower(rl_id)
@@ -144,13 +145,14 @@ class WaveAttenuationMergePOEnv(Env):
                 follow_speed = self.vehicles.get_speed(follower)
                 follow_head = self.vehicles.get_headway(follower)
 
-            observation[5 * i + 0] = this_speed / max_speed
-            observation[5 * i + 1] = (lead_speed - this_speed) / max_speed
-            observation[5 * i + 2] = lead_head / max_length
-            observation[5 * i + 3] = (this_speed - follow_speed) / max_speed
-            observation[5 * i + 4] = follow_head / max_length
+            observation[i] = [this_speed / max_speed,
+                              (lead_speed - this_speed) / max_speed,
+                              lead_head / max_length,
+                              (this_speed - follow_speed) / max_speed,
+                              follow_head / max_length]
 
-        return observation
+        # vehicles that are not controlled are represented by zeros
+        return self.rl_slots.pad(observation, 0).flatten()
 
     def compute_reward(self, rl_actions, **kwargs):
         """See class definition."""
@@ -167,7 +169,7 @@ class WaveAttenuationMergePOEnv(Env):
             # penalize small time headways
             cost2 = 0
             t_min = 1  # smallest acceptable time headway
-            for rl_id in self.rl_veh:
+            for rl_id in self.rl_slots.get_ids():
                 lead_id = self.vehicles.get_leader(rl_id)
                 if lead_id not in ["", None] \
                         and self.vehicles.get_speed(rl_id) > 0:
@@ -188,7 +190,11 @@ class WaveAttenuationMergePOEnv(Env):
         ``get_absolute_position``.
         """
         # vehicles are sorted by their get_x_by_id value
-        sorted_ids = sorted(self.vehicles.get_ids(), key=self.get_x_by_id)
+        veh_ids = self.vehicles.get_ids()
+        pos = self.scenario.topology.get_x_list(
+            self.vehicles.get_edge(veh_ids),
+            self.vehicles.get_position(veh_ids), empty=0)
+        sorted_ids = [veh_ids[i] for i in np.argsort(pos, kind="mergesort")]
         return sorted_ids, None
 
     def additional_command(self):
@@ -197,29 +203,13 @@ class WaveAttenuationMergePOEnv(Env):
         This method performs to auxiliary tasks:
 
         * Define which vehicles are observed for visualization purposes.
-        * Maintains the "rl_veh" and "rl_queue" variables to ensure the RL
-          vehicles that are represented in the state space does not change
-          until one of the vehicles in the state space leaves the network.
-          Then, the next vehicle in the queue is added to the state space and
+        * Maintains the "rl_slots" registry to ensure the RL vehicles that
+          are represented in the state space do not change until one of the
+          vehicles in the state space leaves the network. Then, the next
+          vehicle in the queue takes its slot in the state space and is
           provided with actions from the policy.
         """
-        # add rl vehicles that just entered the network into the rl queue
-        for veh_id in self.vehicles.get_rl_ids():
-            if veh_id not in list(self.rl_queue) + self.rl_veh:
-                self.rl_queue.append(veh_id)
-
-        # remove rl vehicles that exited the network
-        for veh_id in list(self.rl_queue):
-            if veh_id not in self.vehicles.get_rl_ids():
-                self.rl_queue.remove(veh_id)
-        for veh_id in self.rl_veh:
-            if veh_id not in self.vehicles.get_rl_ids():
-                self.rl_veh.remove(veh_id)
-
-        # fil up rl_veh until they are enough controlled vehicles
-        while len(self.rl_queue) > 0 and len(self.rl_veh) < self.num_rl:
-            rl_id = self.rl_queue.popleft()
-            self.rl_veh.append(rl_id)
+        self.rl_slots.sync(self.vehicles.get_rl_ids())
 
         # specify observed vehicles
         for veh_id in self.leader + self.follower:
@@ -233,4 +223,5 @@ class WaveAttenuationMergePOEnv(Env):
         """
         self.leader = []
         self.follower = []
+        self.rl_slots.clear()
         return super().reset()
@@ -0,0 +1,408 @@
+"""Vectorized environment over the replicas of a tiled scenario.
+
+A flow environment whose scenario is a flow.scenarios.TiledScenario simulates
+several independent replicas of a base scenario in a single sumo instance.
+The TiledEnv class exposes every replica as a separate environment, with its
+own vehicles, observations, rewards, dones, and resets, while the simulation
+of all replicas is advanced by a single simulation step.
+
+Usage
+-----
+Create an environment from flow parameters whose scenario is
+"TiledScenario" (the base scenario and number of replicas are specified in
+the additional parameters of net_params), and wrap it:
+
+>>> create_env, _ = make_create_env(params=flow_params, version=0)
+>>> env = TiledEnv(create_env())
+>>> obs = env.vector_reset()
+>>> obs, rewards, dones, infos = env.vector_step(actions)
+>>> obs[0] = env.reset_at(0)  # if dones[0] is True
+"""
+
+from contextlib import contextmanager
+
+import numpy as np
+from traci import constants as tc
+from traci.exceptions import FatalTraCIError, TraCIException
+
+try:
+    # use the vectorized environment interface of rllib if it is installed
+    from ray.rllib.env.vector_env import VectorEnv
+except ImportError:
+    VectorEnv = object
+
+
+class _ReplicaVehicles:
+    """View of the vehicles class restricted to the vehicles of a replica.
+
+    The names of edges and routes are those of the base scenario, so that the
+    methods of the environment compute the observations and rewards of the
+    replica as they would in a network containing the replica alone. All
+    other methods and attributes are those of the vehicles class.
+    """
+
+    def __init__(self, vehicles, tiled_env, index):
+        self._vehicles = vehicles
+        self._tiled_env = tiled_env
+        self._index = index
+
+    def __getattr__(self, name):
+        return getattr(self._vehicles, name)
+
+    def _filter(self, veh_ids):
+        replica_of = self._tiled_env.replica_of
+        return [veh_id for veh_id in veh_ids
+                if replica_of.get(veh_id) == self._index]
+
+    @property
+    def num_vehicles(self):
+        return len(self.get_ids())
+
+    @property
+    def num_rl_vehicles(self):
+        return len(self.get_rl_ids())
+
+    def get_ids(self):
+        return self._filter(self._vehicles.get_ids())
+
+    def get_human_ids(self):
+        return self._filter(self._vehicles.get_human_ids())
+
+    def get_controlled_ids(self):
+        return self._filter(self._vehicles.get_controlled_ids())
+
+    def get_controlled_lc_ids(self):
+        return self._filter(self._vehicles.get_controlled_lc_ids())
+
+    def get_rl_ids(self):
+        return self._filter(self._vehicles.get_rl_ids())
+
+    def get_observed_ids(self):
+        return self._filter(self._vehicles.get_observed_ids())
+
+    def get_departed_ids(self):
+        return self._filter(self._vehicles.get_departed_ids())
+
+    def get_arrived_ids(self):
+        return self._filter(self._vehicles.get_arrived_ids())
+
+    def get_edge(self, veh_id, error=""):
+        if isinstance(veh_id, (list, np.ndarray)):
+            return [self.get_edge(vehID, error) for vehID in veh_id]
+        edge = self._vehicles.get_edge(veh_id, error)
+        if edge == error:
+            return edge
+        return self._tiled_env.scenario.get_base_edge(edge)
+
+    def get_route(self, veh_id, error=list()):
+        if isinstance(veh_id, (list, np.ndarray)):
+            return [self.get_route(vehID, error) for vehID in veh_id]
+        route = self._vehicles.get_route(veh_id, error)
+        if route == error:
+            return route
+        return [self._tiled_env.scenario.get_base_edge(edge)
+                for edge in route]
+
+    def get_ids_by_edge(self, edges):
+        if isinstance(edges, (list, np.ndarray)):
+            return sum([self.get_ids_by_edge(edge) for edge in edges], [])
+        return self._vehicles.get_ids_by_edge(
+            self._tiled_env.scenario.prefix(self._index, edges))
+
+    def get_vehicles_by_lane(self, edge):
+        return self._vehicles.get_vehicles_by_lane(
+            self._tiled_env.scenario.prefix(self._index, edge))
+
+
+class TiledEnv(VectorEnv):
+    """Vectorized environment over the replicas of a tiled scenario.
+
+    Every replica of the scenario is an environment of its own: its
+    observations, rewards, and actions are computed by the methods of the
+    wrapped environment (get_state, compute_reward, apply_rl_actions) while
+    the environment only sees the vehicles of the replica, and the base
+    scenario (see `focus`). Vehicles are assigned to replicas based on the
+    prefix of the edge they are located in.
+
+    The interface follows rllib's VectorEnv (vector_reset, reset_at,
+    vector_step, get_unwrapped), which this class inherits from if rllib is
+    installed.
+
+    Only the vehicles class and the scenario are restricted to a replica.
+    Traffic lights are therefore not supported, and environments should not
+    send requests to TraCI with the names of edges of the base scenario (e.g.
+    through traci_connection.edge or traci_connection.lane).
+
+    Attributes
+    ----------
+    env : flow.envs.Env type
+        the wrapped environment, simulating all replicas
+    scenario : flow.scenarios.TiledScenario
+        the tiled scenario of the wrapped environment
+    num_envs : int
+        number of replicas
+    replica_of : dict
+        replica of every vehicle (the last replica the vehicle was located
+        in, for vehicles that are not in the network)
+    """
+
+    def __init__(self, env):
+        """Wrap an environment whose scenario is a tiled scenario.
+
+        Parameters
+        ----------
+        env : flow.envs.Env type
+            the environment. Its vehicle_arrangement_shuffle option should
+            be disabled, since it would swap vehicles across replicas.
+
+        Raises
+        ------
+        ValueError
+            if the scenario contains traffic lights
+        """
+        if env.traffic_lights.num_traffic_lights > 0:
+            raise ValueError(
+                "TiledEnv does not support scenarios with traffic lights, "
+                "whose ids are not mapped to the replicas.")
+
+        self.env = env
+        self.scenario = env.scenario
+        self.num_envs = self.scenario.num_replicas
+        self.replica_of = dict()
+        self._update_replicas()
+
+        # number of steps since the last reset of every replica
+        self.steps = [0] * self.num_envs
+        # last actions of every replica, repeated during resets of others
+        self._last_actions = [None] * self.num_envs
+
+        with self.focus(0):
+            self.observation_space = env.observation_space
+            self.action_space = env.action_space
+
+    @contextmanager
+    def focus(self, index):
+        """Restrict the wrapped environment to a replica.
+
+        Within this context, the vehicles, scenario, and sorted ids of the
+        environment are those of the replica, as if the network contained the
+        replica alone.
+
+        Parameters
+        ----------
+        index : int
+            index of the replica
+        """
+        env = self.env
+        # the sorted ids are only available after the first reset or step
+        vehicles, scenario, sorted_ids = \
+            env.vehicles, env.scenario, getattr(env, "sorted_ids", [])
+        env.vehicles = _ReplicaVehicles(vehicles, self, index)
+        env.scenario = self.scenario.base
+        env.sorted_ids = [veh_id for veh_id in sorted_ids
+                          if self.replica_of.get(veh_id) == index]
+        try:
+            yield env
+        finally:
+            env.vehicles, env.scenario, env.sorted_ids = \
+                vehicles, scenario, sorted_ids
+
+    def _update_replicas(self, veh_ids=None):
+        """Update the replica of vehicles from the edges they are located in.
+
+        Vehicles that are not in the network keep their last replica.
+        """
+        vehicles = self.env.vehicles
+        if veh_ids is None:
+            veh_ids = vehicles.get_ids()
+        for veh_id, edge in zip(veh_ids, vehicles.get_edge(veh_ids)):
+            index = self.scenario.get_replica(edge)
+            if index is not None:
+                self.replica_of[veh_id] = index
+
+    def _reset_absolute_positions(self, veh_ids):
+        """Set the absolute positions of vehicles in their replica's frame.
+
+        The absolute positions of vehicles are then updated by the vehicles
+        class from the changes in position of vehicles, which are the same in
+        the frame of the tiled scenario and of their replica.
+        """
+        for index in range(self.num_envs):
+            with self.focus(index) as env:
+                for veh_id in env.vehicles.get_ids():
+                    if veh_id in veh_ids:
+                        env.vehicles.set_absolute_position(
+                            veh_id, env.get_x_by_id(veh_id))
+
+    def _get_observation(self, index):
+        """Return the observation of a replica."""
+        with self.focus(index) as env:
+            state = env.get_state()
+        # observations are formatted as by Env.step
+        if isinstance(state, dict):
+            return {key: np.copy(np.asarray(value).T)
+                    for key, value in state.items()}
+        return np.copy(state)
+
+    def vector_reset(self):
+        """Reset all replicas.
+
+        Returns
+        -------
+        list
+            initial observation of every replica
+        """
+        self.env.reset()
+        self.replica_of = dict()
+        self._update_replicas()
+        self._reset_absolute_positions(set(self.env.vehicles.get_ids()))
+        self.env.sorted_ids, self.env.sorted_extra_data = \
+            self.env.sort_by_position()
+
+        self.steps = [0] * self.num_envs
+        self._last_actions = [None] * self.num_envs
+        return [self._get_observation(k) for k in range(self.num_envs)]
+
+    def reset_at(self, index):
+        """Reset a single replica.
+
+        The vehicles of the replica are removed from the network and
+        reintroduced in their initial state. Since vehicles only enter the
+        network during a simulation step, this advances the simulation of all
+        replicas by one step, in which the other replicas repeat their last
+        actions.
+
+        Parameters
+        ----------
+        index : int
+            index of the replica
+
+        Returns
+        -------
+        array_like
+            initial observation of the replica
+        """
+        env = self.env
+        traci_veh = env.traci_connection.vehicle
+
+        # remove the vehicles of the replica from the network
+        for veh_id in [veh_id for veh_id in env.vehicles.get_ids()
+                       if self.replica_of.get(veh_id) == index]:
+            try:
+                traci_veh.remove(veh_id)
+                traci_veh.unsubscribe(veh_id)
+            except (FatalTraCIError, TraCIException):
+                pass
+            env.vehicles.remove(veh_id)
+            env.command_buffer.discard(veh_id)
+
+        # reintroduce its initial vehicles
+        initial_ids = [
+            veh_id for veh_id in env.initial_ids
+            if self.scenario.get_replica(
+                env.initial_state[veh_id][1][len("route"):]) == index]
+        for veh_id in initial_ids:
+            type_id, route_id, lane_index, pos, speed = \
+                env.initial_state[veh_id]
+            traci_veh.addFull(
+                veh_id,
+                route_id,
+                typeID=str(type_id),
+                departLane=str(lane_index),
+                departPos=str(pos),
+                departSpeed=str(speed))
+
+        # advance the simulation, with the last actions of the other replicas
+        self._sub_step([None if k == index else actions
+                        for k, actions in enumerate(self._last_actions)])
+
+        self._update_replicas(initial_ids)
+        self._reset_absolute_positions(set(initial_ids))
+        for veh_id in initial_ids:
+            env.prev_last_lc[veh_id] = -float("inf")
+
+        self.steps[index] = 0
+        self._last_actions[index] = None
+        return self._get_observation(index)
+
+    def _sub_step(self, actions):
+        """Apply the actions of all replicas and advance the simulation.
+
+        Returns
+        -------
+        list of bool
+            whether every replica experienced a collision
+        """
+        env = self.env
+        env.time_counter += 1
+        env.step_counter += 1
+
+        # perform the actions of flow-controlled (non-rl) vehicles
+        env._apply_controller_actions()
+
+        for k, rl_actions in enumerate(actions):
+            with self.focus(k):
+                env.apply_rl_actions(rl_actions)
+
+        env.additional_command()
+        env._sim_step()
+        crash = env._after_sim_step()
+        self._update_replicas()
+
+        crashed = [False] * self.num_envs
+        if crash:
+            id_lists = env.traci_connection.simulation.getSubscriptionResults()
+            for veh_id in id_lists[tc.VAR_TELEPORT_STARTING_VEHICLES_IDS]:
+                index = self.replica_of.get(veh_id)
+                if index is not None:
+                    crashed[index] = True
+        return crashed
+
+    def vector_step(self, actions):
+        """Advance all replicas by one step.
+
+        Parameters
+        ----------
+        actions : list
+            actions of every replica
+
+        Returns
+        -------
+        obs : list
+            observation of every replica
+        rewards : list of float
+            reward of every replica
+        dones : list of bool
+            whether the rollout of every replica ended (collision or horizon)
+        infos : list of dict
+            additional information on every replica
+        """
+        env = self.env
+        crashed = [False] * self.num_envs
+        for _ in range(env.env_params.sims_per_step):
+            crashed = [a or b for a, b in
+                       zip(crashed, self._sub_step(actions))]
+            if any(crashed):
+                break
+            env.render()
+
+        obs, rewards, dones, infos = [], [], [], []
+        for k in range(self.num_envs):
+            self.steps[k] += 1
+            obs.append(self._get_observation(k))
+            with self.focus(k):
+                rewards.append(env.compute_reward(actions[k], fail=crashed[k]))
+            dones.append(crashed[k] or
+                         self.steps[k] >= env.env_params.horizon)
+            infos.append({})
+
+        self._last_actions = list(actions)
+        return obs, rewards, dones, infos
+
+    def get_unwrapped(self):
+        """Return the wrapped environment (a single one for all replicas)."""
+        return [self.env]
+
+    def close(self):
+        """Terminate the wrapped environment."""
+        self.env.terminate()
@@ -0,0 +1,200 @@
+"""Contains the asynchronous renderer class."""
+
+import multiprocessing as mp
+import warnings
+
+import numpy as np
+
+# values stored for every vehicle of a snapshot: x, y, angle, speed
+# (normalized by the maximum speed), and whether the vehicle is rendered as an
+# rl vehicle
+VEHICLE_FIELDS = 5
+# values stored before the vehicles of a snapshot: sequence number and number
+# of vehicles
+HEADER_FIELDS = 2
+
+
+def _render_loop(conn, snapshot, lock, new_snapshot, network, mode, kwargs):
+    """Render the snapshots written by an AsyncRenderer, in a subprocess.
+
+    Only the latest snapshot is rendered whenever the renderer is available;
+    older snapshots that were overwritten in the meantime are dropped. Frame
+    requests are answered with the frame of the latest snapshot, which is
+    rendered first if needed.
+    """
+    # pyglet is only imported in the rendering process
+    from flow.renderer.pyglet_renderer import PygletRenderer
+
+    renderer = PygletRenderer(network, mode, **kwargs)
+    data = np.frombuffer(snapshot, dtype=np.float64)
+    rendered = -1
+    frame, sights = renderer.frame, []
+
+    def render():
+        new_snapshot.clear()
+        with lock:
+            seq, num_vehicles = int(data[0]), int(data[1])
+            vehicles = data[HEADER_FIELDS:HEADER_FIELDS +
+                            num_vehicles * VEHICLE_FIELDS].reshape(
+                (num_vehicles, VEHICLE_FIELDS)).copy()
+
+        human = vehicles[vehicles[:, 4] == 0]
+        machine = vehicles[vehicles[:, 4] == 1]
+        frame = renderer.render(
+            human[:, :3].tolist(), machine[:, :3].tolist(),
+            human[:, 3].tolist(), machine[:, 3].tolist(), [], [])
+        sights = [renderer.get_sight(orientation, i) for i, orientation
+                  in enumerate(machine[:, :3].tolist())]
+        return seq, frame, sights
+
+    while True:
+        if conn.poll():
+            request = conn.recv()
+            if request is None:
+                break
+            # render the latest snapshot, unless it was already rendered
+            if rendered < request:
+                rendered, frame, sights = render()
+            conn.send((frame, sights))
+        elif new_snapshot.wait(0.01):
+            rendered, frame, sights = render()
+
+    renderer.close()
+    conn.close()
+
+
+class AsyncRenderer:
+    """Pyglet renderer running in a separate process.
+
+    The state of the vehicles at every simulation step is written as a
+    compact snapshot in shared memory (see `submit`), which does not block
+    the simulation. The rendering process renders the latest snapshot
+    whenever it is available, so snapshots submitted faster than they can be
+    rendered (e.g. when frames are only displayed) are dropped. Frames are
+    only sent back when requested (see `get_frame`).
+
+    Saving renderings to disk is not supported (see PygletRenderer).
+    """
+
+    def __init__(self, network, mode, max_vehicles=1000, **kwargs):
+        """Start the rendering process.
+
+        Parameters
+        ----------
+        network : list
+            road network polygons (see PygletRenderer)
+        mode : str
+            rendering mode (see PygletRenderer)
+        max_vehicles : int, optional
+            maximum number of vehicles in a snapshot. Vehicles beyond this
+            number are not rendered, starting with the human vehicles.
+        kwargs : dict
+            additional arguments of the pyglet renderer (sight_radius,
+            show_radius, and pxpm)
+        """
+        self.mode = mode
+        self.max_vehicles = max_vehicles
+
+        self._snapshot = mp.RawArray(
+            "d", HEADER_FIELDS + max_vehicles * VEHICLE_FIELDS)
+        self._data = np.frombuffer(self._snapshot, dtype=np.float64)
+        self._lock = mp.Lock()
+        self._new_snapshot = mp.Event()
+        self._conn, child_conn = mp.Pipe()
+        self._seq = -1
+        self._warned = False
+
+        self._process = mp.Process(
+            target=_render_loop,
+            args=(child_conn, self._snapshot, self._lock, self._new_snapshot,
+                  network, mode, kwargs))
+        self._process.daemon = True
+        self._process.start()
+        # only the rendering process holds this end of the pipe, so that
+        # receiving from a terminated process fails instead of blocking
+        child_conn.close()
+
+    def submit(self,
+               human_orientations,
+               machine_orientations,
+               human_dynamics,
+               machine_dynamics):
+        """Send the state of the vehicles to the rendering process.
+
+        Parameters
+        ----------
+        human_orientations : list
+            orientations ([x, y, angle]) of the human vehicles
+        machine_orientations : list
+            orientations ([x, y, angle]) of the rl vehicles. The sights
+            returned by `get_frame` are ordered as these vehicles.
+        human_dynamics : list
+            speeds of the human vehicles, normalized by the maximum speed
+        machine_dynamics : list
+            speeds of the rl vehicles, normalized by the maximum speed
+        """
+        # rl vehicles are stored first, so that they are kept if the
+        # snapshot is truncated
+        num_machine = len(machine_orientations)
+        num_vehicles = num_machine + len(human_orientations)
+        vehicles = np.zeros((num_vehicles, VEHICLE_FIELDS))
+        if num_machine > 0:
+            vehicles[:num_machine, :3] = machine_orientations
+            vehicles[:num_machine, 3] = machine_dynamics
+            vehicles[:num_machine, 4] = 1
+        if num_vehicles > num_machine:
+            vehicles[num_machine:, :3] = human_orientations
+            vehicles[num_machine:, 3] = human_dynamics
+
+        if num_vehicles > self.max_vehicles:
+            if not self._warned:
+                warnings.warn(
+                    "Only {} vehicles are rendered, starting with the rl "
+                    "vehicles.".format(self.max_vehicles), ResourceWarning)
+                self._warned = True
+            vehicles = vehicles[:self.max_vehicles]
+            num_vehicles = self.max_vehicles
+
+        self._seq += 1
+        with self._lock:
+            self._data[0] = self._seq
+            self._data[1] = num_vehicles
+            self._data[HEADER_FIELDS:HEADER_FIELDS +
+                       num_vehicles * VEHICLE_FIELDS] = vehicles.ravel()
+        self._new_snapshot.set()
+
+    def get_frame(self):
+        """Return the rendering of the latest snapshot.
+
+        This blocks until the snapshot is rendered.
+
+        Returns
+        -------
+        np.ndarray
+            rendered frame
+        list of np.ndarray
+            local observations (sights) of the rl vehicles
+
+        Raises
+        ------
+        RuntimeError
+            if the rendering process is no longer running
+        """
+        try:
+            self._conn.send(self._seq)
+            return self._conn.recv()
+        except (BrokenPipeError, EOFError, OSError):
+            raise RuntimeError("The rendering process is no longer running.")
+
+    def close(self):
+        """Stop the rendering process."""
+        if self._process.is_alive():
+            try:
+                self._conn.send(None)
+            except (BrokenPipeError, EOFError, OSError):
+                # the process terminated in the meantime
+                pass
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+        self._conn.close()
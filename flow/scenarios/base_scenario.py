@@ -1,14 +1,16 @@
 """Contains the base scenario class."""
 
+import gc
+import hashlib
 import logging
 import random
 import numpy as np
 import time
 import os
+import shutil
 import subprocess
 import traceback
 from lxml import etree
-import xml.etree.ElementTree as ElementTree
 
 try:
     # Import serializable if rllab is installed
@@ -18,7 +20,8 @@ except ImportError:
 
 from flow.core.params import InitialConfig
 from flow.core.traffic_lights import TrafficLights
-from flow.core.util import makexml, printxml, ensure_dir
+from flow.core.topology import NetworkTopology
+from flow.core.util import makexml, printxml, writexml, ensure_dir
 
 E = etree.Element
 
@@ -29,6 +32,9 @@ WAIT_ON_ERROR = 1
 
 VEHICLE_LENGTH = 5  # length of vehicles in the network, in meters
 
+# suffix of the binary files storing the parsed content of .net.xml files
+NET_SIDECAR_SUFFIX = ".flow.npz"
+
 
 class Scenario(Serializable):
     """Base scenario class.
@@ -108,6 +114,9 @@ class Scenario(Serializable):
         self._edges, self._connections = self.generate_net(
             self.net_params, self.traffic_lights)
 
+        # compiled (array-based) representation of the edges and connections
+        self.topology = NetworkTopology(self._edges, self._connections)
+
         # list of edges and internal links (junctions)
         self._edge_list = [
             edge_id for edge_id in self._edges.keys() if edge_id[0] != ":"
@@ -147,6 +156,11 @@ class Scenario(Serializable):
         self.total_edgestarts.sort(key=lambda tup: tup[1])
 
         self.total_edgestarts_dict = dict(self.total_edgestarts)
+        self.total_edgestarts_index = dict()
+        for i, (edge, _) in enumerate(self.total_edgestarts):
+            self.total_edgestarts_index.setdefault(edge, i)
+        self.topology.set_edge_starts(self.total_edgestarts,
+                                      self.internal_edgestarts_dict)
 
         # length of the network, or the portion of the network in
         # which cars are meant to be distributed
@@ -238,9 +252,7 @@ class Scenario(Serializable):
             1st element: edge name (such as bottom, right, etc.)
             2nd element: relative position on edge
         """
-        for (edge, start_pos) in reversed(self.total_edgestarts):
-            if x >= start_pos:
-                return edge, x - start_pos
+        return self.topology.get_edge(x)
 
     def get_x(self, edge, position):
         """Return the absolute position on the track.
@@ -262,16 +274,10 @@ class Scenario(Serializable):
         if len(edge) == 0:
             return -1001
 
-        if edge[0] == ":":
-            try:
-                return self.internal_edgestarts_dict[edge] + position
-            except KeyError:
-                # in case several internal links are being generalized for
-                # by a single element (for backwards compatibility)
-                edge_name = edge.rsplit("_", 1)[0]
-                return self.total_edgestarts_dict.get(edge_name, -1001)
-        else:
-            return self.total_edgestarts_dict[edge] + position
+        # in case several internal links are being generalized for by a single
+        # element, the position of that element is returned (for backwards
+        # compatibility)
+        return self.topology.get_x(edge, position)
 
     def generate_starting_positions(self, num_vehicles=None, **kwargs):
         """Generate starting positions for vehicles in the network.
@@ -319,6 +325,11 @@ class Scenario(Serializable):
         distribution by a gaussian whose std is equal to this perturbation
         term.
 
+        The absolute positions of consecutive vehicles are computed in
+        batches and mapped to edges through the network topology. Only the
+        vehicles that need to be moved (e.g. vehicles falling on an internal
+        link or on an edge that is not available) are placed one at a time.
+
         Parameters
         ----------
         initial_config : InitialConfig type
@@ -345,78 +356,165 @@ class Scenario(Serializable):
         if num_vehicles == 0:
             return [], []
 
+        topology = self.topology
         increment = available_length / num_vehicles
 
         # if not all lanes are equal, then we must ensure that vehicles are in
         # two edges at the same time
-        flag = False
         lanes = [self.num_lanes(edge) for edge in self.get_edge_list()]
-        if any(lanes[0] != lanes[i] for i in range(1, len(lanes))):
-            flag = True
-
+        flag = any(lanes[0] != lanes[i] for i in range(1, len(lanes)))
+
+        # edges vehicles can be placed on without being moved, and number of
+        # vehicles placed side-by-side on each edge. The last element is used
+        # for positions outside the network (edge id -1).
+        num_ids = len(topology.edge_ids)
+        available = set(available_edges)
+        valid_edge = np.zeros(num_ids + 1, dtype=bool)
+        for edge in available:
+            if edge in topology.edge_index and \
+                    edge not in self.internal_edgestarts_dict:
+                valid_edge[topology.edge_index[edge]] = True
+        slot_size = np.append(
+            np.minimum(topology.lanes, lanes_distr), 0).astype(int)
+
+        slot_edges, slot_pos, slot_counts = [], [], []
         x = x0
         car_count = 0
-        startpositions, startlanes = [], []
+        batch_size = 64
 
         # generate uniform starting positions
         while car_count < num_vehicles:
-            # collect the position and lane number of each new vehicle
-            pos = self.get_edge(x)
-
-            # ensures that vehicles are not placed in an internal junction
-            while pos[0] in dict(self.internal_edgestarts).keys():
-                # find the location of the internal edge in total_edgestarts,
-                # which has the edges ordered by position
-                edges = [tup[0] for tup in self.total_edgestarts]
-                indx_edge = next(
-                    i for i, edge in enumerate(edges) if edge == pos[0])
-
-                # take the next edge in the list, and place the car at the
-                # beginning of this edge
-                if indx_edge == len(edges) - 1:
-                    next_edge_pos = self.total_edgestarts[0]
-                else:
-                    next_edge_pos = self.total_edgestarts[indx_edge + 1]
-
-                x = next_edge_pos[1]
-                pos = (next_edge_pos[0], 0)
-
-            # ensures that you are in an acceptable edge
-            while pos[0] not in available_edges:
-                x = (x + self.edge_length(pos[0])) % self.length
-                pos = self.get_edge(x)
-
-            # ensure that in variable lane settings vehicles always start a
-            # vehicle's length away from the start of the edge. This, however,
-            # prevents the spacing to be completely uniform.
-            if flag and pos[1] < VEHICLE_LENGTH:
-                pos0, pos1 = pos
-                pos = (pos0, VEHICLE_LENGTH)
-                x += VEHICLE_LENGTH
-                increment -= (VEHICLE_LENGTH * self.num_lanes(pos0)) / \
-                             (num_vehicles - car_count)
-
-            # place vehicles side-by-side in all available lanes on this edge
-            for lane in range(min([self.num_lanes(pos[0]), lanes_distr])):
-                car_count += 1
-                startpositions.append(pos)
-                startlanes.append(lane)
-
-                if car_count == num_vehicles:
-                    break
+            remaining = num_vehicles - car_count
+            batch_size = max(1, min(batch_size, remaining))
+            step = increment + VEHICLE_LENGTH + min_gap
+
+            # positions of the next vehicles, assuming none of them is moved
+            xs = (x + step * np.arange(batch_size)) % self.length
+            edge_ids, pos = topology.get_edge_array(xs)
+            valid = valid_edge[edge_ids]
+            if flag:
+                valid &= pos >= VEHICLE_LENGTH
+            num_valid = batch_size if valid.all() else int(np.argmin(valid))
+
+            # place vehicles side-by-side in all available lanes of the edges
+            counts = slot_size[edge_ids[:num_valid]]
+            total = np.cumsum(counts)
+            if num_valid > 0 and total[-1] >= remaining:
+                num_valid = int(np.searchsorted(total, remaining)) + 1
+                counts = counts[:num_valid]
+                counts[-1] -= total[num_valid - 1] - remaining
+            slot_edges.append(edge_ids[:num_valid])
+            slot_pos.append(pos[:num_valid])
+            slot_counts.append(counts)
+            car_count += int(np.sum(counts))
+
+            if car_count == num_vehicles:
+                break
+            if num_valid == batch_size:
+                x = (xs[-1] + step) % self.length
+                batch_size *= 2
+                continue
+
+            # move the next vehicle to an acceptable position
+            x, (edge, edge_pos), increment = self._move_start_pos(
+                xs[num_valid], available, flag, increment,
+                num_vehicles - car_count)
+            count = int(min(self.num_lanes(edge), lanes_distr,
+                            num_vehicles - car_count))
+            slot_edges.append([topology.edge_index[edge]])
+            slot_pos.append([edge_pos])
+            slot_counts.append([count])
+            car_count += count
 
             x = (x + increment + VEHICLE_LENGTH + min_gap) % self.length
+            batch_size = 2 * num_valid
+
+        # expand the slots into the positions and lanes of every vehicle
+        slot_counts = np.concatenate(slot_counts).astype(int)
+        edge_ids = np.repeat(np.concatenate(slot_edges).astype(int),
+                             slot_counts)
+        positions = np.repeat(np.concatenate(slot_pos), slot_counts)
+        startlanes = np.arange(num_vehicles) - np.repeat(
+            np.cumsum(slot_counts) - slot_counts, slot_counts)
 
         # add a perturbation to each vehicle, while not letting the vehicle
         # leave its current edge
+        unique_ids, inverse = np.unique(edge_ids, return_inverse=True)
         if initial_config.perturbation > 0:
-            for i in range(num_vehicles):
-                perturb = np.random.normal(0, initial_config.perturbation)
-                edge, pos = startpositions[i]
-                pos = max(0, min(self.edge_length(edge), pos + perturb))
-                startpositions[i] = (edge, pos)
+            lengths = np.array([self.edge_length(topology.edge_ids[i])
+                                for i in unique_ids])[inverse]
+            perturb = np.random.normal(
+                0, initial_config.perturbation, num_vehicles)
+            positions = np.maximum(0, np.minimum(lengths, positions + perturb))
 
-        return startpositions, startlanes
+        edges = [topology.edge_ids[i] for i in unique_ids]
+        startpositions = list(zip([edges[i] for i in inverse],
+                                  positions.tolist()))
+
+        return startpositions, startlanes.tolist()
+
+    def _move_start_pos(self, x, available_edges, flag, increment,
+                        num_remaining):
+        """Move a starting position to an acceptable location.
+
+        Used by gen_even_start_pos for vehicles that would be placed on an
+        internal link, on an edge that is not available, or (in networks
+        with a variable number of lanes) too close to the start of an edge.
+
+        Parameters
+        ----------
+        x : float
+            absolute position of the vehicle
+        available_edges : set of str
+            edges vehicles may be placed on
+        flag : bool
+            whether the network has a variable number of lanes per edge
+        increment : float
+            current spacing in between vehicles (besides their length and
+            minimum gap)
+        num_remaining : int
+            number of vehicles that still need to be placed
+
+        Returns
+        -------
+        float
+            new absolute position of the vehicle
+        tuple (str, float)
+            edge and relative position of the vehicle
+        float
+            updated spacing in between vehicles
+        """
+        pos = self.get_edge(x)
+
+        # ensures that vehicles are not placed in an internal junction
+        while pos[0] in self.internal_edgestarts_dict:
+            # take the next edge in the list of edges ordered by position, and
+            # place the car at the beginning of this edge
+            indx_edge = self.total_edgestarts_index[pos[0]]
+            if indx_edge == len(self.total_edgestarts) - 1:
+                next_edge_pos = self.total_edgestarts[0]
+            else:
+                next_edge_pos = self.total_edgestarts[indx_edge + 1]
+
+            x = next_edge_pos[1]
+            pos = (next_edge_pos[0], 0)
+
+        # ensures that you are in an acceptable edge
+        while pos[0] not in available_edges:
+            x = (x + self.edge_length(pos[0])) % self.length
+            pos = self.get_edge(x)
+
+        # ensure that in variable lane settings vehicles always start a
+        # vehicle's length away from the start of the edge. This, however,
+        # prevents the spacing to be completely uniform.
+        if flag and pos[1] < VEHICLE_LENGTH:
+            pos0, pos1 = pos
+            pos = (pos0, VEHICLE_LENGTH)
+            x += VEHICLE_LENGTH
+            increment -= (VEHICLE_LENGTH * self.num_lanes(pos0)) / \
+                num_remaining
+
+        return x, pos, increment
 
     def gen_random_start_pos(self, initial_config, num_vehicles, **kwargs):
         """Generate random starting positions.
@@ -451,49 +549,42 @@ class Scenario(Serializable):
             available_length -= efs * min([self.num_lanes(edge), lanes_distr])
 
         # choose random positions for each vehicle
-        init_absolute_pos = \
+        init_absolute_pos = np.array(
             [random.random() * available_length
-             for _ in range(num_vehicles)]
+             for _ in range(num_vehicles)])
 
         # sort the positions of vehicles, for simplicity in using
         init_absolute_pos.sort()
 
         # these positions do not include the length of the vehicle, which need
         # to be added
-        for i in range(num_vehicles):
-            init_absolute_pos[i] += (VEHICLE_LENGTH + min_gap) * i
-
-        decrement = 0
-        edge_indx = 0
-        startpositions = []
-        startlanes = []
-        for i in range(num_vehicles):
-            edge_i = available_edges[edge_indx]
-            pos_i = (init_absolute_pos[i] - decrement) % (
-                    self.edge_length(edge_i) - efs)
-            lane_i = int(((init_absolute_pos[i] - decrement) - pos_i) /
-                         (self.edge_length(edge_i) - efs))
-
-            pos_i += efs
-
-            while lane_i > min([self.num_lanes(edge_i), lanes_distr]) - 1:
-                decrement += min([self.num_lanes(edge_i), lanes_distr]) \
-                             * (self.edge_length(edge_i) - efs)
-                edge_indx += 1
-
-                edge_i = available_edges[edge_indx]
-                pos_i = (init_absolute_pos[i] - decrement) % (
-                        self.edge_length(edge_i) - efs)
-
-                lane_i = int(((init_absolute_pos[i] - decrement) - pos_i) /
-                             (self.edge_length(edge_i) - efs))
-
-                pos_i += efs
+        init_absolute_pos += (VEHICLE_LENGTH + min_gap) * \
+            np.arange(num_vehicles)
+
+        # the positions are distributed over the usable length of every lane
+        # of the available edges, one edge after the other. Each position is
+        # mapped to an edge, a lane, and a relative position through the
+        # cumulative usable length of the edges.
+        usable_length = np.array(
+            [self.edge_length(edge) - efs for edge in available_edges])
+        num_lanes = np.array(
+            [min([self.num_lanes(edge), lanes_distr])
+             for edge in available_edges])
+        edge_end = np.cumsum(usable_length * num_lanes)
+        edge_indx = np.searchsorted(edge_end, init_absolute_pos, side="right")
+        if np.any(edge_indx >= len(available_edges)):
+            raise ValueError("There is not enough space to place all vehicles "
+                             "in the network.")
+        rel_pos = init_absolute_pos - (edge_end - usable_length * num_lanes)[
+            edge_indx]
+        pos = rel_pos % usable_length[edge_indx]
+        startlanes = ((rel_pos - pos) / usable_length[edge_indx]).astype(int)
+        pos += efs
 
-            startpositions.append((edge_i, pos_i))
-            startlanes.append(lane_i)
+        startpositions = list(zip(
+            [available_edges[i] for i in edge_indx], pos.tolist()))
 
-        return startpositions, startlanes
+        return startpositions, startlanes.tolist()
 
     def gen_custom_start_pos(self, initial_config, num_vehicles, **kwargs):
         """Generate a user defined set of starting positions.
@@ -574,15 +665,17 @@ class Scenario(Serializable):
         if "bunching" in kwargs:
             bunching = kwargs["bunching"]
 
-        # compute the lanes distribution (adjust of edge cases)
+        # edges vehicles are distributed over, and their lengths and number
+        # of lanes
         if initial_config.edges_distribution == "all":
-            max_lane = max(
-                [self.num_lanes(edge_id) for edge_id in self.get_edge_list()])
+            edges = self.get_edge_list()
         else:
-            max_lane = max([
-                self.num_lanes(edge_id)
-                for edge_id in initial_config.edges_distribution
-            ])
+            edges = initial_config.edges_distribution
+        lengths = [self.edge_length(edge_id) for edge_id in edges]
+        num_lanes = [self.num_lanes(edge_id) for edge_id in edges]
+
+        # compute the lanes distribution (adjust of edge cases)
+        max_lane = max(num_lanes)
 
         if initial_config.lanes_distribution > max_lane:
             lanes_distribution = max_lane
@@ -592,27 +685,13 @@ class Scenario(Serializable):
         else:
             lanes_distribution = initial_config.lanes_distribution
 
-        if initial_config.edges_distribution == "all":
-            distribution_length = \
-                sum(self.edge_length(edge_id) *
-                    min([self.num_lanes(edge_id), lanes_distribution])
-                    for edge_id in self.get_edge_list()
-                    if self.edge_length(edge_id) > min_gap + VEHICLE_LENGTH)
-        else:
-            distribution_length = \
-                sum(self.edge_length(edge_id) *
-                    min(self.num_lanes(edge_id), lanes_distribution)
-                    for edge_id in initial_config.edges_distribution
-                    if self.edge_length(edge_id) > min_gap + VEHICLE_LENGTH)
-
-        if initial_config.edges_distribution == "all":
-            available_edges = [
-                edge for edge in self.get_edge_list()
-                if self.edge_length(edge) > min_gap + VEHICLE_LENGTH]
-        else:
-            available_edges = [
-                edge for edge in initial_config.edges_distribution
-                if self.edge_length(edge) > min_gap + VEHICLE_LENGTH]
+        # edges that are long enough to fit a vehicle
+        available = [i for i in range(len(edges))
+                     if lengths[i] > min_gap + VEHICLE_LENGTH]
+        available_edges = [edges[i] for i in available]
+        distribution_length = sum(
+            lengths[i] * min(num_lanes[i], lanes_distribution)
+            for i in available)
 
         available_length = \
             distribution_length - lanes_distribution * bunching - \
@@ -672,10 +751,7 @@ class Scenario(Serializable):
         These edges may also be internal links (junctions). Returns an empty
         list if there are no edge/lane pairs in front.
         """
-        try:
-            return self._connections["next"][edge][lane]
-        except KeyError:
-            return []
+        return self.topology.next_edge(edge, lane)
 
     def prev_edge(self, edge, lane):
         """Return the edge/lane pair right before this edge/lane.
@@ -683,10 +759,7 @@ class Scenario(Serializable):
         These edges may also be internal links (junctions). Returns an empty
         list if there are no edge/lane pairs behind.
         """
-        try:
-            return self._connections["prev"][edge][lane]
-        except KeyError:
-            return []
+        return self.topology.prev_edge(edge, lane)
 
     def generate_net(self, net_params, traffic_lights):
         """Generate Net files for the transportation network.
@@ -732,56 +805,54 @@ class Scenario(Serializable):
         """
         # specify the attributes of the nodes
         nodes = self.specify_nodes(net_params)
+        nodes_by_id = {node["id"]: node for node in nodes}
 
         # add traffic lights to the nodes
-        for n_id in traffic_lights.get_ids():
-            indx = next(i for i, nd in enumerate(nodes) if nd["id"] == n_id)
-            nodes[indx]["type"] = "traffic_light"
+        tl_ids = set(traffic_lights.get_ids())
+        for n_id in tl_ids:
+            nodes_by_id[n_id]["type"] = "traffic_light"
 
         # for nodes that have traffic lights that haven't been added
         for node in nodes:
-            if node["id"] not in traffic_lights.get_ids() \
+            if node["id"] not in tl_ids \
                     and node.get("type", None) == "traffic_light":
                 traffic_lights.add(node["id"])
 
-        # xml file for nodes; contains nodes for the boundary points with
-        # respect to the x and y axes
-        x = makexml("nodes", "http://sumo.dlr.de/xsd/nodes_file.xsd")
-        for node_attributes in nodes:
-            x.append(E("node", **node_attributes))
-        printxml(x, self.net_path + self.nodfn)
-
         # collect the attributes of each edge
         edges = self.specify_edges(net_params)
 
-        # xml file for edges
-        x = makexml("edges", "http://sumo.dlr.de/xsd/edges_file.xsd")
-        for edge_attributes in edges:
-            x.append(E("edge", attrib=edge_attributes))
-        printxml(x, self.net_path + self.edgfn)
-
         # specify the types attributes (default is None)
         types = self.specify_types(net_params)
 
-        # xml file for types: contains the the number of lanes and the speed
-        # limit for the lanes
-        if types is not None:
-            x = makexml("types", "http://sumo.dlr.de/xsd/types_file.xsd")
-            for type_attributes in types:
-                x.append(E("type", **type_attributes))
-            printxml(x, self.net_path + self.typfn)
-
         # specify the connection attributes (default is None)
         connections = self.specify_connections(net_params)
 
-        # xml for connections: specifies which lanes connect to which in the
-        # edges
+        # xml files for:
+        # - nodes: contains nodes for the boundary points with respect to the
+        #   x and y axes
+        # - edges
+        # - types: contains the the number of lanes and the speed limit for
+        #   the lanes
+        # - connections: specifies which lanes connect to which in the edges
+        # The files are streamed to disk, without building their trees.
+        xml_files = [
+            (self.nodfn, "nodes", "http://sumo.dlr.de/xsd/nodes_file.xsd",
+             "node", nodes),
+            (self.edgfn, "edges", "http://sumo.dlr.de/xsd/edges_file.xsd",
+             "edge", edges)]
+        if types is not None:
+            xml_files.append(
+                (self.typfn, "types", "http://sumo.dlr.de/xsd/types_file.xsd",
+                 "type", types))
         if connections is not None:
-            x = makexml("connections",
-                        "http://sumo.dlr.de/xsd/connections_file.xsd")
-            for connection_attributes in connections:
-                x.append(E("connection", **connection_attributes))
-            printxml(x, self.net_path + self.confn)
+            xml_files.append(
+                (self.confn, "connections",
+                 "http://sumo.dlr.de/xsd/connections_file.xsd",
+                 "connection", connections))
+
+        for fn, name, nsl, tag, elements in xml_files:
+            writexml(self.net_path + fn, name, nsl,
+                     (E(tag, attrib=attributes) for attributes in elements))
 
         # check whether the user requested no-internal-links (default="true")
         if net_params.no_internal_links:
@@ -812,13 +883,21 @@ class Scenario(Serializable):
         x.append(t)
         printxml(x, self.net_path + self.cfgfn)
 
-        subprocess.call(
-            [
-                "netconvert -c " + self.net_path + self.cfgfn +
-                " --output-file=" + self.cfg_path + self.netfn +
-                ' --no-internal-links="%s"' % no_internal_links
-            ],
-            shell=True)
+        def netconvert():
+            subprocess.call(
+                [
+                    "netconvert -c " + self.net_path + self.cfgfn +
+                    " --output-file=" + self.cfg_path + self.netfn +
+                    ' --no-internal-links="%s"' % no_internal_links
+                ],
+                shell=True)
+
+        # the network file only depends on the content of the input files
+        # and processing options, and may be reused from identical networks
+        self._generate_net_file(
+            netconvert,
+            [self.net_path + fn for fn, _, _, _, _ in xml_files],
+            ["no-internal-links", no_internal_links, "no-turnarounds"])
 
         # collect data from the generated network configuration file
         error = None
@@ -832,6 +911,62 @@ class Scenario(Serializable):
                 time.sleep(WAIT_ON_ERROR)
         raise error
 
+    def _generate_net_file(self, netconvert, input_files, options):
+        """Generate the .net.xml file, or reuse a cached copy of it.
+
+        If net_params.cache_net is set, the network file is stored in a cache
+        indexed by the content of the files and options netconvert is called
+        with. Scenarios with identical inputs (e.g. grids with the same shape
+        and edge parameters) copy the cached file instead of calling
+        netconvert again.
+
+        Parameters
+        ----------
+        netconvert : callable
+            function writing the network file to cfg_path + netfn
+        input_files : list of str
+            paths to the files the network file is generated from
+        options : list of str
+            options the network file is generated with
+
+        Returns
+        -------
+        str or None
+            path to the cached network file, or None if the network is not
+            cached. Other data derived from the network (e.g. its parsed
+            topology) may be cached next to this file.
+        """
+        if not getattr(self.net_params, "cache_net", False):
+            netconvert()
+            return None
+
+        key = hashlib.sha1()
+        for path in input_files:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    key.update(chunk)
+            key.update(b"\0")
+        # files generated by different versions of sumo are not reused
+        binary = shutil.which("netconvert")
+        if binary is not None:
+            options = options + [binary, str(os.path.getmtime(binary))]
+        key.update("\0".join(options).encode())
+
+        cache_path = ensure_dir(os.path.join(self.net_path, "cache"))
+        cached_file = os.path.join(cache_path, key.hexdigest() + ".net.xml")
+        net_file = os.path.join(self.cfg_path, self.netfn)
+        if os.path.isfile(cached_file):
+            shutil.copyfile(cached_file, net_file)
+            return cached_file
+
+        netconvert()
+        if os.path.isfile(net_file):
+            # copy atomically, in case several processes fill the cache
+            tmp_file = "{}.{}.tmp".format(cached_file, os.getpid())
+            shutil.copyfile(net_file, tmp_file)
+            os.replace(tmp_file, cached_file)
+        return cached_file
+
     def generate_cfg(self, net_params, traffic_lights):
         """Generate .sumo.cfg files using net files and netconvert.
 
@@ -854,8 +989,8 @@ class Scenario(Serializable):
         # specify routes vehicles can take
         self.rts = self.specify_routes(net_params)
 
-        add = makexml("additional",
-                      "http://sumo.dlr.de/xsd/additional_file.xsd")
+        # elements of the .add.xml file
+        add = []
 
         # add the routes to the .add.xml file
         for (edge, route) in self.rts.items():
@@ -930,7 +1065,8 @@ class Scenario(Serializable):
 
                     add.append(e)
 
-        printxml(add, self.cfg_path + self.addfn)
+        writexml(self.cfg_path + self.addfn, "additional",
+                 "http://sumo.dlr.de/xsd/additional_file.xsd", add)
 
         gui = E("viewsettings")
         gui.append(E("scheme", name="real world"))
@@ -985,7 +1121,8 @@ class Scenario(Serializable):
             vehicles are assigned starting positions
         """
         vehicles = scenario.vehicles
-        routes = makexml("routes", "http://sumo.dlr.de/xsd/routes_file.xsd")
+        # elements of the .rou.xml file
+        routes = []
 
         # add the types of vehicles to the xml file
         for params in vehicles.types:
@@ -1026,7 +1163,8 @@ class Scenario(Serializable):
                         inflow[key] = repr(inflow[key])
                 routes.append(self._flow(**inflow))
 
-        printxml(routes, self.cfg_path + self.roufn)
+        writexml(self.cfg_path + self.roufn, "routes",
+                 "http://sumo.dlr.de/xsd/routes_file.xsd", routes)
 
     def specify_nodes(self, net_params):
         """Specify the attributes of nodes in the network.
@@ -1197,6 +1335,12 @@ class Scenario(Serializable):
         network configuration file, and returns the information on the edges
         and junctions located in the file.
 
+        The file is parsed by `_read_net_file`. If net_params.cache_net is
+        set, the result is stored in a binary sidecar file next to the
+        network file (see NET_SIDECAR_SUFFIX), which is loaded instead of the
+        network file by subsequent calls, as long as the network file is left
+        unchanged.
+
         Returns
         -------
         net_data : dict <dict>
@@ -1210,106 +1354,173 @@ class Scenario(Serializable):
                     Element = list of edge/lane pairs preceding or following
                     the edge/lane pairs
         """
-        # import the .net.xml file containing all edge/type data
-        parser = etree.XMLParser(recover=True)
-        tree = ElementTree.parse(
-            os.path.join(self.cfg_path, self.netfn), parser=parser)
-
-        root = tree.getroot()
-
-        # Collect information on the available types (if any are available).
-        # This may be used when specifying some edge data.
-        types_data = dict()
-
-        for typ in root.findall('type'):
-            type_id = typ.attrib["id"]
-            types_data[type_id] = dict()
-
-            if "speed" in typ.attrib:
-                types_data[type_id]["speed"] = float(typ.attrib["speed"])
-            else:
-                types_data[type_id]["speed"] = None
-
-            if "numLanes" in typ.attrib:
-                types_data[type_id]["numLanes"] = int(typ.attrib["numLanes"])
-            else:
-                types_data[type_id]["numLanes"] = None
+        net_file = os.path.join(self.cfg_path, self.netfn)
+        sidecar = net_file + NET_SIDECAR_SUFFIX
+        no_internal_links = bool(self.net_params.no_internal_links)
+        stat = os.stat(net_file)
+        source = np.array([stat.st_size, stat.st_mtime_ns, no_internal_links],
+                          dtype=np.int64)
+
+        net = None
+        use_sidecar = getattr(self.net_params, "cache_net", False)
+        if use_sidecar and os.path.isfile(sidecar):
+            try:
+                with np.load(sidecar, allow_pickle=False) as f:
+                    if np.array_equal(f["source"], source):
+                        net = {key: f[key] for key in f.files}
+            except (OSError, ValueError, KeyError):
+                net = None
+
+        if net is None:
+            net = self._read_net_file(net_file, no_internal_links)
+            if use_sidecar:
+                # the sidecar is written under a temporary name and moved
+                # afterwards, in case several processes parse the same file
+                tmp_file = "{}.{}.tmp".format(sidecar, os.getpid())
+                with open(tmp_file, "wb") as f:
+                    np.savez(f, source=source, **net)
+                os.replace(tmp_file, sidecar)
+
+        # the garbage collector is paused while the dictionaries are built,
+        # since none of the containers created here can form reference cycles
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._net_data_from_arrays(net)
+        finally:
+            if gc_enabled:
+                gc.enable()
 
-        net_data = dict()
-        next_conn_data = dict()  # forward looking connections
-        prev_conn_data = dict()  # backward looking connections
+    @staticmethod
+    def _net_data_from_arrays(net):
+        """Convert the arrays extracted by `_read_net_file` into dictionaries.
 
+        See `_import_edges_from_net` for the content of the dictionaries.
+        """
         # collect all information on the edges and junctions
-        for edge in root.findall('edge'):
-            edge_id = edge.attrib["id"]
-
-            # create a new key for this edge
-            net_data[edge_id] = dict()
-
-            # check for speed
-            if "speed" in edge:
-                net_data[edge_id]["speed"] = float(edge.attrib["speed"])
-            else:
-                net_data[edge_id]["speed"] = None
-
-            # if the edge has a type parameters, check that type for a
-            # speed and parameter if one was not already found
-            if "type" in edge.attrib and edge.attrib["type"] in types_data:
-                if net_data[edge_id]["speed"] is None:
-                    net_data[edge_id]["speed"] = \
-                        float(types_data[edge.attrib["type"]]["speed"])
-
-            # collect the length from the lane sub-element in the edge, the
-            # number of lanes from the number of lane elements, and if needed,
-            # also collect the speed value (assuming it is there)
-            net_data[edge_id]["lanes"] = 0
-            for i, lane in enumerate(edge):
-                net_data[edge_id]["lanes"] += 1
-                if i == 0:
-                    net_data[edge_id]["length"] = float(lane.attrib["length"])
-                    if net_data[edge_id]["speed"] is None \
-                            and "speed" in lane.attrib:
-                        net_data[edge_id]["speed"] = float(
-                            lane.attrib["speed"])
-
-            # if no speed value is present anywhere, set it to some default
-            if net_data[edge_id]["speed"] is None:
-                net_data[edge_id]["speed"] = 30
+        net_data = dict()
+        for edge_id, speed, lanes, length in zip(
+                net["edge_ids"].tolist(), net["speed"].tolist(),
+                net["lanes"].tolist(), net["length"].tolist()):
+            net_data[edge_id] = {"speed": speed, "lanes": lanes}
+            if lanes > 0:
+                net_data[edge_id]["length"] = length
 
         # collect connection data
-        for connection in root.findall('connection'):
-            from_edge = connection.attrib["from"]
-            from_lane = int(connection.attrib["fromLane"])
-
-            if from_edge[0] != ":" and not self.net_params.no_internal_links:
-                # if the edge is not an internal links and the network is
-                # allowed to have internal links, then get the next edge/lane
-                # pair from the "via" element
-                via = connection.attrib["via"].rsplit("_", 1)
-                to_edge = via[0]
-                to_lane = int(via[1])
-            else:
-                to_edge = connection.attrib["to"]
-                to_lane = int(connection.attrib["toLane"])
-
-            if from_edge not in next_conn_data:
-                next_conn_data[from_edge] = dict()
+        next_conn_data = dict()  # forward looking connections
+        prev_conn_data = dict()  # backward looking connections
+        conn_edges = net["conn_edges"].tolist()
+        for from_edge, from_lane, to_edge, to_lane in zip(
+                net["from_edge"].tolist(), net["from_lane"].tolist(),
+                net["to_edge"].tolist(), net["to_lane"].tolist()):
+            from_edge = conn_edges[from_edge]
+            to_edge = conn_edges[to_edge]
+            next_conn_data.setdefault(from_edge, {}).setdefault(
+                from_lane, []).append((to_edge, to_lane))
+            prev_conn_data.setdefault(to_edge, {}).setdefault(
+                to_lane, []).append((from_edge, from_lane))
 
-            if from_lane not in next_conn_data[from_edge]:
-                next_conn_data[from_edge][from_lane] = list()
+        connection_data = {"next": next_conn_data, "prev": prev_conn_data}
 
-            if to_edge not in prev_conn_data:
-                prev_conn_data[to_edge] = dict()
+        return net_data, connection_data
 
-            if to_lane not in prev_conn_data[to_edge]:
-                prev_conn_data[to_edge][to_lane] = list()
+    @staticmethod
+    def _read_net_file(net_file, no_internal_links):
+        """Extract the edges and connections of a .net.xml file.
 
-            next_conn_data[from_edge][from_lane].append((to_edge, to_lane))
-            prev_conn_data[to_edge][to_lane].append((from_edge, from_lane))
+        The file is streamed, and every element is discarded once its
+        attributes of interest are extracted, so that the whole network is
+        never held in memory.
 
-        connection_data = {"next": next_conn_data, "prev": prev_conn_data}
+        Parameters
+        ----------
+        net_file : str
+            path to the .net.xml file
+        no_internal_links : bool
+            whether the network was generated without internal links, in
+            which case connections lead directly to the next edge instead of
+            the internal lane they go through
 
-        return net_data, connection_data
+        Returns
+        -------
+        dict of np.ndarray
+            * edge_ids: names of the edges and junctions
+            * speed, lanes, length: speed limit, number of lanes, and length
+              of every edge (the length is NaN for edges without lanes)
+            * conn_edges: names of the edges of the connections
+            * from_edge, from_lane, to_edge, to_lane: edge/lane pairs of every
+              connection, with the edges indexed in conn_edges
+        """
+        # speed limits of the available types (if any are available). This
+        # may be used when specifying some edge data.
+        types_speed = dict()
+
+        edge_ids, speeds, lanes, lengths = [], [], [], []
+        conn_edges = dict()
+        conn = []
+
+        for _, elem in etree.iterparse(
+                net_file, tag=("type", "edge", "connection"), recover=True):
+            if elem.tag == "edge":
+                edge_type = elem.get("type")
+                speed = types_speed.get(edge_type)
+
+                # collect the length from the first lane of the edge, the
+                # number of lanes from the number of lane elements, and if
+                # needed, also collect the speed value (assuming it is there)
+                edge_lanes = elem.findall("lane")
+                length = float("nan")
+                if len(edge_lanes) > 0:
+                    length = float(edge_lanes[0].get("length"))
+                    if speed is None and "speed" in edge_lanes[0].attrib:
+                        speed = float(edge_lanes[0].get("speed"))
+
+                # if no speed value is present anywhere, set it to some
+                # default
+                edge_ids.append(elem.get("id"))
+                speeds.append(30 if speed is None else speed)
+                lanes.append(len(edge_lanes))
+                lengths.append(length)
+
+            elif elem.tag == "connection":
+                from_edge = elem.get("from")
+                from_lane = int(elem.get("fromLane"))
+
+                if from_edge[0] != ":" and not no_internal_links:
+                    # if the edge is not an internal links and the network is
+                    # allowed to have internal links, then get the next
+                    # edge/lane pair from the "via" element
+                    to_edge, to_lane = elem.get("via").rsplit("_", 1)
+                    to_lane = int(to_lane)
+                else:
+                    to_edge = elem.get("to")
+                    to_lane = int(elem.get("toLane"))
+
+                conn.append((conn_edges.setdefault(from_edge, len(conn_edges)),
+                             from_lane,
+                             conn_edges.setdefault(to_edge, len(conn_edges)),
+                             to_lane))
+
+            elif "speed" in elem.attrib:
+                types_speed[elem.get("id")] = float(elem.get("speed"))
+
+            # free the element and the elements preceding it
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+        conn = np.array(conn, dtype=np.int32).reshape(-1, 4)
+        return {
+            "edge_ids": np.array(edge_ids, dtype=str),
+            "speed": np.array(speeds, dtype=float),
+            "lanes": np.array(lanes, dtype=np.int32),
+            "length": np.array(lengths, dtype=float),
+            "conn_edges": np.array(list(conn_edges), dtype=str),
+            "from_edge": conn[:, 0],
+            "from_lane": conn[:, 1],
+            "to_edge": conn[:, 2],
+            "to_lane": conn[:, 3],
+        }
 
     def close(self):
         """Close the scenario class.
@@ -1338,6 +1549,12 @@ class Scenario(Serializable):
         except OSError:
             pass
 
+        # nor the parsed network file
+        try:
+            os.remove(self.cfg_path + self.netfn + NET_SIDECAR_SUFFIX)
+        except OSError:
+            pass
+
     def __str__(self):
         """Return the name of the scenario and the number of vehicles."""
         return "Scenario " + self.name + " with " + \
@@ -1,12 +1,97 @@
 """Contains the scenario class for OpenStreetMap files."""
 
+from lxml import etree
+
 from flow.core.params import InitialConfig
 from flow.core.traffic_lights import TrafficLights
+from flow.core.util import load_net_topology, save_net_topology
 from flow.scenarios.base_scenario import Scenario
+import os
 import sys
 import subprocess
 
 
+def _clear(elem):
+    """Free an element and its preceding siblings, once processed."""
+    elem.clear()
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
+
+
+def clip_osm(osm_path, output_path, bbox=None, ways=None):
+    """Clip an OpenStreetMap file to a bounding box and/or a set of ways.
+
+    The file is streamed twice: the first pass selects the ways to be kept
+    and the nodes they reference, and the second one writes these elements,
+    as well as the relations whose members are all kept (e.g. turn
+    restrictions). Ways are kept in their entirety, even if some of their
+    nodes are located outside the bounding box.
+
+    Parameters
+    ----------
+    osm_path : str
+        path to the .osm file
+    output_path : str
+        path to the clipped .osm file
+    bbox : (float, float, float, float), optional
+        bounding box (west, south, east, north, in degrees). Only the ways
+        with at least one node inside the box are kept.
+    ways : set of str, optional
+        ids of the ways to be kept
+    """
+    # first pass: select the ways and nodes to be kept
+    in_bbox = set()
+    kept_ways = set()
+    kept_nodes = set()
+    for _, elem in etree.iterparse(osm_path, tag=("node", "way")):
+        if elem.tag == "node":
+            if bbox is not None:
+                lon, lat = float(elem.get("lon")), float(elem.get("lat"))
+                if bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]:
+                    in_bbox.add(elem.get("id"))
+        else:
+            refs = [nd.get("ref") for nd in elem.iterfind("nd")]
+            if (ways is None or elem.get("id") in ways) and \
+                    (bbox is None or any(ref in in_bbox for ref in refs)):
+                kept_ways.add(elem.get("id"))
+                kept_nodes.update(refs)
+        _clear(elem)
+    del in_bbox
+
+    kept = {"node": kept_nodes, "way": kept_ways}
+
+    # second pass: write the kept elements
+    context = etree.iterparse(osm_path, events=("start", "end"))
+    _, root = next(context)
+    with etree.xmlfile(output_path, encoding="UTF-8") as xf:
+        xf.write_declaration()
+        with xf.element("osm", dict(root.attrib)):
+            if bbox is not None:
+                xf.write("\n  ", etree.Element("bounds", {
+                    "minlon": repr(bbox[0]), "minlat": repr(bbox[1]),
+                    "maxlon": repr(bbox[2]), "maxlat": repr(bbox[3])}))
+
+            for event, elem in context:
+                if event != "end" or elem.getparent() is not root:
+                    continue
+
+                if elem.tag in kept:
+                    write = elem.get("id") in kept[elem.tag]
+                elif elem.tag == "relation":
+                    write = all(
+                        member.get("ref") in kept[member.get("type")]
+                        for member in elem.iterfind("member")
+                        if member.get("type") in kept)
+                else:
+                    write = elem.tag != "bounds" or bbox is None
+
+                if write:
+                    xf.write("\n  ", elem, with_tail=False)
+                _clear(elem)
+
+            xf.write("\n")
+
+
 class OpenStreetMapScenario(Scenario):
     """Class used to generate network files from an OpenStreetMap (.osm) file.
 
@@ -41,41 +126,72 @@ class OpenStreetMapScenario(Scenario):
         """See parent class.
 
         The network file is generated from the .osm file specified in
-        net_params.osm_path
+        net_params.osm_path. If net_params.osm_bbox or net_params.osm_edges
+        are specified, the .osm file is first clipped to the corresponding
+        roads (see clip_osm).
+
+        If net_params.cache_net is set, both the network file and its parsed
+        topology are cached, indexed by the content of the .osm file and the
+        conversion options, so that large networks are only converted and
+        parsed once.
         """
         # specify the location of the input osm file
         osm_path = net_params.osm_path
 
-        # specify the location of the output file
-        netfn = "%s.net.xml" % self.name
-
-        # generate the network file with sumo
-        net_cmd = "netconvert --osm-files {0} --output-file {1}".\
-            format(osm_path, self.cfg_path + netfn)
-
         # this handles removing all roads in the network that cannot be ridden
         # by vehicles
-        net_cmd += \
-            " --remove-edges.by-vclass rail_slow,rail_fast,bicycle,pedestrian"
+        options = ["--remove-edges.by-vclass",
+                   "rail_slow,rail_fast,bicycle,pedestrian"]
 
         # this removes edges that are not connected to a network (isolated)
-        net_cmd += " --remove-edges.isolated"
+        options += ["--remove-edges.isolated"]
 
         # this removes internal links from the network (useful when the network
         # becomes very large)
         if net_params.no_internal_links:
-            net_cmd += " --no_internal_links"
-
-        subprocess.call(
-            net_cmd, stdout=sys.stdout, stderr=sys.stderr, shell=True)
-
-        # name of the .net.xml file (located in cfg_path)
-        self.netfn = netfn
+            options += ["--no-internal-links", "true"]
+
+        # this keeps only the requested edges, and the ways they are part of
+        # in the clipped osm file. Edges generated from osm ways are named
+        # after the way, e.g. "-123#2" for the third edge of the way with id
+        # 123 in its opposite direction.
+        bbox = net_params.osm_bbox
+        ways = None
+        if net_params.osm_edges is not None:
+            options += ["--keep-edges.explicit",
+                        ",".join(net_params.osm_edges)]
+            ways = {edge.lstrip("-").split("#")[0]
+                    for edge in net_params.osm_edges}
+
+        def netconvert():
+            input_path = osm_path
+            if bbox is not None or ways is not None:
+                input_path = os.path.join(
+                    self.net_path, "%s.clipped.osm" % self.name)
+                clip_osm(osm_path, input_path, bbox=bbox, ways=ways)
+
+            # generate the network file with sumo
+            net_cmd = "netconvert --osm-files {0} --output-file {1} {2}".\
+                format(input_path, self.cfg_path + self.netfn,
+                       " ".join(options))
+            subprocess.call(
+                net_cmd, stdout=sys.stdout, stderr=sys.stderr, shell=True)
+
+        key_options = options + ["osm_bbox", repr(bbox)]
+        cached_file = self._generate_net_file(
+            netconvert, [osm_path], key_options)
 
         # collect data from the generated network configuration file
-        edges_dict, conn_dict = self._import_edges_from_net()
-
-        return edges_dict, conn_dict
+        if cached_file is None:
+            return self._import_edges_from_net()
+
+        # the parsed topology is cached next to the network file, and only
+        # the requested edges are loaded from it
+        topology_file = cached_file[:-len(".net.xml")] + ".topology"
+        if not os.path.isfile(topology_file):
+            edges_dict, conn_dict = self._import_edges_from_net()
+            save_net_topology(topology_file, edges_dict, conn_dict)
+        return load_net_topology(topology_file, edges=net_params.osm_edges)
 
     def specify_nodes(self, net_params):
         """See class definition."""
@@ -0,0 +1,387 @@
+"""Contains the tiled scenario class."""
+
+from copy import deepcopy
+import os
+import xml.etree.ElementTree as ElementTree
+
+from flow.core.params import InFlows, InitialConfig
+from flow.core.traffic_lights import TrafficLights
+from flow.core.vehicles import Vehicles
+from flow.scenarios.base_scenario import Scenario
+
+ADDITIONAL_NET_PARAMS = {
+    # scenario class (or name of a scenario class in flow.scenarios) that is
+    # replicated
+    "scenario": "LoopScenario",
+    # number of replicas of the scenario
+    "num_replicas": 4,
+    # distance in between the bounding boxes of consecutive replicas, in
+    # meters
+    "replica_spacing": 50,
+}
+
+# properties of traffic lights, and the arguments of TrafficLights.add they
+# are specified through
+TLS_PROPERTIES = {
+    "type": "tls_type",
+    "programID": "programID",
+    "offset": "offset",
+    "phases": "phases",
+    "max-gap": "maxGap",
+    "detector-gap": "detectorGap",
+    "show-detectors": "showDetectors",
+    "file": "file",
+    "freq": "freq",
+}
+
+
+def replica_prefix(index):
+    """Return the prefix of the nodes, edges and routes of a replica."""
+    return "r%d_" % index
+
+
+class TiledScenario(Scenario):
+    """Scenario made of several disjoint replicas of another scenario.
+
+    The network contains `num_replicas` copies of the network of the base
+    scenario, offset from one another along the x axis. The nodes, edges,
+    routes, traffic lights, and inflows of every replica are prefixed by
+    "r<index>_" (e.g. the edge "bottom" of the third replica of a ring road is
+    named "r2_bottom"), and the vehicles of every replica are placed as they
+    would be in the base scenario. Replicas are also disjoint in the 1-D
+    reference frame of the network (see `get_x`): the positions of the
+    replica with index k are offset by k * replica_length.
+
+    This allows a single sumo instance to simulate several independent copies
+    of a small scenario at once, e.g. through flow.envs.tiled_env.TiledEnv,
+    which exposes every replica as a separate environment.
+
+    Requires from net_params:
+
+    * scenario: scenario class (or name of a scenario class in
+      flow.scenarios) that is replicated. The network parameters of this
+      scenario are specified in the same net_params.
+    * num_replicas: number of replicas of the scenario
+    * replica_spacing: distance in between the bounding boxes of consecutive
+      replicas, in meters
+
+    The vehicles, initial_config, and traffic_lights objects describe a
+    single replica. The vehicles of the tiled scenario (see the `vehicles`
+    attribute) contain `num_replicas` times as many vehicles of every type.
+
+    Attributes
+    ----------
+    base : flow.scenarios.Scenario type
+        a single replica of the scenario, with the original names of the
+        nodes and edges
+    num_replicas : int
+        number of replicas
+    replica_length : float
+        offset in between the positions of consecutive replicas in the 1-D
+        reference frame of the network
+    """
+
+    def __init__(self,
+                 name,
+                 vehicles,
+                 net_params,
+                 initial_config=InitialConfig(),
+                 traffic_lights=TrafficLights()):
+        """Initialize a tiled scenario.
+
+        See flow/scenarios/base_scenario.py for description of params.
+        """
+        for p in ADDITIONAL_NET_PARAMS.keys():
+            if p not in net_params.additional_params:
+                raise KeyError('Network parameter "{}" not supplied'.format(p))
+
+        params = net_params.additional_params
+        scenario_class = params["scenario"]
+        if isinstance(scenario_class, str):
+            import flow.scenarios
+            scenario_class = getattr(flow.scenarios, scenario_class)
+        self.num_replicas = params["num_replicas"]
+        self.replica_spacing = params["replica_spacing"]
+
+        # generate a single replica, and collect the elements of its network
+        self.base = scenario_class(name + "_base", vehicles, net_params,
+                                   initial_config, traffic_lights)
+        self._base_elements = self._read_base_network()
+        self.base.close()
+
+        # width of a replica along the x axis, and offset in between the
+        # positions of consecutive replicas
+        x = [float(node["x"]) for node in self._base_elements["node"]]
+        for edge in self._base_elements["edge"]:
+            if "shape" in edge:
+                x += [float(point.split(",")[0])
+                      for point in edge["shape"].split()]
+        self.replica_width = max(x) - min(x) + self.replica_spacing
+
+        base_edges = set(self.base.get_edge_list() +
+                         self.base.get_junction_list())
+        self.replica_length = max(
+            pos + self.base.edge_length(edge)
+            for edge, pos in self.base.edgestarts +
+            self.base.internal_edgestarts if edge in base_edges)
+
+        # the portion of the network in which vehicles are distributed is a
+        # single replica (see generate_starting_positions)
+        self.length = self.base.length
+
+        # replicate the vehicles, traffic lights, and inflows of the replica
+        tiled_vehicles = Vehicles(
+            max_flow_window=vehicles.max_flow_window,
+            record_flow_ids=vehicles.record_flow_ids)
+        for type_params in vehicles.initial:
+            type_params = dict(type_params)
+            type_params["num_vehicles"] *= self.num_replicas
+            tiled_vehicles.add(**type_params)
+
+        tiled_traffic_lights = TrafficLights(baseline=traffic_lights.baseline)
+        for k in range(self.num_replicas):
+            for node_id, properties in \
+                    traffic_lights.get_properties().items():
+                tiled_traffic_lights.add(
+                    self.prefix(k, node_id),
+                    **{TLS_PROPERTIES[key]: value
+                       for key, value in properties.items()
+                       if key in TLS_PROPERTIES})
+
+        tiled_net_params = deepcopy(net_params)
+        tiled_net_params.inflows = InFlows()
+        for k in range(self.num_replicas):
+            for inflow in net_params.inflows.get():
+                inflow = dict(inflow)
+                # the index of the inflow is appended again by InFlows.add
+                name = replica_prefix(k) + inflow.pop("name").rsplit("_", 1)[0]
+                veh_type = inflow.pop("vtype")
+                edge = self.prefix(k, inflow.pop("route")[len("route"):])
+                vehs_per_hour = inflow.pop("vehsPerHour", None)
+                tiled_net_params.inflows.add(
+                    veh_type, edge, name=name, begin=inflow.pop("begin", None),
+                    vehs_per_hour=vehs_per_hour, **inflow)
+
+        super().__init__(name, tiled_vehicles, tiled_net_params,
+                         initial_config, tiled_traffic_lights)
+
+        # replica of every edge and junction of the network
+        self._replica_of_edge = {
+            edge: self._parse_replica(edge) for edge in self._edges}
+
+    def _read_base_network(self):
+        """Read the nodes, edges, types, and connections of the base network.
+
+        These are read from the files generated by the base scenario instead
+        of calling its specify methods again, since the latter may modify the
+        state of the base scenario.
+        """
+        base = self.base
+        if not os.path.isfile(base.net_path + base.nodfn):
+            raise ValueError(
+                "{} cannot be tiled, as its network is not generated from "
+                "nodes and edges.".format(type(base).__name__))
+
+        elements = {}
+        for tag, fn in [("node", base.nodfn), ("edge", base.edgfn),
+                        ("type", base.typfn), ("connection", base.confn)]:
+            path = base.net_path + fn
+            if os.path.isfile(path):
+                root = ElementTree.parse(path).getroot()
+                elements[tag] = [dict(elem.attrib) for elem in root]
+            else:
+                elements[tag] = None
+        return elements
+
+    @staticmethod
+    def prefix(index, name):
+        """Return the name of a node or edge of the base scenario in a replica.
+
+        Parameters
+        ----------
+        index : int
+            index of the replica
+        name : str
+            name of the node or edge in the base scenario. The names of
+            internal edges (junctions) start with ":", which is preserved.
+
+        Returns
+        -------
+        str
+            name of the node or edge in the replica
+        """
+        if name.startswith(":"):
+            return ":" + replica_prefix(index) + name[1:]
+        return replica_prefix(index) + name
+
+    @staticmethod
+    def _parse_replica(edge):
+        """Return the replica of an edge from its name, or None."""
+        name = edge[1:] if edge.startswith(":") else edge
+        head, sep, _ = name.partition("_")
+        if not sep or not head.startswith("r") or not head[1:].isdigit():
+            return None
+        return int(head[1:])
+
+    def get_replica(self, edge):
+        """Return the index of the replica an edge is located in.
+
+        Parameters
+        ----------
+        edge : str
+            name of an edge or junction of the tiled network
+
+        Returns
+        -------
+        int or None
+            index of the replica, or None if the edge is not part of any
+            replica (e.g. "" for vehicles that are not in the network)
+        """
+        try:
+            return self._replica_of_edge[edge]
+        except KeyError:
+            return self._parse_replica(edge) if edge else None
+
+    def get_base_edge(self, edge):
+        """Return the name of an edge of the tiled network in its replica.
+
+        Parameters
+        ----------
+        edge : str
+            name of an edge or junction of the tiled network
+
+        Returns
+        -------
+        str
+            name of the edge in the base scenario, or the name itself if the
+            edge is not part of any replica
+        """
+        k = self.get_replica(edge)
+        if k is None:
+            return edge
+        start = len(replica_prefix(k))
+        if edge.startswith(":"):
+            return ":" + edge[start + 1:]
+        return edge[start:]
+
+    def specify_nodes(self, net_params):
+        """See parent class."""
+        nodes = []
+        for k in range(self.num_replicas):
+            dx = k * self.replica_width
+            for node in self._base_elements["node"]:
+                node = dict(node)
+                node["id"] = self.prefix(k, node["id"])
+                node["x"] = repr(float(node["x"]) + dx)
+                nodes.append(node)
+        return nodes
+
+    def specify_edges(self, net_params):
+        """See parent class."""
+        edges = []
+        for k in range(self.num_replicas):
+            dx = k * self.replica_width
+            for edge in self._base_elements["edge"]:
+                edge = dict(edge)
+                edge["id"] = self.prefix(k, edge["id"])
+                edge["from"] = self.prefix(k, edge["from"])
+                edge["to"] = self.prefix(k, edge["to"])
+                if "shape" in edge:
+                    edge["shape"] = " ".join(
+                        self._shift_point(point, dx)
+                        for point in edge["shape"].split())
+                edges.append(edge)
+        return edges
+
+    @staticmethod
+    def _shift_point(point, dx):
+        """Shift a point of a shape ("x,y" or "x,y,z") along the x axis."""
+        coords = point.split(",")
+        coords[0] = "%.2f" % (float(coords[0]) + dx)
+        return ",".join(coords)
+
+    def specify_types(self, net_params):
+        """See parent class.
+
+        The types are shared by all replicas.
+        """
+        return self._base_elements["type"]
+
+    def specify_connections(self, net_params):
+        """See parent class."""
+        if self._base_elements["connection"] is None:
+            return None
+
+        connections = []
+        for k in range(self.num_replicas):
+            for connection in self._base_elements["connection"]:
+                connection = dict(connection)
+                connection["from"] = self.prefix(k, connection["from"])
+                connection["to"] = self.prefix(k, connection["to"])
+                connections.append(connection)
+        return connections
+
+    def specify_routes(self, net_params):
+        """See parent class."""
+        rts = {}
+        for k in range(self.num_replicas):
+            for edge, route in self.base.rts.items():
+                rts[self.prefix(k, edge)] = \
+                    [self.prefix(k, route_edge) for route_edge in route]
+        return rts
+
+    def _tile_edge_starts(self, edgestarts):
+        """Replicate edge starts, offsetting the positions of every replica."""
+        return [(self.prefix(k, edge), pos + k * self.replica_length)
+                for k in range(self.num_replicas)
+                for edge, pos in edgestarts]
+
+    def specify_edge_starts(self):
+        """See parent class."""
+        return self._tile_edge_starts(self.base.edgestarts)
+
+    def specify_internal_edge_starts(self):
+        """See parent class."""
+        return self._tile_edge_starts(self.base.internal_edgestarts)
+
+    def specify_intersection_edge_starts(self):
+        """See parent class."""
+        return self._tile_edge_starts(self.base.intersection_edgestarts)
+
+    def generate_starting_positions(self, num_vehicles=None, **kwargs):
+        """See parent class.
+
+        The starting positions of every replica are generated by the base
+        scenario. The vehicles of every type are assigned to replicas in
+        consecutive blocks, in the order of their ids (e.g. for 2 replicas of
+        a ring road with 21 "human" vehicles, "human_0" to "human_20" are
+        placed in the first replica and "human_21" to "human_41" in the
+        second one).
+        """
+        num_vehicles = num_vehicles or self.vehicles.num_vehicles
+        base_vehicles = self.base.vehicles
+        if num_vehicles != self.num_replicas * base_vehicles.num_vehicles:
+            raise ValueError(
+                "The number of vehicles ({}) must be {} times the number of "
+                "vehicles of the base scenario.".format(
+                    num_vehicles, self.num_replicas))
+
+        replicas = []
+        for k in range(self.num_replicas):
+            positions, lanes = self.base.generate_starting_positions(
+                num_vehicles=base_vehicles.num_vehicles, **kwargs)
+            positions = [(self.prefix(k, edge), pos)
+                         for edge, pos in positions]
+            replicas.append((positions, lanes))
+
+        startpositions = []
+        startlanes = []
+        start = 0
+        for type_params in base_vehicles.initial:
+            end = start + type_params["num_vehicles"]
+            for positions, lanes in replicas:
+                startpositions += positions[start:end]
+                startlanes += lanes[start:end]
+            start = end
+
+        return startpositions, startlanes
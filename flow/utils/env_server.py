@@ -0,0 +1,458 @@
+"""Local server hosting a pool of flow environments, and its client.
+
+A server process builds a pool of environments from a set of flow parameters
+(see flow.utils.registry.make_create_env), and serves reset/step/close
+requests over a local socket. Clients (e.g. trainers, evaluators, or
+visualizers) reserve environments from the pool and interact with them
+through gym-compatible proxies, or step several of them with a single
+request. This allows several processes on a node to share a warm pool of
+sumo instances instead of each starting their own.
+
+Usage
+-----
+Start a server from the flow_params.json file of an experiment:
+
+    python -m flow.utils.env_server flow_params.json --num_envs 8
+
+which prints the (randomly generated) key clients need to provide, and
+connect to it from other processes:
+
+>>> client = EnvClient(("localhost", 6000), bytes.fromhex(printed_key))
+>>> env_a, env_b = client.make_envs(2)
+>>> obs = env_a.reset()
+>>> results = client.step([env_a, env_b], [action_a, action_b])
+>>> client.close()
+"""
+
+import argparse
+from copy import deepcopy
+import os
+import pickle
+import struct
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import gym
+import numpy as np
+
+from flow.core.orchestrator import StepOrchestrator
+from flow.core.params import InitialConfig
+from flow.core.traffic_lights import TrafficLights
+
+DEFAULT_PORT = 6000
+
+
+class _ArrayRef:
+    """Placeholder of a numpy array within a packed message."""
+
+    def __init__(self, index):
+        self.index = index
+
+
+def pack_message(obj):
+    """Serialize a message, packing its numpy arrays as raw binary data.
+
+    Arrays located in (nested) lists, tuples, and dicts are replaced by
+    references, and their buffers are appended after the pickled remainder of
+    the message, so that observations are sent without any per-element
+    encoding.
+
+    Parameters
+    ----------
+    obj : any
+        message to be serialized
+
+    Returns
+    -------
+    bytes
+        serialized message
+    """
+    arrays = []
+
+    def strip(o):
+        if isinstance(o, np.ndarray):
+            arrays.append(np.ascontiguousarray(o))
+            return _ArrayRef(len(arrays) - 1)
+        if type(o) in (list, tuple):
+            return type(o)(strip(x) for x in o)
+        if type(o) is dict:
+            return {key: strip(value) for key, value in o.items()}
+        return o
+
+    body = strip(obj)
+    header = pickle.dumps(
+        (body, [(a.dtype.str, a.shape) for a in arrays]),
+        pickle.HIGHEST_PROTOCOL)
+    return b"".join([struct.pack("!I", len(header)), header] +
+                    [a.tobytes() for a in arrays])
+
+
+def unpack_message(data):
+    """Deserialize a message serialized by `pack_message`."""
+    header_len, = struct.unpack_from("!I", data)
+    body, array_specs = pickle.loads(data[4:4 + header_len])
+
+    arrays = []
+    offset = 4 + header_len
+    for dtype, shape in array_specs:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays.append(np.frombuffer(
+            data, dtype, count, offset).reshape(shape).copy())
+        offset += count * dtype.itemsize
+
+    def fill(o):
+        if isinstance(o, _ArrayRef):
+            return arrays[o.index]
+        if type(o) in (list, tuple):
+            return type(o)(fill(x) for x in o)
+        if type(o) is dict:
+            return {key: fill(value) for key, value in o.items()}
+        return o
+
+    return fill(body)
+
+
+def _env_from_flow_params(flow_params):
+    """Create an environment from flow-related parameters.
+
+    The environment is created directly from the parameters, which it keeps
+    (e.g. its vehicles and sumo parameters), rather than through the gym
+    registry, whose registered parameters are shared by all environments of
+    the same name.
+    """
+    module = __import__("flow.scenarios", fromlist=[flow_params["scenario"]])
+    scenario_class = getattr(module, flow_params["scenario"])
+    scenario = scenario_class(
+        name=flow_params["exp_tag"],
+        vehicles=flow_params["veh"],
+        net_params=flow_params["net"],
+        initial_config=flow_params.get("initial", InitialConfig()),
+        traffic_lights=flow_params.get("tls", TrafficLights()))
+
+    module = __import__("flow.envs", fromlist=[flow_params["env_name"]])
+    env_class = getattr(module, flow_params["env_name"])
+    return env_class(env_params=flow_params["env"],
+                     sumo_params=flow_params["sumo"],
+                     scenario=scenario)
+
+
+class EnvServer:
+    """Server hosting a pool of environments for local clients.
+
+    Every client connection is served by its own thread. Environments are
+    reserved by a client (see `EnvClient.make_envs`) until it releases them
+    or disconnects, after which they are returned to the pool. Batched step
+    requests are performed concurrently through a
+    flow.core.orchestrator.StepOrchestrator.
+    """
+
+    def __init__(self, envs, address=("localhost", DEFAULT_PORT),
+                 authkey=None):
+        """Instantiate the server.
+
+        Parameters
+        ----------
+        envs : list of gym.Env
+            environments in the pool
+        address : (str, int), optional
+            address the server listens on. Use port 0 to pick a free port
+            (see the `address` attribute)
+        authkey : bytes, optional
+            key clients need to provide to connect, randomly generated by
+            default (see the `authkey` attribute). Requests are unpickled, so
+            this key should only be shared with trusted clients.
+        """
+        self.envs = list(envs)
+        self.authkey = authkey if authkey is not None else os.urandom(32)
+        self.listener = Listener(address, authkey=self.authkey)
+        self.address = self.listener.address
+        self._free = list(range(len(self.envs)))
+        self._lock = threading.Lock()
+        self._running = False
+
+    @classmethod
+    def from_flow_params(cls, flow_params, num_envs, **kwargs):
+        """Create a server with a pool of environments built from params.
+
+        Parameters
+        ----------
+        flow_params : dict or str
+            flow-related parameters (see flow.utils.registry.make_create_env),
+            or their json serialization (see
+            flow.utils.rllib.FlowParamsEncoder)
+        num_envs : int
+            number of environments in the pool
+        kwargs : dict
+            additional arguments passed to the constructor
+
+        Returns
+        -------
+        EnvServer
+            the server
+        """
+        if isinstance(flow_params, str):
+            from flow.utils.rllib import get_flow_params
+            flow_params = get_flow_params(
+                {"env_config": {"flow_params": flow_params}})
+
+        return cls([_env_from_flow_params(deepcopy(flow_params))
+                    for _ in range(num_envs)], **kwargs)
+
+    def serve_forever(self):
+        """Accept and serve clients until a shutdown request is received."""
+        self._running = True
+        while True:
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError:
+                # ignore clients that do not provide the key
+                continue
+            if not self._running:
+                conn.close()
+                break
+            thread = threading.Thread(target=self._serve_client, args=(conn,))
+            thread.daemon = True
+            thread.start()
+        self.listener.close()
+
+    def shutdown(self, terminate_envs=True):
+        """Stop accepting clients, and (optionally) close the environments."""
+        if self._running:
+            self._running = False
+            # wake up the thread waiting for new clients
+            Client(self.address, authkey=self.authkey).close()
+        else:
+            self.listener.close()
+
+        if terminate_envs:
+            for env in self.envs:
+                env = getattr(env, "unwrapped", env)
+                if hasattr(env, "terminate"):
+                    env.terminate()
+                else:
+                    env.close()
+
+    def _serve_client(self, conn):
+        """Answer the requests of a single client until it disconnects."""
+        session = _Session()
+        try:
+            while True:
+                try:
+                    request = unpack_message(conn.recv_bytes())
+                except (EOFError, OSError):
+                    break
+
+                try:
+                    response = {"result": self._dispatch(session, request)}
+                except Exception as e:
+                    response = {"error": "{}: {}".format(
+                        type(e).__name__, e)}
+                conn.send_bytes(pack_message(response))
+
+                if request["cmd"] == "shutdown":
+                    break
+        finally:
+            self._release(session, session.env_ids)
+            conn.close()
+
+    def _dispatch(self, session, request):
+        """Perform a request of a client and return its result."""
+        cmd = request["cmd"]
+        if cmd == "acquire":
+            return self._acquire(session, request["num_envs"])
+        if cmd == "release":
+            return self._release(session, request["envs"])
+        if cmd == "reset":
+            envs = self._check_owned(session, request["envs"])
+            return [self.envs[i].reset() for i in envs]
+        if cmd == "step":
+            envs = self._check_owned(session, request["envs"])
+            if len(envs) == 1:
+                return [self.envs[envs[0]].step(request["actions"][0])]
+            return session.get_orchestrator(self.envs, envs).step(
+                request["actions"])
+        if cmd == "shutdown":
+            self._release(session, session.env_ids)
+            self.shutdown()
+            return None
+        raise ValueError("Unknown request: {}".format(cmd))
+
+    def _acquire(self, session, num_envs):
+        """Reserve environments of the pool for a client.
+
+        Returns the index, observation space, and action space of every
+        reserved environment.
+        """
+        with self._lock:
+            if num_envs > len(self._free):
+                raise ValueError(
+                    "Requested {} environments, but only {} are available."
+                    .format(num_envs, len(self._free)))
+            env_ids = self._free[:num_envs]
+            self._free = self._free[num_envs:]
+        session.env_ids.extend(env_ids)
+        return [(i, self.envs[i].observation_space,
+                 self.envs[i].action_space) for i in env_ids]
+
+    def _release(self, session, env_ids):
+        """Return environments reserved by a client to the pool."""
+        env_ids = [i for i in env_ids if i in session.env_ids]
+        for i in env_ids:
+            session.env_ids.remove(i)
+        session.close_orchestrators()
+        with self._lock:
+            self._free.extend(env_ids)
+
+    def _check_owned(self, session, env_ids):
+        """Ensure that all environments of a request belong to the client."""
+        for i in env_ids:
+            if i not in session.env_ids:
+                raise ValueError(
+                    "Environment {} is not reserved by this client.".format(i))
+        return list(env_ids)
+
+
+class _Session:
+    """State of a client connection: reserved environments and the
+    orchestrators used to step batches of them."""
+
+    def __init__(self):
+        self.env_ids = []
+        self.orchestrators = {}
+
+    def get_orchestrator(self, envs, env_ids):
+        """Return an orchestrator stepping a batch of environments."""
+        key = tuple(env_ids)
+        if key not in self.orchestrators:
+            self.orchestrators[key] = StepOrchestrator(
+                [envs[i] for i in env_ids])
+        return self.orchestrators[key]
+
+    def close_orchestrators(self):
+        """Stop the orchestrators (the environments are left running)."""
+        for orchestrator in self.orchestrators.values():
+            orchestrator.close(terminate_envs=False)
+        self.orchestrators.clear()
+
+
+class EnvClient:
+    """Connection to an environment server."""
+
+    def __init__(self, address, authkey):
+        """Connect to an environment server.
+
+        Parameters
+        ----------
+        address : (str, int)
+            address of the server, e.g. ("localhost", DEFAULT_PORT)
+        authkey : bytes
+            key of the server (see `EnvServer.authkey`)
+        """
+        self.conn = Client(address, authkey=authkey)
+        self._lock = threading.Lock()
+
+    def request(self, cmd, **kwargs):
+        """Send a request to the server and return its result.
+
+        Raises a RuntimeError if the request failed on the server.
+        """
+        kwargs["cmd"] = cmd
+        with self._lock:
+            self.conn.send_bytes(pack_message(kwargs))
+            response = unpack_message(self.conn.recv_bytes())
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def make_envs(self, num_envs=1):
+        """Reserve environments of the server's pool.
+
+        Parameters
+        ----------
+        num_envs : int, optional
+            number of environments to reserve
+
+        Returns
+        -------
+        list of RemoteEnv
+            proxies of the reserved environments
+        """
+        return [RemoteEnv(self, env_id, observation_space, action_space)
+                for env_id, observation_space, action_space in
+                self.request("acquire", num_envs=num_envs)]
+
+    def reset(self, envs):
+        """Reset several environments with a single request.
+
+        Returns the initial observation of every environment.
+        """
+        return self.request("reset", envs=[env.env_id for env in envs])
+
+    def step(self, envs, actions):
+        """Step several environments concurrently with a single request.
+
+        Returns the observation, reward, done, and info of every environment.
+        """
+        return self.request(
+            "step", envs=[env.env_id for env in envs], actions=list(actions))
+
+    def release(self, envs):
+        """Return environments to the server's pool."""
+        self.request("release", envs=[env.env_id for env in envs])
+
+    def shutdown_server(self):
+        """Request the server to shut down, and close the connection."""
+        self.request("shutdown")
+        self.conn.close()
+
+    def close(self):
+        """Close the connection; the reserved environments are released."""
+        self.conn.close()
+
+
+class RemoteEnv(gym.Env):
+    """Gym-compatible proxy of an environment hosted by a server."""
+
+    def __init__(self, client, env_id, observation_space, action_space):
+        """Instantiate the proxy (see EnvClient.make_envs)."""
+        self.client = client
+        self.env_id = env_id
+        self.observation_space = observation_space
+        self.action_space = action_space
+
+    def reset(self):
+        """Reset the remote environment."""
+        return self.client.reset([self])[0]
+
+    def step(self, action):
+        """Step the remote environment."""
+        return self.client.step([self], [action])[0]
+
+    def close(self):
+        """Return the remote environment to the server's pool."""
+        self.client.release([self])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Serves a pool of flow environments to local clients.")
+    parser.add_argument(
+        "flow_params", type=str,
+        help="path to the flow_params.json file of the environments")
+    parser.add_argument(
+        "--num_envs", type=int, default=1,
+        help="number of environments in the pool")
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT,
+        help="port the server listens on")
+    args = parser.parse_args()
+
+    with open(args.flow_params) as f:
+        server = EnvServer.from_flow_params(
+            f.read(), args.num_envs, address=("localhost", args.port))
+    print("Serving {} environments on {} with key {}".format(
+        args.num_envs, server.address, server.authkey.hex()))
+    server.serve_forever()
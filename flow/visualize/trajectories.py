@@ -0,0 +1,456 @@
+"""Analysis of vehicle trajectories: time-space and fundamental diagrams.
+
+The trajectories of vehicles are read in chunks from emission files generated
+by sumo (see SumoParams.emission_path), from their csv conversion (see
+flow.core.util.emission_to_csv), or from TraCI recordings (see
+SumoParams.traci_record). The functions of this module aggregate these chunks
+with vectorized binning, so that their memory use only depends on the size of
+the chunks and of the aggregated results, regardless of the length of the
+simulation.
+
+Every chunk is a dictionary of numpy arrays of the same length (one element
+per vehicle and time step), with the following keys:
+
+- time: simulation time (in seconds)
+- id: name of the vehicle
+- edge_id: edge the vehicle is located in
+- lane_number: lane the vehicle is located in
+- relative_position: position of the vehicle on its edge (in meters)
+- speed: speed of the vehicle (in m/s)
+
+Usage
+-----
+>>> chunks = read_trajectories("data/ring-emission.xml")
+>>> times, positions, speeds = space_time_grid(
+...     chunks, scenario.total_edgestarts_dict, time_bin=1, space_bin=5)
+>>> plot_time_space(times, positions, speeds)
+"""
+
+import csv
+import pickle
+from xml.etree import ElementTree
+
+from matplotlib import pyplot as plt
+import numpy as np
+from traci import constants as tc
+
+# columns of the chunks of trajectories, and their types
+COLUMNS = (("time", float), ("id", str), ("edge_id", str),
+           ("lane_number", int), ("relative_position", float),
+           ("speed", float))
+
+
+def _to_chunk(rows):
+    """Convert a list of rows (tuples ordered as COLUMNS) into a chunk."""
+    columns = list(zip(*rows)) if len(rows) > 0 else [()] * len(COLUMNS)
+    return {name: np.array(values, dtype=dtype)
+            for (name, dtype), values in zip(COLUMNS, columns)}
+
+
+def read_emission_csv(path, chunk_size=100000):
+    """Read trajectories from an emission csv file, in chunks.
+
+    Parameters
+    ----------
+    path : str
+        path to a csv file generated by flow.core.util.emission_to_csv
+    chunk_size : int, optional
+        maximum number of rows of a chunk
+
+    Yields
+    ------
+    dict of np.ndarray
+        chunk of trajectories (see COLUMNS)
+    """
+    with open(path, "r") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        indices = [header.index(name) for name, _ in COLUMNS]
+
+        rows = []
+        for row in reader:
+            rows.append([row[i] for i in indices])
+            if len(rows) == chunk_size:
+                yield _to_chunk(rows)
+                rows = []
+        if len(rows) > 0:
+            yield _to_chunk(rows)
+
+
+def read_emission_xml(path, chunk_size=100000):
+    """Read trajectories from an emission file generated by sumo, in chunks.
+
+    The file is parsed incrementally, so that it is never loaded in memory as
+    a whole.
+
+    Parameters
+    ----------
+    path : str
+        path to the emission file
+    chunk_size : int, optional
+        maximum number of rows of a chunk
+
+    Yields
+    ------
+    dict of np.ndarray
+        chunk of trajectories (see COLUMNS)
+    """
+    rows = []
+    root = None
+    time = None
+    for event, elem in ElementTree.iterparse(path, events=("start", "end")):
+        if root is None:
+            root = elem
+        if elem.tag == "timestep":
+            if event == "start":
+                time = elem.attrib["time"]
+            else:
+                # free the time step and its vehicles
+                elem.clear()
+                root.remove(elem)
+        elif elem.tag == "vehicle" and event == "end":
+            edge, _, lane = elem.attrib["lane"].rpartition("_")
+            rows.append((time, elem.attrib["id"], edge, lane,
+                         elem.attrib["pos"], elem.attrib["speed"]))
+            if len(rows) == chunk_size:
+                yield _to_chunk(rows)
+                rows = []
+    if len(rows) > 0:
+        yield _to_chunk(rows)
+
+
+def read_traci_recording(path, chunk_size=100000):
+    """Read trajectories from a TraCI recording, in chunks.
+
+    The vehicles are read from the subscription results of the recording,
+    whose time is that of the subsequent simulation subscription results.
+    Note that the recording itself is loaded in memory.
+
+    Parameters
+    ----------
+    path : str
+        path to a recording written by flow.core.traci_replay.TraCIRecorder
+    chunk_size : int, optional
+        maximum number of rows of a chunk
+
+    Yields
+    ------
+    dict of np.ndarray
+        chunk of trajectories (see COLUMNS)
+    """
+    with open(path, "rb") as f:
+        records = pickle.load(f)
+
+    rows = []
+    vehicle_obs = None
+    for domain, method, _, response, _ in records:
+        if method != "getSubscriptionResults" or response is None:
+            continue
+        if domain == "vehicle":
+            vehicle_obs = response
+        elif domain == "simulation" and vehicle_obs is not None \
+                and tc.VAR_TIME_STEP in response:
+            # times of the simulation subscriptions are in milliseconds
+            time = response[tc.VAR_TIME_STEP] / 1000
+            for veh_id, obs in vehicle_obs.items():
+                if tc.VAR_ROAD_ID not in obs:
+                    continue
+                rows.append((time, veh_id, obs[tc.VAR_ROAD_ID],
+                             obs.get(tc.VAR_LANE_INDEX, 0),
+                             obs[tc.VAR_LANEPOSITION], obs[tc.VAR_SPEED]))
+            vehicle_obs = None
+            if len(rows) >= chunk_size:
+                yield _to_chunk(rows)
+                rows = []
+    if len(rows) > 0:
+        yield _to_chunk(rows)
+
+
+def read_trajectories(path, chunk_size=100000):
+    """Read trajectories in chunks, from any supported file.
+
+    Files are identified by their extension: ".csv" for emission csv files,
+    ".xml" for emission files, and TraCI recordings otherwise.
+
+    Parameters
+    ----------
+    path : str
+        path to the file
+    chunk_size : int, optional
+        maximum number of rows of a chunk
+
+    Returns
+    -------
+    iterator of dict of np.ndarray
+        chunks of trajectories (see COLUMNS)
+    """
+    if path.endswith(".csv"):
+        return read_emission_csv(path, chunk_size)
+    elif path.endswith(".xml"):
+        return read_emission_xml(path, chunk_size)
+    else:
+        return read_traci_recording(path, chunk_size)
+
+
+def _lookup(keys, mapping):
+    """Map an array of keys through a dictionary, in a vectorized way.
+
+    Keys missing from the dictionary are mapped to NaN.
+    """
+    unique, inverse = np.unique(keys, return_inverse=True)
+    values = np.array([mapping.get(key, np.nan) for key in unique],
+                      dtype=float)
+    return values[inverse]
+
+
+class _BinnedSums:
+    """Sums of values over a two-dimensional grid of bins.
+
+    The grid is extended as values are added to new bins, so that its size
+    does not need to be known in advance (e.g. the duration of a simulation).
+    """
+
+    def __init__(self, num_sums):
+        self.sums = np.zeros((num_sums, 0, 0))
+
+    def grow(self, num_rows, num_cols):
+        """Extend the grid to at least the given number of bins."""
+        shape = (max(self.sums.shape[1], num_rows),
+                 max(self.sums.shape[2], num_cols))
+        if shape != self.sums.shape[1:]:
+            sums = np.zeros((len(self.sums),) + shape)
+            sums[:, :self.sums.shape[1], :self.sums.shape[2]] = self.sums
+            self.sums = sums
+
+    def add(self, rows, cols, values):
+        """Add values to the bins (rows, cols) of every sum."""
+        if len(rows) == 0:
+            return
+        self.grow(rows.max() + 1, cols.max() + 1)
+        shape = self.sums.shape[1:]
+
+        flat = rows * shape[1] + cols
+        for k, weights in enumerate(values):
+            self.sums[k] += np.bincount(
+                flat, weights=weights,
+                minlength=shape[0] * shape[1]).reshape(shape)
+
+
+def space_time_grid(chunks, edge_starts, time_bin=1., space_bin=10.):
+    """Compute the mean speed of vehicles in bins of time and space.
+
+    Parameters
+    ----------
+    chunks : iterable of dict
+        chunks of trajectories (see COLUMNS)
+    edge_starts : dict
+        absolute starting position of the edges along which the diagram is
+        plotted, e.g. scenario.total_edgestarts_dict. Vehicles on other
+        edges are ignored.
+    time_bin : float, optional
+        duration of the time bins (in seconds)
+    space_bin : float, optional
+        length of the space bins (in meters)
+
+    Returns
+    -------
+    np.ndarray
+        starting times of the time bins
+    np.ndarray
+        starting positions of the space bins
+    np.ndarray
+        mean speed in every bin (time bins x space bins), NaN for bins
+        without any vehicle
+    """
+    binned = _BinnedSums(2)
+    for chunk in chunks:
+        pos = _lookup(chunk["edge_id"], edge_starts) + \
+            chunk["relative_position"]
+        mask = ~np.isnan(pos)
+        binned.add((chunk["time"][mask] // time_bin).astype(int),
+                   (pos[mask] // space_bin).astype(int),
+                   [np.ones(mask.sum()), chunk["speed"][mask]])
+
+    count, speed = binned.sums
+    with np.errstate(invalid="ignore", divide="ignore"):
+        speed = np.where(count > 0, speed / count, np.nan)
+    return np.arange(count.shape[0]) * time_bin, \
+        np.arange(count.shape[1]) * space_bin, speed
+
+
+def edge_aggregates(chunks, edge_lengths, sim_step, time_bin=60.):
+    """Compute the flow, density, and speed of every edge, by time bin.
+
+    These are computed with Edie's definitions, over the area of every edge
+    and time bin: the density is the total time spent by vehicles in the
+    area, and the flow is the total distance traveled by vehicles in the
+    area, both divided by the duration of the bin and the length of the edge.
+    The speed is the ratio of the flow and density.
+
+    Parameters
+    ----------
+    chunks : iterable of dict
+        chunks of trajectories (see COLUMNS)
+    edge_lengths : dict
+        length of the edges to aggregate (in meters). Vehicles on other edges
+        are ignored.
+    sim_step : float
+        duration between two consecutive positions of a vehicle in the
+        trajectories (in seconds), e.g. the simulation step
+    time_bin : float, optional
+        duration of the time bins (in seconds)
+
+    Returns
+    -------
+    edges : list of str
+        aggregated edges, ordered as the rows of the arrays
+    times : np.ndarray
+        starting times of the time bins
+    flow : np.ndarray
+        flow (in veh/hr) of every edge and time bin (edges x time bins)
+    density : np.ndarray
+        density (in veh/km)
+    speed : np.ndarray
+        space-mean speed (in m/s), NaN for bins without any vehicle
+    """
+    edges = sorted(edge_lengths)
+    index = {edge: i for i, edge in enumerate(edges)}
+    lengths = np.array([edge_lengths[edge] for edge in edges], dtype=float)
+
+    binned = _BinnedSums(2)
+    for chunk in chunks:
+        rows = _lookup(chunk["edge_id"], index)
+        mask = ~np.isnan(rows)
+        binned.add(rows[mask].astype(int),
+                   (chunk["time"][mask] // time_bin).astype(int),
+                   [np.full(mask.sum(), sim_step),
+                    chunk["speed"][mask] * sim_step])
+
+    # include edges without any vehicle
+    binned.grow(len(edges), 0)
+    time_spent, distance = binned.sums
+    area = lengths[:, np.newaxis] * time_bin
+
+    flow = 3600 * distance / area
+    density = 1000 * time_spent / area
+    with np.errstate(invalid="ignore", divide="ignore"):
+        speed = np.where(time_spent > 0, distance / time_spent, np.nan)
+    return edges, np.arange(time_spent.shape[1]) * time_bin, flow, density, \
+        speed
+
+
+def vehicle_delays(chunks, max_speeds, sim_step):
+    """Compute the travel time and delay of every vehicle.
+
+    The delay of a vehicle is the time it lost by traveling below the maximum
+    speed of the edges it traversed.
+
+    Parameters
+    ----------
+    chunks : iterable of dict
+        chunks of trajectories (see COLUMNS)
+    max_speeds : dict or float
+        maximum speed of every edge (in m/s), or of all edges. Vehicles on
+        edges without a maximum speed are not delayed.
+    sim_step : float
+        duration between two consecutive positions of a vehicle in the
+        trajectories (in seconds), e.g. the simulation step
+
+    Returns
+    -------
+    ids : list of str
+        names of the vehicles, ordered as they appear in the trajectories
+    travel_time : np.ndarray
+        time spent by every vehicle in the network (in seconds)
+    delay : np.ndarray
+        delay of every vehicle (in seconds)
+    """
+    index = dict()
+    travel_time = np.zeros(0)
+    delay = np.zeros(0)
+    for chunk in chunks:
+        unique, inverse = np.unique(chunk["id"], return_inverse=True)
+        unique = [str(veh_id) for veh_id in unique]
+        for veh_id in unique:
+            index.setdefault(veh_id, len(index))
+        rows = np.array([index[veh_id] for veh_id in unique],
+                        dtype=int)[inverse]
+
+        if isinstance(max_speeds, dict):
+            max_speed = _lookup(chunk["edge_id"], max_speeds)
+        else:
+            max_speed = np.full(len(rows), max_speeds, dtype=float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            lost = sim_step * (1 - chunk["speed"] / max_speed)
+        lost = np.where(np.isnan(lost), 0, np.maximum(lost, 0))
+
+        travel_time = np.append(travel_time,
+                                np.zeros(len(index) - len(travel_time)))
+        delay = np.append(delay, np.zeros(len(index) - len(delay)))
+        travel_time += sim_step * np.bincount(rows, minlength=len(index))
+        delay += np.bincount(rows, weights=lost, minlength=len(index))
+
+    return sorted(index, key=index.get), travel_time, delay
+
+
+def plot_time_space(times, positions, speeds, ax=None, max_speed=None):
+    """Plot a time-space diagram, colored by speed.
+
+    Parameters
+    ----------
+    times, positions, speeds : np.ndarray
+        binned speeds, see `space_time_grid`
+    ax : matplotlib.axes.Axes, optional
+        axes to plot in, the current axes by default
+    max_speed : float, optional
+        speed at the top of the color scale, the maximum speed by default
+
+    Returns
+    -------
+    matplotlib.axes.Axes
+        the axes of the plot
+    """
+    if ax is None:
+        ax = plt.gca()
+    time_bin = times[1] - times[0] if len(times) > 1 else 1
+    space_bin = positions[1] - positions[0] if len(positions) > 1 else 1
+    mesh = ax.pcolormesh(
+        np.append(times, times[-1] + time_bin) if len(times) > 0 else times,
+        np.append(positions, positions[-1] + space_bin)
+        if len(positions) > 0 else positions,
+        np.ma.masked_invalid(speeds).T,
+        cmap="RdYlGn", vmin=0, vmax=max_speed)
+    plt.colorbar(mesh, ax=ax, label="speed (m/s)")
+    ax.set_xlabel("time (s)")
+    ax.set_ylabel("position (m)")
+    return ax
+
+
+def plot_fundamental_diagram(density, flow, speed=None, ax=None):
+    """Plot the flow-density diagram of aggregated edges and time bins.
+
+    Parameters
+    ----------
+    density, flow, speed : np.ndarray
+        aggregates of edges, see `edge_aggregates`. The points are colored by
+        speed, if specified.
+    ax : matplotlib.axes.Axes, optional
+        axes to plot in, the current axes by default
+
+    Returns
+    -------
+    matplotlib.axes.Axes
+        the axes of the plot
+    """
+    if ax is None:
+        ax = plt.gca()
+    density, flow = np.ravel(density), np.ravel(flow)
+    if speed is None:
+        ax.scatter(density, flow, s=4)
+    else:
+        points = ax.scatter(density, flow, s=4, c=np.ravel(speed),
+                            cmap="RdYlGn")
+        plt.colorbar(points, ax=ax, label="speed (m/s)")
+    ax.set_xlabel("density (veh/km)")
+    ax.set_ylabel("flow (veh/hr)")
+    return ax
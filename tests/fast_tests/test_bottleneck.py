@@ -2,6 +2,9 @@ import unittest
 
 from tests.setup_scripts import setup_bottlenecks
 from flow.core.experiment import SumoExperiment
+from flow.core.params import EnvParams, SumoParams
+from flow.core.traffic_lights import TrafficLights
+from flow.envs.bottleneck_env import BottleneckEnv
 
 
 class TestBottleneck(unittest.TestCase):
@@ -11,5 +14,44 @@ class TestBottleneck(unittest.TestCase):
         self.exp.run(5, 50)
 
 
+class TestTollAndRampMeter(unittest.TestCase):
+    """Tests the toll booths and ramp meters of the bottleneck environment."""
+
+    def test_it_runs(self):
+        traffic_lights = TrafficLights()
+        traffic_lights.add(node_id="2")
+        traffic_lights.add(node_id="3")
+
+        env_params = EnvParams(additional_params={
+            "target_velocity": 40,
+            "max_accel": 1,
+            "max_decel": 1,
+            "lane_change_duration": 5,
+            "add_rl_if_exit": False,
+            "disable_tb": False,
+            "disable_ramp_metering": False
+        })
+        sumo_params = SumoParams(sim_step=0.5, render=False)
+        env, _ = setup_bottlenecks(sumo_params=sumo_params,
+                                   env_params=env_params,
+                                   traffic_lights=traffic_lights,
+                                   env_class=BottleneckEnv)
+        env.reset()
+        for _ in range(50):
+            env.step(rl_actions=None)
+
+        # one traffic light per lane of the toll plaza and ramp meter
+        self.assertEqual(len(env.toll_plaza.tl_state), 4)
+        self.assertEqual(len(env.ramp_meter.tl_state), 4)
+        self.assertTrue(all(t >= -1 for t in env.toll_plaza.wait_time))
+
+        # the toll plaza and ramp meter start over at every rollout
+        env.reset()
+        self.assertEqual(env.toll_plaza.tl_state, "")
+        self.assertEqual(len(env.ramp_meter.vehicles_in_area), 0)
+
+        env.terminate()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -5,14 +5,18 @@ from flow.core.params import SumoParams, EnvParams, InitialConfig, \
 from flow.core.vehicles import Vehicles
 
 from flow.controllers.routing_controllers import ContinuousRouter
-from flow.controllers.car_following_models import IDMController
+from flow.controllers.car_following_models import IDMController, \
+    SumoCarFollowingController
 from flow.controllers import RLController
 from flow.envs.loop.loop_accel import ADDITIONAL_ENV_PARAMS
 from flow.envs import Env
+from flow.core.orchestrator import StepOrchestrator
+from flow.core.commands import CommandBuffer
 
 from tests.setup_scripts import ring_road_exp_setup
 import os
 import numpy as np
+from traci import constants as tc
 
 os.environ["TEST_FLAG"] = "True"
 
@@ -210,6 +214,7 @@ class TestApplyingActionsWithSumo(unittest.TestCase):
         # apply a certain set of accelerations to the vehicles in the network
         accel_step0 = np.array([0, 1, 4, 9, 16])
         self.env.apply_acceleration(veh_ids=ids, acc=accel_step0)
+        self.env.command_buffer.flush(self.env.traci_connection)
         self.env.traci_connection.simulationStep()
 
         # compare the new velocity of the vehicles to the expected velocity
@@ -234,6 +239,7 @@ class TestApplyingActionsWithSumo(unittest.TestCase):
         # apply a set of decelerations
         accel_step1 = np.array([-16, -9, -4, -1, 0])
         self.env.apply_acceleration(veh_ids=ids, acc=accel_step1)
+        self.env.command_buffer.flush(self.env.traci_connection)
         self.env.traci_connection.simulationStep()
 
         # this time, some vehicles should be at 0 velocity (NOT less), and sum
@@ -278,6 +284,7 @@ class TestApplyingActionsWithSumo(unittest.TestCase):
         # perform lane-changing actions using the direction method
         direction0 = np.array([0, 1, 0, 1, -1])
         self.env.apply_lane_change(ids, direction=direction0)
+        self.env.command_buffer.flush(self.env.traci_connection)
         self.env.traci_connection.simulationStep()
 
         # check that the lane vehicle lane changes to the correct direction
@@ -304,6 +311,7 @@ class TestApplyingActionsWithSumo(unittest.TestCase):
         # time to test lane changes to the right
         direction1 = np.array([-1, -1, -1, -1, -1])
         self.env.apply_lane_change(ids, direction=direction1)
+        self.env.command_buffer.flush(self.env.traci_connection)
         self.env.traci_connection.simulationStep()
 
         # check that the lane vehicle lane changes to the correct direction
@@ -318,6 +326,72 @@ class TestApplyingActionsWithSumo(unittest.TestCase):
         np.testing.assert_array_almost_equal(lane2, expected_lane2, 1)
 
 
+class TestCommandBuffer(unittest.TestCase):
+    """
+    Tests that actuation commands are buffered until the next simulation step,
+    and that redundant commands are dropped.
+    """
+
+    def setUp(self):
+        vehicles = Vehicles()
+        vehicles.add(
+            veh_id="test",
+            acceleration_controller=(IDMController, {}),
+            routing_controller=(ContinuousRouter, {}),
+            num_vehicles=5)
+        self.env, scenario = ring_road_exp_setup(vehicles=vehicles)
+
+    def tearDown(self):
+        # terminate the traci instance
+        self.env.terminate()
+
+        # free data used by the class
+        self.env = None
+
+    def test_buffered_commands(self):
+        ids = self.env.vehicles.get_ids()
+
+        # commands issued twice for the same vehicle are only sent once
+        self.env.apply_acceleration(veh_ids=ids, acc=[1] * len(ids))
+        self.env.apply_acceleration(veh_ids=ids, acc=[2] * len(ids))
+        self.assertEqual(len(self.env.command_buffer), len(ids))
+
+        # routes that match the current route of a vehicle are dropped
+        routes = self.env.vehicles.get_route(ids)
+        self.env.choose_routes(ids, routes)
+        self.assertEqual(len(self.env.command_buffer), len(ids))
+
+        # the buffer is emptied by the simulation step
+        self.env.step(rl_actions=None)
+        self.assertEqual(len(self.env.command_buffer), 0)
+
+    def test_discard(self):
+        ids = self.env.vehicles.get_ids()
+        self.env.apply_acceleration(veh_ids=ids, acc=[1] * len(ids))
+        self.env.apply_lane_change(veh_ids=ids[:1], direction=[0])
+
+        # commands of removed vehicles are not sent
+        self.env.traci_connection.vehicle.remove(ids[0])
+        self.env.command_buffer.discard(ids[0])
+        self.assertEqual(len(self.env.command_buffer), len(ids) - 1)
+        self.env.command_buffer.flush(self.env.traci_connection)
+
+    def test_tls_order(self):
+        buffer = CommandBuffer()
+        buffer.set_tls_state("n", "GG")
+        buffer.set_tls_state("n", "r", link_index=1)
+        buffer.set_tls_state("n", "rr")
+        buffer.set_tls_state("m", "G", link_index=0)
+        buffer.set_tls_state("m", "r", link_index=1)
+        buffer.set_tls_state("m", "y", link_index=0)
+
+        # states of all links override the previous commands of the node,
+        # and commands are sent in the order they were last requested
+        self.assertEqual(list(buffer._tls_states.items()),
+                         [(("n", "all"), "rr"), (("m", 1), "r"),
+                          (("m", 0), "y")])
+
+
 class TestSorting(unittest.TestCase):
     """
     Tests that the sorting method returns a list of ids sorted by the
@@ -394,6 +468,108 @@ class TestWarmUpSteps(unittest.TestCase):
         # ensure that the difference in time is equal to sims_per_step
         self.assertEqual(t2 - t1, warmup_step)
 
+    def test_sims_per_step(self):
+        warmup_step = 5  # some value
+        sims_per_step = 3  # some value
+
+        # warm-up steps with several simulations per step are performed
+        # without computing observations in all but the last step
+        env_params = EnvParams(
+            warmup_steps=warmup_step, sims_per_step=sims_per_step,
+            additional_params=ADDITIONAL_ENV_PARAMS)
+        env, scenario = ring_road_exp_setup(env_params=env_params)
+
+        # the default vehicles are controlled by flow, and so the warm-up
+        # cannot be performed by sumo alone
+        self.assertFalse(env._can_fast_forward())
+
+        t1 = env.time_counter
+        env.reset()
+        t2 = env.time_counter
+
+        # ensure that all simulation steps of the warm-up are run
+        self.assertEqual(t2 - t1, warmup_step * sims_per_step)
+
+    def test_fast_forward(self):
+        warmup_step = 5  # some value
+        sims_per_step = 2  # some value
+
+        def warmup(fast_forward):
+            # vehicles controlled by sumo, whose warm-up may be performed by
+            # sumo alone
+            vehicles = Vehicles()
+            vehicles.add(
+                "test",
+                acceleration_controller=(SumoCarFollowingController, {}),
+                initial_speed=5,
+                num_vehicles=5)
+            env_params = EnvParams(
+                warmup_steps=warmup_step, sims_per_step=sims_per_step,
+                additional_params=ADDITIONAL_ENV_PARAMS)
+            env, scenario = ring_road_exp_setup(vehicles=vehicles,
+                                                env_params=env_params)
+            self.assertTrue(env._can_fast_forward())
+            if not fast_forward:
+                env._can_fast_forward = lambda: False
+
+            # record the simulation steps sent to sumo
+            calls = []
+            simulation_step = env.traci_connection.simulationStep
+
+            def recorded_step(*args):
+                calls.append(args)
+                return simulation_step(*args)
+
+            env.traci_connection.simulationStep = recorded_step
+
+            t1 = env.time_counter
+            s1 = env.step_counter
+            env.reset()
+
+            # ensure that all simulation steps of the warm-up are counted
+            self.assertEqual(env.time_counter - t1,
+                             warmup_step * sims_per_step)
+            self.assertEqual(env.step_counter - s1,
+                             warmup_step * sims_per_step)
+
+            return env, calls
+
+        fast_env, fast_calls = warmup(fast_forward=True)
+        slow_env, slow_calls = warmup(fast_forward=False)
+
+        # the fast-forwarded warm-up is sent to sumo as a single step with a
+        # target time, followed by the last (regular) warm-up step
+        self.assertEqual(len([c for c in fast_calls if len(c) > 0]), 1)
+        self.assertEqual(len([c for c in slow_calls if len(c) > 0]), 0)
+        self.assertEqual(len(fast_calls),
+                         len(slow_calls) - (warmup_step - 1) * sims_per_step
+                         + 1)
+
+        # the vehicles are in the same state as after a regular warm-up
+        self.assertListEqual(fast_env.vehicles.get_ids(),
+                             slow_env.vehicles.get_ids())
+        for veh_id in slow_env.vehicles.get_ids():
+            for getter in ["get_speed", "get_position", "get_edge",
+                           "get_absolute_position", "get_headway"]:
+                self.assertAlmostEqual(
+                    getattr(fast_env.vehicles, getter)(veh_id),
+                    getattr(slow_env.vehicles, getter)(veh_id))
+
+        # the flow rates count the fast-forwarded steps as a single step
+        self.assertEqual(len(fast_env.vehicles._num_departed),
+                         1 + sims_per_step)
+        self.assertEqual(len(slow_env.vehicles._num_departed),
+                         warmup_step * sims_per_step)
+        self.assertEqual(fast_env.vehicles.get_inflow_rate(100), 0)
+
+        # environments overwriting additional_command must opt in (the
+        # AccelEnv of ring_road_exp_setup does)
+        fast_env.warmup_fast_forward = False
+        self.assertFalse(fast_env._can_fast_forward())
+
+        fast_env.terminate()
+        slow_env.terminate()
+
 
 class TestSimsPerStep(unittest.TestCase):
     """Ensures that the appropriate number of simultaions are run at any given
@@ -421,6 +597,203 @@ class TestSimsPerStep(unittest.TestCase):
         self.assertEqual(t2 - t1, sims_per_step)
 
 
+class CountingIDMController(IDMController):
+    """IDM controller that counts the number of times it is queried."""
+
+    num_calls = 0
+
+    def get_accel(self, env):
+        CountingIDMController.num_calls += 1
+        return super().get_accel(env)
+
+
+class TestControllerUpdatePeriods(unittest.TestCase):
+    """Ensures that acceleration controllers are only queried once every
+    flow.core.params.EnvParams.accel_update_period seconds"""
+
+    def test_it_works(self):
+        vehicles = Vehicles()
+        vehicles.add(
+            veh_id="test",
+            acceleration_controller=(CountingIDMController, {}),
+            routing_controller=(ContinuousRouter, {}),
+            num_vehicles=1)
+
+        # simulation steps are 0.1 s long, so the controller should be
+        # updated every 5 simulation steps
+        env_params = EnvParams(
+            sims_per_step=10,
+            accel_update_period=0.5,
+            additional_params=ADDITIONAL_ENV_PARAMS)
+        env, scenario = ring_road_exp_setup(
+            env_params=env_params, vehicles=vehicles)
+
+        env.reset()
+        CountingIDMController.num_calls = 0
+        env.step(rl_actions=[])
+
+        self.assertEqual(CountingIDMController.num_calls, 2)
+
+
+class TestMesoscopic(unittest.TestCase):
+    """Tests running sumo's mesoscopic model through
+    flow.core.params.SumoParams.mesoscopic"""
+
+    def test_flow_controllers(self):
+        # vehicles with flow acceleration controllers cannot be simulated
+        sumo_params = SumoParams(sim_step=0.1, mesoscopic=True)
+        self.assertRaises(ValueError, ring_road_exp_setup,
+                          sumo_params=sumo_params)
+
+    def test_edge_queues(self):
+        vehicles = Vehicles()
+        vehicles.add(
+            veh_id="test",
+            acceleration_controller=(SumoCarFollowingController, {}),
+            routing_controller=(ContinuousRouter, {}),
+            num_vehicles=5)
+
+        sumo_params = SumoParams(sim_step=0.1, mesoscopic=True)
+        env, scenario = ring_road_exp_setup(
+            sumo_params=sumo_params, vehicles=vehicles)
+
+        env.reset()
+        for _ in range(10):
+            env.step(rl_actions=[])
+
+        # all vehicles of an edge are in a single queue sorted by position
+        edges = scenario.get_edge_list()
+        num_vehicles, mean_speed = env.vehicles.get_edge_queues(edges)
+        self.assertEqual(sum(num_vehicles), 5)
+        for edge, num in zip(edges, num_vehicles):
+            lanes = env.vehicles.get_vehicles_by_lane(edge)
+            if num > 0:
+                self.assertEqual(len(lanes), 1)
+                self.assertEqual(len(lanes[0]), num)
+                positions = [pos for _, pos in lanes[0]]
+                self.assertListEqual(positions, sorted(positions))
+
+        # no lanes or leaders are available
+        for veh_id in env.vehicles.get_ids():
+            self.assertEqual(env.vehicles.get_lane(veh_id), 0)
+            self.assertIsNone(env.vehicles.get_leader(veh_id))
+
+        env.terminate()
+
+    def test_rl_accelerations(self):
+        vehicles = Vehicles()
+        vehicles.add(
+            veh_id="rl",
+            acceleration_controller=(RLController, {}),
+            routing_controller=(ContinuousRouter, {}),
+            num_vehicles=1)
+
+        sumo_params = SumoParams(sim_step=0.1, mesoscopic=True)
+        env, _ = ring_road_exp_setup(
+            sumo_params=sumo_params, vehicles=vehicles)
+        env.reset()
+
+        # rl vehicles may be simulated, but not accelerated
+        env.step(rl_actions=None)
+        self.assertRaises(ValueError, env.step, rl_actions=[1])
+
+        env.terminate()
+
+
+class TestCheckpoints(unittest.TestCase):
+    """Tests that saved checkpoints restore the state of the simulation and of
+    the environment, from memory and from disk."""
+
+    def setUp(self):
+        vehicles = Vehicles()
+        vehicles.add(
+            veh_id="test",
+            acceleration_controller=(IDMController, {}),
+            routing_controller=(ContinuousRouter, {}),
+            num_vehicles=5)
+        self.env, scenario = ring_road_exp_setup(vehicles=vehicles)
+        self.env.reset()
+        for _ in range(10):
+            self.env.step(rl_actions=[])
+
+    def tearDown(self):
+        self.env.terminate()
+        self.env = None
+
+    def run_branch(self, num_steps=20):
+        """Return the positions of the vehicles after a few steps."""
+        for _ in range(num_steps):
+            self.env.step(rl_actions=[])
+        return self.env.time_counter, \
+            self.env.vehicles.get_absolute_position(
+                sorted(self.env.vehicles.get_ids()))
+
+    def test_restore_from_memory(self):
+        checkpoint = self.env.save_checkpoint()
+        time1, pos1 = self.run_branch()
+
+        # the checkpoint can be restored several times
+        for _ in range(2):
+            self.env.restore_checkpoint(checkpoint)
+            self.assertEqual(self.env.time_counter, 10)
+            # the subscriptions of the simulation are requested again
+            self.assertIn(
+                tc.VAR_ARRIVED_VEHICLES_IDS,
+                self.env.traci_connection.simulation.getSubscriptionResults())
+            time2, pos2 = self.run_branch()
+            self.assertEqual(time1, time2)
+            np.testing.assert_array_almost_equal(pos1, pos2)
+
+    def test_restore_from_disk(self):
+        path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            "test_files", "checkpoint.pkl")
+        self.env.save_checkpoint(path)
+        time1, pos1 = self.run_branch()
+
+        self.env.restore_checkpoint(path)
+        time2, pos2 = self.run_branch()
+        os.remove(path)
+
+        self.assertEqual(time1, time2)
+        np.testing.assert_array_almost_equal(pos1, pos2)
+
+
+class TestStepOrchestrator(unittest.TestCase):
+    """Tests that several environments can be stepped concurrently."""
+
+    def test_it_works(self):
+        envs = [ring_road_exp_setup()[0] for _ in range(3)]
+        orchestrator = StepOrchestrator(envs)
+
+        observations = orchestrator.reset()
+        self.assertEqual(len(observations), 3)
+
+        for _ in range(5):
+            results = orchestrator.step([[], [], []])
+            self.assertEqual(len(results), 3)
+            for observation, _, done, _ in results:
+                self.assertFalse(done)
+
+        # all environments were stepped the same number of times
+        for env in envs:
+            self.assertEqual(env.time_counter, 5)
+
+        # the orchestrator expects one action per environment
+        self.assertRaises(ValueError, orchestrator.step, [[]])
+
+        # results are passed to the callback as environments complete
+        completed = []
+        results = orchestrator.loop.run_until_complete(
+            orchestrator.as_completed(
+                [[], [], []], lambda i, result: completed.append(i)))
+        self.assertEqual(sorted(completed), [0, 1, 2])
+        self.assertEqual(len(results), 3)
+        for env in envs:
+            self.assertEqual(env.time_counter, 6)
+
+        orchestrator.close()
+
+
 class TestAbstractMethods(unittest.TestCase):
     """
     These series of tests are meant to ensure that the environment abstractions
@@ -3,15 +3,19 @@ import unittest
 import os
 from flow.core.vehicles import Vehicles
 from flow.core.params import NetParams, EnvParams, SumoParams
+from flow.core.traffic_lights import TrafficLights
 from flow.controllers import IDMController, RLController
 from flow.scenarios import LoopScenario, MergeScenario, \
-    TwoLoopsOneMergingScenario
+    TwoLoopsOneMergingScenario, TiledScenario
 from flow.scenarios.loop import ADDITIONAL_NET_PARAMS as LOOP_PARAMS
 from flow.scenarios.merge import ADDITIONAL_NET_PARAMS as MERGE_PARAMS
 from flow.scenarios.loop_merge import ADDITIONAL_NET_PARAMS as LM_PARAMS
 from flow.envs import LaneChangeAccelEnv, LaneChangeAccelPOEnv, AccelEnv, \
     WaveAttenuationEnv, WaveAttenuationPOEnv, WaveAttenuationMergePOEnv, \
     TestEnv, TwoLoopsMergePOEnv
+from flow.envs.loop.loop_accel import ADDITIONAL_ENV_PARAMS as ACCEL_PARAMS
+from flow.envs.loop.loop_accel import MultiAgentAccelEnv
+from flow.envs.tiled_env import TiledEnv
 
 
 os.environ["TEST_FLAG"] = "True"
@@ -260,6 +264,57 @@ class TestAccelEnv(unittest.TestCase):
         )
 
 
+class TestMultiAgentAccelEnv(unittest.TestCase):
+
+    def setUp(self):
+        vehicles = Vehicles()
+        vehicles.add("rl", acceleration_controller=(RLController, {}))
+        vehicles.add("human", acceleration_controller=(IDMController, {}))
+
+        self.scenario = LoopScenario(
+            name="test_multiagent",
+            vehicles=vehicles,
+            net_params=NetParams(additional_params=LOOP_PARAMS.copy()),
+        )
+        self.env_params = EnvParams(
+            additional_params={
+                "max_accel": 3,
+                "max_decel": 3,
+                "target_velocity": 10,
+                "perturb_weight": 0.1
+            }
+        )
+
+    def tearDown(self):
+        self.scenario = None
+        self.env_params = None
+
+    def test_restart_policy(self):
+        """Ensures that the restart policy is used by multi-agent envs."""
+        env = MultiAgentAccelEnv(
+            sumo_params=SumoParams(restart_threshold=0.5),
+            scenario=self.scenario,
+            env_params=self.env_params
+        )
+        env.reset()
+
+        # the latency of every simulation step is measured
+        actions = {"av": np.array([0.]), "adversary": np.array([0.])}
+        obs, reward, done, _ = env.step(actions)
+        self.assertEqual(env.restart_policy._num_steps, 1)
+        self.assertEqual(sorted(obs.keys()), ["adversary", "av"])
+        self.assertFalse(done["__all__"])
+
+        # sumo is restarted at the reset if the policy requests it
+        pid = env.sumo_proc.pid
+        env.restart_policy.end_episode = lambda memory: True
+        env.reset()
+        self.assertNotEqual(env.sumo_proc.pid, pid)
+        self.assertEqual(env.restart_policy._num_steps, 0)
+
+        env.terminate()
+
+
 class TestTwoLoopsMergeEnv(unittest.TestCase):
 
     def setUp(self):
@@ -410,6 +465,41 @@ class TestWaveAttenuationEnv(unittest.TestCase):
             )
         )
 
+    def test_ring_library(self):
+        """Ensures that resets load one of the pregenerated ring roads."""
+        env_params = EnvParams(additional_params={
+            "max_accel": 1,
+            "max_decel": 1,
+            "ring_length": [220, 230],
+            "ring_length_step": 5
+        })
+        env = WaveAttenuationEnv(
+            sumo_params=self.sumo_params,
+            scenario=self.scenario,
+            env_params=env_params
+        )
+
+        self.assertListEqual(sorted(env.ring_scenarios), [220, 225, 230])
+        for length, scenario in env.ring_scenarios.items():
+            self.assertAlmostEqual(scenario.length, length)
+
+        # longer rings have higher equilibrium speeds
+        v_eq_max = [env.v_eq_max[length] for length in [220, 225, 230]]
+        self.assertListEqual(v_eq_max, sorted(v_eq_max))
+
+        for _ in range(3):
+            env.reset()
+            self.assertIn(env.scenario, env.ring_scenarios.values())
+            self.assertEqual(len(env.vehicles.get_ids()),
+                             env.vehicles.num_vehicles)
+
+        # the library is not saved in checkpoints
+        checkpoint = env.save_checkpoint()
+        self.assertNotIn("ring_scenarios", checkpoint.get_env_state())
+        self.assertIn(env.scenario, env.ring_scenarios.values())
+
+        env.terminate()
+
 
 class TestWaveAttenuationPOEnv(unittest.TestCase):
 
@@ -607,6 +697,92 @@ class TestTestEnv(unittest.TestCase):
         self.assertEqual(self.env.compute_reward([]), 1)
 
 
+class TestTiledEnv(unittest.TestCase):
+
+    """Tests the TiledEnv wrapper in flow/envs/tiled_env.py"""
+
+    def setUp(self):
+        vehicles = Vehicles()
+        vehicles.add("human", acceleration_controller=(IDMController, {}),
+                     num_vehicles=4)
+
+        additional_net_params = LOOP_PARAMS.copy()
+        additional_net_params.update({
+            "scenario": "LoopScenario",
+            "num_replicas": 2,
+            "replica_spacing": 50
+        })
+        scenario = TiledScenario(
+            name="test_tiled",
+            vehicles=vehicles,
+            net_params=NetParams(additional_params=additional_net_params))
+        env = AccelEnv(
+            env_params=EnvParams(additional_params=ACCEL_PARAMS.copy(),
+                                 horizon=5),
+            sumo_params=SumoParams(),
+            scenario=scenario)
+        self.env = TiledEnv(env)
+
+    def tearDown(self):
+        self.env.close()
+        self.env = None
+
+    def test_replicas(self):
+        obs = self.env.vector_reset()
+        self.assertEqual(self.env.num_envs, 2)
+        self.assertEqual(len(obs), 2)
+
+        # observations are those of the base scenario, formatted as by step
+        for k in range(2):
+            self.assertEqual(obs[k].shape, self.env.observation_space.shape)
+            with self.env.focus(k) as env:
+                np.testing.assert_array_almost_equal(obs[k], env.get_state())
+                self.assertEqual(len(env.vehicles.get_ids()), 4)
+                self.assertIs(env.scenario, self.env.scenario.base)
+                for veh_id in env.vehicles.get_ids():
+                    self.assertEqual(self.env.replica_of[veh_id], k)
+                    self.assertIn(env.vehicles.get_edge(veh_id),
+                                  self.env.scenario.base.get_edge_list())
+
+        # the environment is restored outside of the focus context
+        self.assertEqual(len(self.env.env.vehicles.get_ids()), 8)
+        self.assertIs(self.env.env.scenario, self.env.scenario)
+
+    def test_reset_at(self):
+        initial_obs = self.env.vector_reset()
+        for _ in range(5):
+            obs, rewards, dones, infos = self.env.vector_step([None, None])
+        self.assertEqual(len(rewards), 2)
+        self.assertListEqual(dones, [True, True])
+
+        with self.env.focus(1) as env:
+            ids = env.vehicles.get_ids()
+            pos = env.vehicles.get_absolute_position(ids)
+
+        # only the vehicles of the reset replica return to their initial state
+        obs = self.env.reset_at(0)
+        np.testing.assert_array_almost_equal(obs, initial_obs[0], decimal=1)
+        self.assertListEqual(self.env.steps, [0, 5])
+        with self.env.focus(1) as env:
+            self.assertListEqual(env.vehicles.get_ids(), ids)
+            self.assertTrue(np.all(
+                np.array(env.vehicles.get_absolute_position(ids)) >=
+                np.array(pos)))
+
+        # dones are attributed to every replica separately
+        _, _, dones, _ = self.env.vector_step([None, None])
+        self.assertListEqual(dones, [False, True])
+
+    def test_traffic_lights(self):
+        # the ids of traffic lights are not mapped to the replicas
+        env = self.env.env
+        traffic_lights = env.traffic_lights
+        env.traffic_lights = TrafficLights()
+        env.traffic_lights.add("r0_bottom")
+        self.assertRaises(ValueError, TiledEnv, env)
+        env.traffic_lights = traffic_lights
+
+
 ###############################################################################
 #                              Utility methods                                #
 ###############################################################################
@@ -1,5 +1,7 @@
 import unittest
 
+import numpy as np
+
 from flow.core.experiment import SumoExperiment
 
 from tests.setup_scripts import grid_mxn_exp_setup
@@ -117,6 +119,28 @@ class TestUtils(unittest.TestCase):
         for i, veh_id in enumerate(sort[::-1]):
             self.assertTrue(veh_id in dists[i // 4])
 
+    def test_closest_to_intersection(self):
+        self.env.reset()
+        edges = self.gen_edges(1, 1)
+        closest_ids, dists = self.env.closest_to_intersection(edges, 2)
+        self.assertEqual(dists.shape, (len(edges), 2))
+
+        for edge, ids, edge_dists in zip(edges, closest_ids, dists):
+            # the closest vehicles are sorted by distance to the intersection
+            expected = sorted(self.env.vehicles.get_ids_by_edge(edge),
+                              key=self.env.get_distance_to_intersection)[:2]
+            self.assertEqual(
+                self.env.get_distance_to_intersection(ids),
+                self.env.get_distance_to_intersection(expected))
+            np.testing.assert_array_almost_equal(
+                edge_dists[:len(ids)],
+                self.env.get_distance_to_intersection(ids))
+
+        # missing vehicles are padded with zeros
+        closest_ids, dists = self.env.closest_to_intersection(
+            [edges[0]], len(closest_ids[0]) + 1)
+        self.assertEqual(dists[0, -1], 0)
+
     def tearDown(self):
         # terminate the traci instance
         self.env.terminate()
@@ -1,4 +1,5 @@
 from flow.renderer.pyglet_renderer import PygletRenderer as Renderer
+from flow.renderer.async_renderer import AsyncRenderer
 import os
 import unittest
 
@@ -82,5 +83,45 @@ class TestPygletRenderer(unittest.TestCase):
         self.assertEqual(renderer.show_radius, show_radius)
 
 
+class TestAsyncRenderer(unittest.TestCase):
+    """Tests the asynchronous renderer"""
+
+    def setUp(self):
+        # square network polygon
+        network = [[0, 0, 100, 0, 100, 100, 0, 100, 0, 0]]
+        self.renderer = AsyncRenderer(
+            network, "gray", max_vehicles=3, sight_radius=10, pxpm=2)
+
+    def tearDown(self):
+        self.renderer.close()
+
+    def test_get_frame(self):
+        # frames are only rendered once requested, from the latest snapshot
+        self.renderer.submit([[10, 0, 90]], [[50, 0, 90]], [0.5], [0.2])
+        self.renderer.submit([[20, 0, 90], [80, 0, 90]], [[60, 0, 90]],
+                             [0.5, 0.5], [0.2])
+        frame, sights = self.renderer.get_frame()
+        self.assertEqual(frame.ndim, 2)
+        self.assertEqual(len(sights), 1)
+
+        # vehicles beyond the maximum number of vehicles are dropped,
+        # starting with the human vehicles
+        with self.assertWarns(ResourceWarning):
+            self.renderer.submit([[10, 0, 90], [20, 0, 90]],
+                                 [[50, 0, 90], [60, 0, 90]],
+                                 [0.5, 0.5], [0.2, 0.2])
+        _, sights = self.renderer.get_frame()
+        self.assertEqual(len(sights), 2)
+
+    def test_terminated_process(self):
+        self.renderer._process.terminate()
+        self.renderer._process.join()
+
+        # frames cannot be requested from a terminated process, but the
+        # renderer can still be closed
+        self.assertRaises(RuntimeError, self.renderer.get_frame)
+        self.renderer.close()
+
+
 if __name__ == '__main__':
     unittest.main()
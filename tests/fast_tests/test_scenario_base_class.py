@@ -3,7 +3,10 @@ import os
 import numpy as np
 
 from flow.core.params import InitialConfig, NetParams
+from flow.core.topology import NetworkTopology
 from flow.core.vehicles import Vehicles
+from flow.scenarios.base_scenario import NET_SIDECAR_SUFFIX
+from flow.scenarios.tiled import TiledScenario
 
 from flow.controllers.routing_controllers import ContinuousRouter
 from flow.controllers.car_following_models import IDMController
@@ -69,6 +72,52 @@ class TestGetEdge(unittest.TestCase):
             self.scenario.get_edge(x2), (":bottom_lower_ring", 0.1))
 
 
+class TestTopology(unittest.TestCase):
+    """
+    Tests that the vectorized get_x and get_edge methods of the compiled
+    network topology match the scalar methods of the scenario.
+    """
+
+    def setUp(self):
+        # create the environment and scenario classes for a figure eight
+        env, self.scenario = figure_eight_exp_setup()
+
+    def tearDown(self):
+        # free data used by the class
+        self.scenario = None
+
+    def test_vectorized_get_x_get_edge(self):
+        topology = self.scenario.topology
+        edges = ["bottom_lower_ring", ":bottom_lower_ring"]
+        positions = [4.72, 0.1]
+        edge_ids = [topology.edge_index[edge] for edge in edges]
+
+        np.testing.assert_array_almost_equal(
+            topology.get_x_array(edge_ids, positions),
+            [self.scenario.get_x(e, p) for e, p in zip(edges, positions)])
+
+        ids, rel_pos = topology.get_edge_array([5, 0.1])
+        self.assertListEqual([topology.edge_ids[i] for i in ids], edges)
+        np.testing.assert_array_almost_equal(rel_pos, positions)
+
+    def test_next_prev_edge(self):
+        edges = {"a": {"lanes": 1, "speed": 30, "length": 10},
+                 "b": {"lanes": 2, "speed": 30, "length": 10}}
+        connections = {"next": {"a": {0: [("b", 0), ("b", 1)]},
+                                "b": {2: [("a", 0)]}},
+                       "prev": {"b": {0: [("a", 0)], 1: [("a", 0)]}}}
+
+        # connections of lanes that do not exist are not silently dropped
+        with self.assertWarns(UserWarning):
+            topology = NetworkTopology(edges, connections)
+
+        self.assertListEqual(topology.next_edge("a", 0), [("b", 0), ("b", 1)])
+        self.assertListEqual(topology.next_edge("b", 2), [("a", 0)])
+        self.assertListEqual(topology.prev_edge("b", 1), [("a", 0)])
+        self.assertListEqual(topology.prev_edge("a", 0), [])
+        self.assertListEqual(topology.next_edge("c", 0), [])
+
+
 class TestEvenStartPos(unittest.TestCase):
     """
     Tests the function gen_even_start_pos in base_scenario.py. This function
@@ -548,6 +597,21 @@ class TestEvenStartPosVariableLanes(unittest.TestCase):
         lanes = self.env.vehicles.get_lane(self.env.vehicles.get_ids())
         self.assertFalse(any(i not in lanes for i in range(4)))
 
+    def test_start_pos_bounds(self):
+        """
+        Ensure that the generated positions and lanes are within the edges
+        the vehicles are placed on.
+        """
+        scenario = self.env.scenario
+        startpos, startlanes = scenario.generate_starting_positions(
+            num_vehicles=50)
+        self.assertEqual(len(startpos), 50)
+        for (edge, pos), lane in zip(startpos, startlanes):
+            self.assertIn(edge, scenario.get_edge_list())
+            self.assertLess(lane, scenario.num_lanes(edge))
+            self.assertGreaterEqual(pos, 0)
+            self.assertLessEqual(pos, scenario.edge_length(edge))
+
 
 class TestRandomStartPosVariableLanes(TestEvenStartPosVariableLanes):
     def setUp(self):
@@ -814,5 +878,108 @@ class TestNextPrevEdge(unittest.TestCase):
         self.assertTrue(len(prev_edge) == 0)
 
 
+class TestImportEdgesFromNet(unittest.TestCase):
+    """
+    Tests that the edges and connections imported from the .net.xml file of
+    a scenario are identical when loaded from the binary sidecar file.
+    """
+
+    def setUp(self):
+        # create the environment and scenario classes for a figure eight
+        env, self.scenario = figure_eight_exp_setup()
+        self.sidecar = os.path.join(
+            self.scenario.cfg_path,
+            self.scenario.netfn + NET_SIDECAR_SUFFIX)
+
+    def tearDown(self):
+        if os.path.isfile(self.sidecar):
+            os.remove(self.sidecar)
+        # free data used by the class
+        self.scenario = None
+
+    def test_sidecar(self):
+        expected = self.scenario._import_edges_from_net()
+        self.assertFalse(os.path.isfile(self.sidecar))
+        self.assertEqual(expected,
+                         (self.scenario._edges, self.scenario._connections))
+
+        # the first import writes the sidecar, and the second one loads it
+        self.scenario.net_params.cache_net = True
+        self.assertEqual(self.scenario._import_edges_from_net(), expected)
+        self.assertTrue(os.path.isfile(self.sidecar))
+        self.assertEqual(self.scenario._import_edges_from_net(), expected)
+
+
+class TestTiledScenario(unittest.TestCase):
+    """
+    Tests that the replicas of a tiled scenario are disjoint copies of the
+    base scenario, each containing the vehicles of a single replica.
+    """
+
+    def setUp(self):
+        vehicles = Vehicles()
+        vehicles.add(
+            veh_id="idm",
+            acceleration_controller=(IDMController, {}),
+            routing_controller=(ContinuousRouter, {}),
+            num_vehicles=4)
+
+        additional_net_params = {
+            "length": 230,
+            "lanes": 1,
+            "speed_limit": 30,
+            "resolution": 40,
+            "scenario": "LoopScenario",
+            "num_replicas": 3,
+            "replica_spacing": 50
+        }
+        net_params = NetParams(additional_params=additional_net_params)
+
+        self.scenario = TiledScenario(
+            name="TiledTest",
+            vehicles=vehicles,
+            net_params=net_params,
+            initial_config=InitialConfig())
+
+    def tearDown(self):
+        self.scenario.close()
+        # free data used by the class
+        self.scenario = None
+
+    def test_edges(self):
+        base = self.scenario.base
+        self.assertCountEqual(
+            self.scenario.get_edge_list(),
+            ["r%d_%s" % (k, edge) for k in range(3)
+             for edge in base.get_edge_list()])
+
+        for edge in base.get_edge_list():
+            for k in range(3):
+                tiled_edge = self.scenario.prefix(k, edge)
+                self.assertEqual(self.scenario.get_replica(tiled_edge), k)
+                self.assertEqual(self.scenario.get_base_edge(tiled_edge),
+                                 edge)
+                self.assertAlmostEqual(
+                    self.scenario.edge_length(tiled_edge),
+                    base.edge_length(edge))
+                self.assertAlmostEqual(
+                    self.scenario.get_x(tiled_edge, 1),
+                    base.get_x(edge, 1) + k * self.scenario.replica_length)
+
+        self.assertIsNone(self.scenario.get_replica(""))
+
+    def test_starting_positions(self):
+        self.assertEqual(self.scenario.vehicles.num_vehicles, 12)
+
+        base_pos, base_lanes = self.scenario.base.generate_starting_positions()
+        pos, lanes = self.scenario.generate_starting_positions()
+        self.assertEqual(len(pos), 12)
+        for i, ((edge, x), lane) in enumerate(zip(pos, lanes)):
+            k, j = divmod(i, 4)
+            self.assertEqual(edge, self.scenario.prefix(k, base_pos[j][0]))
+            self.assertAlmostEqual(x, base_pos[j][1])
+            self.assertEqual(lane, base_lanes[j])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -3,16 +3,30 @@ import csv
 import os
 import json
 import collections
+import threading
+from multiprocessing import AuthenticationError
+import numpy as np
+from xml.etree import ElementTree
 
 from flow.core.vehicles import Vehicles
 from flow.core.traffic_lights import TrafficLights
 from flow.controllers import IDMController, ContinuousRouter, RLController
 from flow.core.params import SumoParams, EnvParams, NetParams, InitialConfig, \
     InFlows
-from flow.core.util import emission_to_csv
+from flow.core.util import emission_to_csv, makexml, printxml, writexml, E, \
+    save_net_topology, load_net_topology
+from flow.core.restart import RestartPolicy
+from flow.core.agent_slots import AgentSlots
+from flow.core.traci_replay import TraCIRecorder, TraCIReplay
+from flow.utils.env_server import EnvServer, EnvClient, pack_message, \
+    unpack_message
+from tests.setup_scripts import ring_road_exp_setup
 from flow.utils.flow_warnings import deprecation_warning
 from flow.utils.registry import make_create_env
 from flow.utils.rllib import FlowParamsEncoder, get_flow_params
+from flow.scenarios.openstreetmap import clip_osm
+from flow.scenarios.loop import ADDITIONAL_NET_PARAMS as LOOP_PARAMS
+from flow.envs.loop.loop_accel import ADDITIONAL_ENV_PARAMS as ACCEL_PARAMS
 
 os.environ["TEST_FLAG"] = "True"
 
@@ -56,6 +70,144 @@ class TestEmissionToCSV(unittest.TestCase):
         self.assertEqual(len(dict1), 104)
 
 
+class TestWriteXML(unittest.TestCase):
+    """Tests that streamed xml files match the files written by printxml."""
+
+    def test_writexml(self):
+        current_path = os.path.realpath(__file__).rsplit("/", 1)[0]
+        nodes = [{"id": "center{}".format(i), "x": repr(float(i)), "y": "0"}
+                 for i in range(3)]
+        nsl = "http://sumo.dlr.de/xsd/nodes_file.xsd"
+
+        streamed = current_path + "/test_files/streamed.nod.xml"
+        printed = current_path + "/test_files/printed.nod.xml"
+        writexml(streamed, "nodes", nsl,
+                 (E("node", attrib=node) for node in nodes))
+        x = makexml("nodes", nsl)
+        for node in nodes:
+            x.append(E("node", attrib=node))
+        printxml(x, printed)
+
+        try:
+            roots = [ElementTree.parse(fn).getroot()
+                     for fn in [streamed, printed]]
+            self.assertEqual(roots[0].tag, roots[1].tag)
+            self.assertEqual(roots[0].attrib, roots[1].attrib)
+            self.assertEqual([node.attrib for node in roots[0]], nodes)
+            self.assertEqual([node.attrib for node in roots[1]], nodes)
+        finally:
+            os.remove(streamed)
+            os.remove(printed)
+
+
+class TestNetTopology(unittest.TestCase):
+    """Tests the indexed storage of the topology of networks."""
+
+    def setUp(self):
+        current_path = os.path.realpath(__file__).rsplit("/", 1)[0]
+        self.path = current_path + "/test_files/test.topology"
+        self.net_data = {
+            "a": {"lanes": 1, "speed": 30, "length": 10},
+            "b": {"lanes": 2, "speed": 30, "length": 20},
+            "c": {"lanes": 1, "speed": 15, "length": 30},
+            ":j_0": {"lanes": 1, "speed": 30, "length": 5},
+            ":k_0": {"lanes": 1, "speed": 15, "length": 5},
+            ":k_1": {"lanes": 1, "speed": 15, "length": 5},
+        }
+        self.connection_data = {
+            "next": {"a": {0: [(":j_0", 0)]},
+                     ":j_0": {0: [("b", 0)]},
+                     "b": {1: [(":k_0", 0)]},
+                     ":k_0": {0: [(":k_1", 0)]},
+                     ":k_1": {0: [("c", 0)]}},
+            "prev": {":j_0": {0: [("a", 0)]},
+                     "b": {0: [(":j_0", 0)]},
+                     ":k_0": {0: [("b", 1)]},
+                     ":k_1": {0: [(":k_0", 0)]},
+                     "c": {0: [(":k_1", 0)]}},
+        }
+        save_net_topology(self.path, self.net_data, self.connection_data)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_load_all(self):
+        net_data, connection_data = load_net_topology(self.path)
+        self.assertEqual(net_data, self.net_data)
+        self.assertEqual(connection_data, self.connection_data)
+
+    def test_load_subset(self):
+        # the junction in between the two edges is loaded as well, and the
+        # connections to the other edges are discarded
+        net_data, connection_data = load_net_topology(
+            self.path, edges=["a", "b"])
+        self.assertEqual(sorted(net_data), [":j_0", "a", "b"])
+        self.assertEqual(connection_data, {
+            "next": {"a": {0: [(":j_0", 0)]}, ":j_0": {0: [("b", 0)]}},
+            "prev": {":j_0": {0: [("a", 0)]}, "b": {0: [(":j_0", 0)]}}})
+
+        # chains of junctions are only loaded if they lead to a requested
+        # edge
+        net_data, connection_data = load_net_topology(
+            self.path, edges=["b", "c"])
+        self.assertEqual(sorted(net_data), [":k_0", ":k_1", "b", "c"])
+        self.assertEqual(connection_data, {
+            "next": {"b": {1: [(":k_0", 0)]}, ":k_0": {0: [(":k_1", 0)]},
+                     ":k_1": {0: [("c", 0)]}},
+            "prev": {":k_0": {0: [("b", 1)]}, ":k_1": {0: [(":k_0", 0)]},
+                     "c": {0: [(":k_1", 0)]}}})
+
+        self.assertRaises(ValueError, load_net_topology, self.path,
+                          edges=["d"])
+
+
+class TestClipOSM(unittest.TestCase):
+    """Tests the clipping of OpenStreetMap files."""
+
+    def setUp(self):
+        current_path = os.path.realpath(__file__).rsplit("/", 1)[0]
+        self.osm_path = current_path + "/test_files/test.osm"
+        self.clipped_path = current_path + "/test_files/test.clipped.osm"
+        with open(self.osm_path, "w") as f:
+            f.write("""<?xml version='1.0' encoding='UTF-8'?>
+<osm version="0.6">
+  <bounds minlat="0" minlon="0" maxlat="1" maxlon="1"/>
+  <node id="1" lat="0.1" lon="0.1"/>
+  <node id="2" lat="0.2" lon="0.2"/>
+  <node id="3" lat="0.9" lon="0.9"/>
+  <node id="4" lat="0.95" lon="0.95"/>
+  <way id="10"><nd ref="1"/><nd ref="2"/><nd ref="3"/></way>
+  <way id="11"><nd ref="3"/><nd ref="4"/></way>
+  <relation id="20">
+    <member type="way" ref="10"/><member type="node" ref="2"/>
+  </relation>
+  <relation id="21">
+    <member type="way" ref="11"/><member type="way" ref="10"/>
+  </relation>
+</osm>""")
+
+    def tearDown(self):
+        os.remove(self.osm_path)
+        if os.path.isfile(self.clipped_path):
+            os.remove(self.clipped_path)
+
+    def get_ids(self):
+        root = ElementTree.parse(self.clipped_path).getroot()
+        return {tag: [elem.attrib["id"] for elem in root.iter(tag)]
+                for tag in ["node", "way", "relation"]}
+
+    def test_bbox(self):
+        # ways crossing the bounding box are kept with all their nodes
+        clip_osm(self.osm_path, self.clipped_path, bbox=(0, 0, 0.5, 0.5))
+        self.assertEqual(self.get_ids(), {
+            "node": ["1", "2", "3"], "way": ["10"], "relation": ["20"]})
+
+    def test_ways(self):
+        clip_osm(self.osm_path, self.clipped_path, ways={"11"})
+        self.assertEqual(self.get_ids(), {
+            "node": ["3", "4"], "way": ["11"], "relation": []})
+
+
 class TestWarnings(unittest.TestCase):
     """Tests warning functions located in flow.utils.warnings"""
 
@@ -331,5 +483,288 @@ class TestRllib(unittest.TestCase):
                                      flow_params["veh"].__dict__))
 
 
+class TestRestartPolicy(unittest.TestCase):
+    """Tests the decisions of the adaptive sumo restart policy."""
+
+    def run_episode(self, policy, latency, memory=None, num_steps=10):
+        for _ in range(num_steps):
+            policy.record_step(latency)
+        return policy.end_episode(memory)
+
+    def test_latency(self):
+        policy = RestartPolicy(threshold=0.5)
+
+        # episodes without steps are ignored
+        self.assertFalse(policy.end_episode())
+        self.assertIsNone(policy.baseline_latency)
+
+        # the first episode provides the baseline
+        self.assertFalse(self.run_episode(policy, 0.01))
+        self.assertAlmostEqual(policy.baseline_latency, 0.01)
+
+        # small drifts are tolerated, large ones lead to a restart
+        self.assertFalse(self.run_episode(policy, 0.014))
+        self.assertTrue(self.run_episode(policy, 0.016))
+        self.assertAlmostEqual(policy.last_latency, 0.016)
+
+        # a new baseline is measured after a restart
+        policy.reset()
+        self.assertIsNone(policy.baseline_latency)
+        self.assertFalse(self.run_episode(policy, 0.016))
+        self.assertFalse(self.run_episode(policy, 0.02))
+
+    def test_memory(self):
+        policy = RestartPolicy(threshold=0.5)
+        self.assertFalse(self.run_episode(policy, 0.01, memory=1000))
+        self.assertEqual(policy.baseline_memory, 1000)
+        self.assertFalse(self.run_episode(policy, 0.01, memory=1400))
+        self.assertFalse(self.run_episode(policy, 0.01, memory=None))
+        self.assertTrue(self.run_episode(policy, 0.01, memory=1600))
+
+    def test_invalid_threshold(self):
+        self.assertRaises(ValueError, RestartPolicy, threshold=0)
+
+
+class TestEnvServer(unittest.TestCase):
+    """Tests the local environment server and its gym-compatible clients."""
+
+    def test_pack_message(self):
+        message = {"obs": [np.arange(6.).reshape(2, 3), np.zeros(0)],
+                   "rew": (1.5, np.array([1, 2], dtype=np.int32)),
+                   "done": False}
+        unpacked = unpack_message(pack_message(message))
+        np.testing.assert_array_equal(unpacked["obs"][0], message["obs"][0])
+        self.assertEqual(unpacked["obs"][1].shape, (0,))
+        self.assertEqual(unpacked["rew"][0], 1.5)
+        self.assertEqual(unpacked["rew"][1].dtype, np.int32)
+        self.assertFalse(unpacked["done"])
+
+    def test_server(self):
+        envs = [ring_road_exp_setup()[0] for _ in range(2)]
+        server = EnvServer(envs, address=("localhost", 0))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        client = EnvClient(server.address, server.authkey)
+        env_a, env_b = client.make_envs(2)
+        self.assertEqual(env_a.observation_space.shape,
+                         envs[0].observation_space.shape)
+
+        # single and batched requests
+        obs = env_a.reset()
+        self.assertEqual(obs.shape, envs[0].observation_space.shape)
+        client.reset([env_b])
+        env_a.step([])
+        results = client.step([env_a, env_b], [[], []])
+        self.assertEqual(len(results), 2)
+        self.assertEqual(envs[0].time_counter, 2)
+        self.assertEqual(envs[1].time_counter, 1)
+
+        # environments that are reserved cannot be used by other clients
+        other_client = EnvClient(server.address, server.authkey)
+        self.assertRaises(RuntimeError, other_client.make_envs, 1)
+        self.assertRaises(RuntimeError, other_client.step, [env_a], [[]])
+
+        # released environments can be reserved again
+        env_a.close()
+        self.assertEqual(len(other_client.make_envs(1)), 1)
+
+        client.close()
+        other_client.shutdown_server()
+        thread.join()
+
+    def test_authkey(self):
+        # servers use a random key by default, that clients must provide
+        server = EnvServer([], address=("localhost", 0))
+        other_server = EnvServer([], address=("localhost", 0))
+        self.assertEqual(len(server.authkey), 32)
+        self.assertNotEqual(server.authkey, other_server.authkey)
+        other_server.shutdown()
+
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.assertRaises(AuthenticationError, EnvClient, server.address,
+                          b"flow")
+
+        # the server keeps serving clients with the right key
+        client = EnvClient(server.address, server.authkey)
+        self.assertEqual(client.make_envs(0), [])
+        client.shutdown_server()
+        thread.join()
+
+    def test_from_flow_params(self):
+        vehicles = Vehicles()
+        vehicles.add("human", acceleration_controller=(IDMController, {}),
+                     routing_controller=(ContinuousRouter, {}),
+                     num_vehicles=4)
+        flow_params = dict(
+            exp_tag="ring",
+            env_name="AccelEnv",
+            scenario="LoopScenario",
+            sumo=SumoParams(sim_step=0.1, render=False),
+            env=EnvParams(additional_params=ACCEL_PARAMS.copy()),
+            net=NetParams(additional_params=LOOP_PARAMS.copy()),
+            veh=vehicles,
+            initial=InitialConfig(),
+        )
+        server = EnvServer.from_flow_params(flow_params, 2,
+                                            address=("localhost", 0))
+        env_a, env_b = server.envs
+
+        # every environment has its own parameters, vehicles, and sumo
+        # instance
+        self.assertIsNot(env_a.sumo_params, env_b.sumo_params)
+        self.assertNotEqual(env_a.sumo_params.port, env_b.sumo_params.port)
+        self.assertIsNot(env_a.vehicles, env_b.vehicles)
+        self.assertIsNot(env_a.scenario, env_b.scenario)
+
+        # the environments are stepped independently
+        env_a.reset()
+        env_b.reset()
+        for _ in range(5):
+            env_a.step([])
+        self.assertEqual(env_a.time_counter, 5)
+        self.assertEqual(env_b.time_counter, 0)
+        self.assertEqual(env_b.vehicles.get_speed("human_0"), 0)
+        self.assertGreater(env_a.vehicles.get_speed("human_0"), 0)
+        env_b.step([])
+        self.assertEqual(env_a.time_counter, 5)
+        self.assertEqual(env_b.time_counter, 1)
+
+        server.shutdown()
+
+
+class TestAgentSlots(unittest.TestCase):
+    """Tests the assignment of rl vehicles to fixed slots."""
+
+    def test_sync(self):
+        slots = AgentSlots(2)
+        slots.sync(["a", "b", "c"])
+        self.assertEqual(slots.items(), [(0, "a"), (1, "b")])
+        self.assertEqual(slots.get_queued_ids(), ["c"])
+
+        # remaining vehicles keep their slot, and queued vehicles take the
+        # slots of exiting vehicles
+        slots.sync(["b", "c", "d"])
+        self.assertEqual(slots.items(), [(0, "c"), (1, "b")])
+        self.assertEqual(slots.get_queued_ids(), ["d"])
+
+        slots.sync(["b"])
+        self.assertEqual(slots.items(), [(1, "b")])
+        np.testing.assert_array_equal(slots.mask, [False, True])
+        self.assertEqual(len(slots), 1)
+        self.assertIn("b", slots)
+
+        slots.clear()
+        self.assertEqual(slots.get_ids(), [])
+
+    def test_reserve(self):
+        slots = AgentSlots(3)
+        slots.reserve("a", 1)
+        self.assertRaises(ValueError, slots.reserve, "b", 1)
+
+        slots.sync(["b", "a"])
+        self.assertEqual(slots.get_slot("a"), 1)
+        self.assertEqual(slots.get_slot("b"), 0)
+
+        # reserved slots are not given to other vehicles
+        slots.sync(["b", "c", "d"])
+        self.assertEqual(slots.items(), [(0, "b"), (2, "c")])
+        self.assertEqual(slots.get_queued_ids(), ["d"])
+        slots.sync(["b", "c", "d", "a"])
+        self.assertEqual(slots.get_slot("a"), 1)
+
+    def test_buffers(self):
+        slots = AgentSlots(3)
+        slots.sync(["a", "b"])
+        slots.sync(["b"])
+
+        obs = slots.pad(np.ones((3, 2)), 0)
+        np.testing.assert_array_equal(obs, [[0, 0], [1, 1], [0, 0]])
+
+        rl_ids, actions = slots.split_actions(np.arange(6), 2)
+        self.assertEqual(rl_ids, ["b"])
+        np.testing.assert_array_equal(actions, [[2, 3]])
+
+        # vehicles that exited since the last sync are skipped
+        slots.sync(["b", "c"])
+        rl_ids, actions = slots.split_actions(np.arange(6), 2, ["c"])
+        self.assertEqual(rl_ids, ["c"])
+        np.testing.assert_array_equal(actions, [[0, 1]])
+
+
+class TestTraCIReplay(unittest.TestCase):
+    """Tests the recording and replay of TraCI connections."""
+
+    def setUp(self):
+        current_path = os.path.realpath(__file__).rsplit("/", 1)[0]
+        self.path = current_path + "/test_files/test.traci"
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_replay_env(self):
+        """Check that a replayed rollout matches the recorded one."""
+        def rollout(sumo_params):
+            np.random.seed(0)
+            env, _ = ring_road_exp_setup(sumo_params=sumo_params)
+            env.reset()
+            states = [env.step(None)[0] for _ in range(20)]
+            positions = env.vehicles.get_position(env.vehicles.get_ids())
+            env.terminate()
+            return states, positions
+
+        states, positions = rollout(
+            SumoParams(sim_step=0.1, traci_record=self.path))
+        replayed_states, replayed_positions = rollout(
+            SumoParams(sim_step=0.1, traci_replay=self.path))
+
+        np.testing.assert_array_almost_equal(states, replayed_states)
+        np.testing.assert_array_almost_equal(positions, replayed_positions)
+
+    def test_requests(self):
+        """Check the matching of requests to the recording."""
+        class Vehicle:
+            def __init__(self):
+                self.speeds = {"a": 1, "b": 2}
+
+            def getSpeed(self, veh_id):
+                return self.speeds[veh_id]
+
+            def setSpeed(self, veh_id, speed):
+                self.speeds[veh_id] = speed
+
+        class Connection:
+            def __init__(self):
+                self.vehicle = Vehicle()
+
+            def close(self):
+                pass
+
+        recorder = TraCIRecorder(Connection(), self.path)
+        recorder.vehicle.getSpeed("a")
+        recorder.vehicle.setSpeed("a", 5)
+        recorder.vehicle.getSpeed("a")
+        recorder.vehicle.getSpeed("b")
+        self.assertRaises(KeyError, recorder.vehicle.getSpeed, "c")
+        recorder.close()
+
+        # responses are served by request, in the order they were recorded
+        replay = TraCIReplay(self.path)
+        self.assertEqual(replay.vehicle.getSpeed("b"), 2)
+        self.assertEqual(replay.vehicle.getSpeed("a"), 1)
+        self.assertEqual(replay.vehicle.getSpeed("a"), 5)
+        self.assertRaises(KeyError, replay.vehicle.getSpeed, "c")
+
+        # unmatched requests are served the responses of the same method,
+        # unless the replay is strict
+        replay.rewind()
+        replay.vehicle.setSpeed("a", 10)
+        self.assertRaises(ValueError, replay.vehicle.setSpeed, "a", 5)
+        replay = TraCIReplay(self.path, strict=True)
+        self.assertRaises(ValueError, replay.vehicle.setSpeed, "a", 10)
+
+
 if __name__ == '__main__':
     unittest.main()
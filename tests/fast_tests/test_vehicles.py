@@ -2,13 +2,17 @@ import unittest
 import os
 import numpy as np
 
-from flow.core.vehicles import Vehicles
+import traci.constants as tc
+
+from flow.core.vehicles import Vehicles, RollingCounter
 from flow.core.params import SumoCarFollowingParams, NetParams, \
-    InitialConfig, SumoParams
+    InitialConfig, SumoParams, InFlows
 from flow.controllers.car_following_models import IDMController, \
     SumoCarFollowingController
-from flow.controllers.lane_change_controllers import StaticLaneChanger
+from flow.controllers.lane_change_controllers import StaticLaneChanger, \
+    SumoLaneChangeController
 from flow.controllers.rlcontroller import RLController
+from flow.controllers.routing_controllers import ContinuousRouter
 
 from tests.setup_scripts import ring_road_exp_setup, highway_exp_setup
 
@@ -172,6 +176,44 @@ class TestVehiclesClass(unittest.TestCase):
         self.assertEqual(vehicles.num_rl_vehicles, len(vehicles.get_rl_ids()))
 
 
+class TestSortByAbsolutePosition(unittest.TestCase):
+    """Tests that vehicles are sorted by absolute position across calls, as
+    vehicles overtake one another and leave the network."""
+
+    def test_sort_by_absolute_position(self):
+        vehicles = Vehicles()
+        vehicles.add("test", num_vehicles=4)
+        for veh_id, pos in zip(vehicles.get_ids(), [3, 1, 4, 2]):
+            vehicles.set_absolute_position(veh_id, pos)
+
+        self.assertListEqual(vehicles.sort_by_absolute_position(),
+                             ["test_1", "test_3", "test_0", "test_2"])
+
+        # a vehicle overtakes another, and another vehicle leaves
+        vehicles.set_absolute_position("test_1", 2.5)
+        vehicles.remove("test_2")
+        self.assertListEqual(vehicles.sort_by_absolute_position(),
+                             ["test_3", "test_1", "test_0"])
+
+
+class TestRollingCounter(unittest.TestCase):
+    """Tests the bounded running sums used to compute inflow and outflow
+    rates."""
+
+    def test_rolling_sums(self):
+        counter = RollingCounter(max_steps=4)
+        for count in [1, 2, 3, 4, 5, 6]:
+            counter.append(count)
+
+        # only the last four steps are kept
+        self.assertEqual(len(counter), 4)
+        self.assertEqual(counter.sum(1), 6)
+        self.assertEqual(counter.sum(2), 11)
+        self.assertEqual(counter.sum(4), 18)
+        self.assertEqual(counter.sum(10), 18)
+        self.assertEqual(counter.last, 6)
+
+
 class TestMultiLaneData(unittest.TestCase):
     """
     Tests the functions get_lane_leaders(), get_lane_followers(),
@@ -562,5 +604,232 @@ class TestObservedIDs(unittest.TestCase):
         self.assertCountEqual(vehicles.get_observed_ids(), ["test_1"])
 
 
+class TestSubscriptions(unittest.TestCase):
+    """Tests that vehicles are only subscribed to the variables needed by
+    their controllers and the environment."""
+
+    def test_type_subscriptions(self):
+        vehicles = Vehicles()
+        vehicles.add("human", acceleration_controller=(IDMController, {}),
+                     routing_controller=(ContinuousRouter, {}))
+        vehicles.add("sumo",
+                     acceleration_controller=(SumoCarFollowingController, {}))
+        vehicles.add("rl", acceleration_controller=(RLController, {}))
+
+        base = [tc.VAR_LANE_INDEX, tc.VAR_LANEPOSITION, tc.VAR_ROAD_ID,
+                tc.VAR_SPEED]
+
+        # the leader and route are needed by the IDM model and the router
+        self.assertCountEqual(vehicles.get_subscriptions("human"),
+                              base + [tc.VAR_LEADER, tc.VAR_EDGES])
+
+        # sumo and rl controlled vehicles only need the base variables
+        self.assertCountEqual(vehicles.get_subscriptions("sumo"), base)
+        self.assertCountEqual(vehicles.get_subscriptions("rl"), base)
+
+        # variables requested by the environment are added to all types
+        vehicles.set_env_subscriptions([tc.VAR_LEADER])
+        self.assertCountEqual(vehicles.get_subscriptions("human"),
+                              base + [tc.VAR_LEADER, tc.VAR_EDGES])
+        self.assertCountEqual(vehicles.get_subscriptions("rl"),
+                              base + [tc.VAR_LEADER])
+
+    def test_fail_safe_subscriptions(self):
+        vehicles = Vehicles()
+        vehicles.add("rl", acceleration_controller=(RLController, {}))
+        vehicles.add("rl_safe", acceleration_controller=(
+            RLController, {"fail_safe": "safe_velocity"}))
+
+        # the leader is only needed by rl vehicles with a failsafe
+        self.assertNotIn(tc.VAR_LEADER, vehicles.get_subscriptions("rl"))
+        self.assertIn(tc.VAR_LEADER, vehicles.get_subscriptions("rl_safe"))
+        self.assertEqual(vehicles.get_acc_controller("rl_0").subscriptions,
+                         ())
+        self.assertEqual(
+            vehicles.get_acc_controller("rl_safe_0").subscriptions,
+            (tc.VAR_LEADER, ))
+
+    def test_default_speed(self):
+        """Ensures that the speeds sumo would apply without TraCI are
+        subscribed to by default."""
+        env, _ = ring_road_exp_setup()
+        env.reset()
+        env.step(rl_actions=[])
+
+        self.assertIn(tc.VAR_SPEED_WITHOUT_TRACI,
+                      env.vehicles.get_subscriptions("idm"))
+        self.assertNotEqual(env.vehicles.get_default_speed("idm_0"), -1001)
+
+        env.terminate()
+
+
+class _VehicleDomain:
+    """Vehicle domain of a TraCI connection counting the requests sent."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def method(veh_id, *args):
+            self.calls.append((name, veh_id))
+            if name == "getTypeID":
+                return "other"
+            if name == "getLength":
+                return 4.5
+        return method
+
+
+class _DepartureEnv:
+    """Environment attributes used when vehicles depart."""
+
+    def __init__(self, inflows, initial_state=None):
+        self.traci_connection = type("Connection", (), {})()
+        self.traci_connection.vehicle = _VehicleDomain()
+        self.scenario = type("Scenario", (), {})()
+        self.scenario.net_params = NetParams(inflows=inflows)
+        self.initial_state = initial_state or {}
+        self.time_counter = 1
+
+
+class TestDepartedVehicles(unittest.TestCase):
+    """Tests that departing vehicles are added with as few requests to sumo
+    as possible, and that arrived vehicles are removed from all id lists."""
+
+    def setUp(self):
+        self.vehicles = Vehicles()
+        self.vehicles.add("human",
+                          acceleration_controller=(IDMController, {}),
+                          routing_controller=(ContinuousRouter, {}),
+                          speed_mode="all_checks",
+                          lane_change_mode="strategic")
+        self.vehicles.add("rl", acceleration_controller=(RLController, {}),
+                          speed_mode="aggressive")
+        self.vehicles.add("other")
+
+        inflows = InFlows()
+        inflows.add(veh_type="human", edge="1", name="inflow")
+        inflows.add(veh_type="rl", edge="1", name="inflow")
+        self.env = _DepartureEnv(
+            inflows, initial_state={"human_0": ("human", "1", 0, 0, 0)})
+        self.calls = self.env.traci_connection.vehicle.calls
+
+    def test_departed_type(self):
+        vehicles = self.vehicles
+        env = self.env
+
+        # initial vehicles and vehicles from inflows do not query sumo
+        self.assertEqual(vehicles._get_departed_type("human_0", env), "human")
+        self.assertEqual(vehicles._get_departed_type("inflow_0.3", env),
+                         "human")
+        self.assertEqual(vehicles._get_departed_type("inflow_1.12", env),
+                         "rl")
+        self.assertListEqual(self.calls, [])
+
+        # other vehicles are queried from sumo
+        self.assertEqual(vehicles._get_departed_type("added", env), "other")
+        self.assertListEqual(self.calls, [("getTypeID", "added")])
+
+    def test_membership(self):
+        vehicles = Vehicles()
+        vehicles.add("human", acceleration_controller=(IDMController, {}),
+                     num_vehicles=5)
+        env, _ = ring_road_exp_setup(vehicles=vehicles)
+
+        # vehicles placed again in the network at a reset are already in the
+        # class, and are not added a second time
+        env.reset()
+        env.reset()
+        self.assertEqual(env.vehicles.num_vehicles, 5)
+        self.assertCountEqual(env.vehicles.get_ids(),
+                              ["human_%d" % i for i in range(5)])
+        env.terminate()
+
+    def test_length_cache(self):
+        vehicles = self.vehicles
+        vehicles._add_departed("inflow_0.0", "human", self.env)
+        vehicles._add_departed("inflow_0.1", "human", self.env)
+        vehicles._add_departed("inflow_1.0", "rl", self.env)
+
+        # the length is only requested once per type
+        lengths = [call for call in self.calls if call[0] == "getLength"]
+        self.assertListEqual(lengths, [("getLength", "inflow_0.0"),
+                                       ("getLength", "inflow_1.0")])
+        self.assertEqual(vehicles.get_length("inflow_0.1"), 4.5)
+
+    def test_default_modes(self):
+        vehicles = self.vehicles
+        vehicles._add_departed("inflow_0.0", "human", self.env)
+        vehicles._add_departed("inflow_1.0", "rl", self.env)
+        vehicles._add_departed("other_1", "other", self.env)
+
+        # only the modes that differ from sumo's defaults are sent
+        modes = [call for call in self.calls
+                 if call[0] in ["setSpeedMode", "setLaneChangeMode"]]
+        self.assertListEqual(modes, [("setSpeedMode", "inflow_1.0"),
+                                     ("setLaneChangeMode", "inflow_1.0"),
+                                     ("setSpeedMode", "other_1"),
+                                     ("setLaneChangeMode", "other_1")])
+        self.assertEqual(vehicles.get_speed_mode("inflow_0.0"), 31)
+        self.assertEqual(vehicles.get_lane_change_mode("inflow_0.0"), 1621)
+
+    def test_lazy_controllers(self):
+        vehicles = self.vehicles
+        vehicles._add_departed("inflow_0.0", "human", self.env)
+
+        # controllers are created the first time they are requested
+        state = vehicles._Vehicles__vehicles["inflow_0.0"]
+        self.assertNotIn("acc_controller", state)
+        self.assertNotIn("lane_changer", state)
+        controller = vehicles.get_acc_controller("inflow_0.0")
+        self.assertIsInstance(controller, IDMController)
+        self.assertEqual(controller.veh_id, "inflow_0.0")
+        self.assertIs(vehicles.get_acc_controller("inflow_0.0"), controller)
+        self.assertIsInstance(
+            vehicles.get_lane_changing_controller("inflow_0.0"),
+            SumoLaneChangeController)
+        self.assertIsInstance(vehicles.get_routing_controller("inflow_0.0"),
+                              ContinuousRouter)
+
+        # vehicles that are not in the network do not get controllers
+        self.assertIsNone(vehicles.get_acc_controller("inflow_0.1"))
+
+    def test_remove_many(self):
+        vehicles = Vehicles()
+        vehicles.add("human", acceleration_controller=(IDMController, {}),
+                     lane_change_controller=(StaticLaneChanger, {}),
+                     num_vehicles=3)
+        vehicles.add("rl", acceleration_controller=(RLController, {}),
+                     num_vehicles=12)
+
+        # rl ids are sorted, also as vehicles depart
+        self.assertListEqual(vehicles.get_rl_ids(),
+                             sorted(vehicles.get_rl_ids()))
+        vehicles._add_departed("rl_12", "rl", self.env)
+        self.assertListEqual(vehicles.get_rl_ids(),
+                             sorted(vehicles.get_rl_ids()))
+
+        vehicles._remove_many(["human_1", "rl_10", "rl_3"])
+
+        self.assertListEqual(vehicles.get_human_ids(), ["human_0", "human_2"])
+        self.assertListEqual(vehicles.get_controlled_ids(),
+                             ["human_0", "human_2"])
+        self.assertListEqual(vehicles.get_controlled_lc_ids(),
+                             ["human_0", "human_2"])
+        rl_ids = ["rl_%d" % i for i in range(13) if i not in [3, 10]]
+        self.assertListEqual(vehicles.get_rl_ids(), sorted(rl_ids))
+        self.assertCountEqual(vehicles.get_ids(),
+                              ["human_0", "human_2"] + rl_ids)
+        self.assertEqual(vehicles.num_vehicles, 13)
+        self.assertEqual(vehicles.num_rl_vehicles, 11)
+        self.assertIsNone(vehicles.get_state("rl_3", "type", error=None))
+
+        # removing no vehicles, or vehicles that were already removed,
+        # changes nothing
+        vehicles._remove_many([])
+        vehicles._remove_many(["human_1", "rl_3"])
+        self.assertEqual(vehicles.num_vehicles, 13)
+        self.assertEqual(vehicles.num_rl_vehicles, 11)
+
+
 if __name__ == '__main__':
     unittest.main()
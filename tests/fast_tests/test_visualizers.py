@@ -2,10 +2,15 @@
 # from flow.visualize.visualizer_rllab import visualizer_rllab
 from flow.visualize import visualizer_rllib as vs_rllib
 from flow.visualize.visualizer_rllib import visualizer_rllib
+from flow.visualize import trajectories
+from flow.core.util import emission_to_csv
 
 import os
+import pickle
 import unittest
+import numpy as np
 import ray
+from traci import constants as tc
 
 os.environ['TEST_FLAG'] = 'True'
 
@@ -49,6 +54,106 @@ class TestVisualizerRLlib(unittest.TestCase):
         visualizer_rllib(pass_args)
 
 
+class TestTrajectories(unittest.TestCase):
+    """Tests the trajectory analysis toolkit"""
+
+    def setUp(self):
+        current_path = os.path.realpath(__file__).rsplit('/', 1)[0]
+        self.xml_path = current_path + '/test_files/test-emission.xml'
+        self.csv_path = current_path + '/test_files/trajectories.csv'
+        emission_to_csv(self.xml_path, self.csv_path)
+
+        # the ring road of the emission file consists of four 50m edges
+        self.edge_starts = {'bottom': 0, 'right': 50, 'top': 100, 'left': 150}
+        self.edge_lengths = {edge: 50 for edge in self.edge_starts}
+
+    def tearDown(self):
+        os.remove(self.csv_path)
+
+    def test_readers(self):
+        """Check that emission files and their csv are read identically"""
+        xml_chunks = list(trajectories.read_trajectories(self.xml_path, 10))
+        csv_chunks = list(trajectories.read_trajectories(self.csv_path, 10))
+        self.assertTrue(all(len(c['time']) <= 10 for c in xml_chunks))
+
+        def rows(chunks):
+            return sorted(zip(*[np.concatenate([c[name] for c in chunks])
+                                for name, _ in trajectories.COLUMNS]))
+
+        self.assertEqual(len(rows(xml_chunks)), 104)
+        self.assertEqual(rows(xml_chunks), rows(csv_chunks))
+
+    def test_traci_recording(self):
+        """Check that vehicles are read from the subscriptions of a TraCI
+        recording"""
+        def vehicle(edge, lane, pos, speed):
+            return {tc.VAR_ROAD_ID: edge, tc.VAR_LANE_INDEX: lane,
+                    tc.VAR_LANEPOSITION: pos, tc.VAR_SPEED: speed}
+
+        # records are (domain, method, key, response, error) tuples, as
+        # written by flow.core.traci_replay.TraCIRecorder
+        records = [
+            ('vehicle', 'getSubscriptionResults', None, {
+                'a': vehicle('bottom', 0, 1., 2.),
+                'b': vehicle('right', 1, 3., 4.),
+                # vehicles without any position are skipped
+                'c': {tc.VAR_SPEED: 5.}}, None),
+            ('vehicle', 'setSpeed', None, None, None),
+            ('simulation', 'getSubscriptionResults', None,
+             {tc.VAR_TIME_STEP: 100}, None),
+            ('vehicle', 'getSubscriptionResults', None,
+             {'a': vehicle('bottom', 0, 1.5, 2.5)}, None),
+            ('simulation', 'getSubscriptionResults', None,
+             {tc.VAR_TIME_STEP: 200}, None),
+            # vehicles of a step whose time is unknown are not read
+            ('vehicle', 'getSubscriptionResults', None,
+             {'a': vehicle('right', 0, 0., 3.)}, None),
+        ]
+        current_path = os.path.realpath(__file__).rsplit('/', 1)[0]
+        path = current_path + '/test_files/trajectories.traci'
+        with open(path, 'wb') as f:
+            pickle.dump(records, f)
+
+        chunks = list(trajectories.read_trajectories(path, chunk_size=2))
+        os.remove(path)
+
+        self.assertEqual([len(c['time']) for c in chunks], [2, 1])
+        rows = list(zip(*[np.concatenate([c[name] for c in chunks])
+                          for name, _ in trajectories.COLUMNS]))
+        self.assertEqual(rows, [(0.1, 'a', 'bottom', 0, 1., 2.),
+                                (0.1, 'b', 'right', 1, 3., 4.),
+                                (0.2, 'a', 'bottom', 0, 1.5, 2.5)])
+
+    def test_aggregates(self):
+        """Check the conservation of the time spent by vehicles"""
+        sim_step = 0.1
+        # total time spent by vehicles in the network
+        total_time = 104 * sim_step
+
+        times, positions, speeds = trajectories.space_time_grid(
+            trajectories.read_emission_xml(self.xml_path, 10),
+            self.edge_starts, time_bin=0.5, space_bin=25)
+        np.testing.assert_array_almost_equal(times, [0, 0.5, 1])
+        np.testing.assert_array_almost_equal(positions, np.arange(8) * 25)
+        self.assertTrue(np.all(speeds >= 0))
+
+        edges, times, flow, density, speed = trajectories.edge_aggregates(
+            trajectories.read_emission_xml(self.xml_path, 10),
+            self.edge_lengths, sim_step, time_bin=1)
+        self.assertEqual(edges, ['bottom', 'left', 'right', 'top'])
+        self.assertEqual(flow.shape, (4, 2))
+        self.assertAlmostEqual(np.sum(density) * 50 / 1000, total_time)
+        np.testing.assert_array_almost_equal(
+            speed, flow / density / 3.6)
+
+        ids, travel_time, delay = trajectories.vehicle_delays(
+            trajectories.read_emission_xml(self.xml_path, 10), 30, sim_step)
+        self.assertEqual(len(ids), 8)
+        self.assertAlmostEqual(np.sum(travel_time), total_time)
+        self.assertTrue(np.all(delay >= 0))
+        self.assertTrue(np.all(delay <= travel_time))
+
+
 # class TestVisualizerRLlab(unittest.TestCase):
 #     """Tests visualizer_rllab"""
 #
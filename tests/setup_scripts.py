@@ -504,7 +504,8 @@ def setup_bottlenecks(sumo_params=None,
                       initial_config=None,
                       traffic_lights=None,
                       inflow=None,
-                      scaling=1):
+                      scaling=1,
+                      env_class=AccelEnv):
     """
     Create an environment and scenario pair for grid 1x1 test experiments.
 
@@ -531,6 +532,8 @@ def setup_bottlenecks(sumo_params=None,
         distributed vehicles across the length of the network
     traffic_lights: TrafficLights type
         specifies logic of any traffic lights added to the system
+    env_class: type, optional
+        environment class, defaults to AccelEnv
     """
     if sumo_params is None:
         # set default sumo_params configuration
@@ -593,7 +596,7 @@ def setup_bottlenecks(sumo_params=None,
         traffic_lights=traffic_lights)
 
     # create the environment
-    env = AccelEnv(
+    env = env_class(
         env_params=env_params, sumo_params=sumo_params, scenario=scenario)
 
     return env, scenario